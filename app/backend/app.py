@@ -5,6 +5,7 @@ import logging
 import mimetypes
 import os
 import json
+import time
 import urllib.parse
 from datetime import datetime, timedelta
 
@@ -13,7 +14,15 @@ from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from azure.core.credentials import AzureKeyCredential
 from azure.identity import DefaultAzureCredential, AzureAuthorityHosts
 from azure.mgmt.cognitiveservices import CognitiveServicesManagementClient
-from azure.search.documents import SearchClient
+from core.hedging import HedgedCall
+from core.openairouter import OpenAIEndpoint, OpenAIRouter
+from core.prefetch import FollowupPrefetcher
+from core.workingset import ConversationWorkingSet
+from core.searchcache import SearchResultCache
+from core.singleflight import SingleFlight
+from core.trafficrecorder import TrafficRecorder
+from core.usagemetrics import TokenUsageTracker
+from core.shardedsearch import ShardedSearchClient
 from azure.storage.blob import (
     AccountSasPermissions,
     BlobServiceClient,
@@ -21,6 +30,8 @@ from azure.storage.blob import (
     generate_account_sas,
 )
 from flask import Flask, jsonify, request
+from shared_code.index_shards import IndexShardRouter
+from shared_code.index_watermark import IndexWatermark
 from shared_code.status_log import State, StatusClassification, StatusLog
 from shared_code.tags_helper import TagsHelper
 
@@ -38,6 +49,8 @@ AZURE_SEARCH_SERVICE = os.environ.get("AZURE_SEARCH_SERVICE") or "gptkb"
 AZURE_SEARCH_SERVICE_ENDPOINT = os.environ.get("AZURE_SEARCH_SERVICE_ENDPOINT")
 AZURE_SEARCH_SERVICE_KEY = os.environ.get("AZURE_SEARCH_SERVICE_KEY")
 AZURE_SEARCH_INDEX = os.environ.get("AZURE_SEARCH_INDEX") or "gptkbindex"
+AZURE_SEARCH_INDEX_SHARD_COUNT = int(os.environ.get("AZURE_SEARCH_INDEX_SHARD_COUNT") or 1)
+AZURE_SEARCH_INDEX_SHARD_ROUTING = os.environ.get("AZURE_SEARCH_INDEX_SHARD_ROUTING") or "folder"
 AZURE_OPENAI_SERVICE = os.environ.get("AZURE_OPENAI_SERVICE") or "myopenai"
 AZURE_OPENAI_RESOURCE_GROUP = os.environ.get("AZURE_OPENAI_RESOURCE_GROUP") or ""
 AZURE_OPENAI_CHATGPT_DEPLOYMENT = (
@@ -45,6 +58,17 @@ AZURE_OPENAI_CHATGPT_DEPLOYMENT = (
 )
 AZURE_OPENAI_CHATGPT_MODEL_NAME = ( os.environ.get("AZURE_OPENAI_CHATGPT_MODEL_NAME") or "")
 AZURE_OPENAI_CHATGPT_MODEL_VERSION = ( os.environ.get("AZURE_OPENAI_CHATGPT_MODEL_VERSION") or "")
+# Optional smaller deployment for the keyword query rewrite, defaults to the chat deployment
+AZURE_OPENAI_REWRITE_DEPLOYMENT = ( os.environ.get("AZURE_OPENAI_REWRITE_DEPLOYMENT") or "")
+AZURE_OPENAI_REWRITE_MODEL_NAME = ( os.environ.get("AZURE_OPENAI_REWRITE_MODEL_NAME") or "")
+# First-turn questions of at most this many words that need no rewriting are searched as asked, 0 disables
+QUERY_REWRITE_SKIP_MAX_WORDS = int(os.environ.get("QUERY_REWRITE_SKIP_MAX_WORDS") or 6)
+# Optional extra Azure OpenAI deployments of the chat model to spread completions across, e.g.
+# [{"service": "myopenai-eastus", "key": "...", "deployment": "gpt-4", "tokens_per_minute": 80000,
+#   "rewrite_deployment": "gpt-35-turbo", "rewrite_tokens_per_minute": 120000}]
+# The service and deployment above are always included.
+AZURE_OPENAI_CHAT_ENDPOINTS = json.loads(os.environ.get("AZURE_OPENAI_CHAT_ENDPOINTS") or "[]")
+AZURE_OPENAI_CHATGPT_TOKENS_PER_MINUTE = int(os.environ.get("AZURE_OPENAI_CHATGPT_TOKENS_PER_MINUTE") or 0)
 USE_AZURE_OPENAI_EMBEDDINGS = str_to_bool.get(os.environ.get("USE_AZURE_OPENAI_EMBEDDINGS").lower()) or False
 EMBEDDING_DEPLOYMENT_NAME = ( os.environ.get("EMBEDDING_DEPLOYMENT_NAME") or "")
 AZURE_OPENAI_EMBEDDINGS_MODEL_NAME = ( os.environ.get("AZURE_OPENAI_EMBEDDINGS_MODEL_NAME") or "")
@@ -75,6 +99,33 @@ QUERY_TERM_LANGUAGE = os.environ.get("QUERY_TERM_LANGUAGE") or "English"
 TARGET_EMBEDDING_MODEL = os.environ.get("TARGET_EMBEDDINGS_MODEL") or "BAAI/bge-small-en-v1.5"
 ENRICHMENT_APPSERVICE_NAME = os.environ.get("ENRICHMENT_APPSERVICE_NAME") or "enrichment"
 
+CHAT_REQUEST_DEADLINE_SECONDS = float(os.environ.get("CHAT_REQUEST_DEADLINE_SECONDS") or 60)
+ENABLE_REQUEST_HEDGING = str_to_bool.get((os.environ.get("ENABLE_REQUEST_HEDGING") or "false").lower()) or False
+REQUEST_HEDGING_BUDGET_PERCENT = float(os.environ.get("REQUEST_HEDGING_BUDGET_PERCENT") or 5)
+# Attempts that can be hedged at once per process, calls beyond it run unhedged on their own thread.
+# Twice the requests a server process handles at once lets every call be hedged
+REQUEST_HEDGING_MAX_WORKERS = int(os.environ.get("REQUEST_HEDGING_MAX_WORKERS") or 32)
+# Optional cost per 1,000 tokens by model name, e.g. {"gpt-4": {"prompt": 0.03, "completion": 0.06}}
+MODEL_TOKEN_PRICES = json.loads(os.environ.get("MODEL_TOKEN_PRICES") or "{}")
+# Opt-in capture of the shape of /chat traffic for replay, see tests/replay_chat_traffic.py
+CHAT_TRAFFIC_RECORD_PATH = os.environ.get("CHAT_TRAFFIC_RECORD_PATH") or ""
+CHAT_TRAFFIC_RECORD_SAMPLE_RATE = float(os.environ.get("CHAT_TRAFFIC_RECORD_SAMPLE_RATE") or 1.0)
+CHAT_TRAFFIC_RECORD_TEXT = str_to_bool.get((os.environ.get("CHAT_TRAFFIC_RECORD_TEXT") or "false").lower()) or False
+SEARCH_CACHE_TTL_SECONDS = float(os.environ.get("SEARCH_CACHE_TTL_SECONDS") or 120)
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES") or 1000)
+INDEX_WATERMARK_BLOB_NAME = os.environ.get("INDEX_WATERMARK_BLOB_NAME") or "_index/watermark.json"
+INDEX_WATERMARK_REFRESH_SECONDS = float(os.environ.get("INDEX_WATERMARK_REFRESH_SECONDS") or 10)
+# Retrieve suggested follow-up questions in the background, costs a rewrite and a search per suggestion
+ENABLE_FOLLOWUP_PREFETCH = str_to_bool.get((os.environ.get("ENABLE_FOLLOWUP_PREFETCH") or "false").lower()) or False
+FOLLOWUP_PREFETCH_TTL_SECONDS = float(os.environ.get("FOLLOWUP_PREFETCH_TTL_SECONDS") or 300)
+# Chunks each conversation has retrieved, so later turns only download content they have not seen, 0 disables
+CONVERSATION_WORKING_SET_TTL_SECONDS = float(os.environ.get("CONVERSATION_WORKING_SET_TTL_SECONDS") or 1800)
+CONVERSATION_WORKING_SET_MAX_CONVERSATIONS = int(os.environ.get("CONVERSATION_WORKING_SET_MAX_CONVERSATIONS") or 1000)
+# Share of a turn's hits the conversation must already hold for its next turn to rank without content
+CONVERSATION_WORKING_SET_MIN_REUSE = float(os.environ.get("CONVERSATION_WORKING_SET_MIN_REUSE") or 0.5)
+# Identical /chat requests arriving while one is in flight share its answer, off unless enabled
+ENABLE_CHAT_COALESCING = str_to_bool.get((os.environ.get("ENABLE_CHAT_COALESCING") or "false").lower()) or False
+
 # embedding_service_suffix = "xyoek"
 
 # Used by the OpenAI SDK
@@ -111,10 +162,14 @@ tagsHelper = TagsHelper(
 openai.api_key = AZURE_OPENAI_SERVICE_KEY
 
 # Set up clients for Cognitive Search and Storage
-search_client = SearchClient(
+# The index may be split into shards, the client fans queries out across them
+search_client = ShardedSearchClient(
     endpoint=AZURE_SEARCH_SERVICE_ENDPOINT,
-    index_name=AZURE_SEARCH_INDEX,
     credential=azure_search_key_credential,
+    router=IndexShardRouter(
+        AZURE_SEARCH_INDEX,
+        AZURE_SEARCH_INDEX_SHARD_COUNT,
+        AZURE_SEARCH_INDEX_SHARD_ROUTING),
 )
 blob_client = BlobServiceClient(
     account_url=AZURE_BLOB_STORAGE_ENDPOINT,
@@ -122,14 +177,26 @@ blob_client = BlobServiceClient(
 )
 blob_container = blob_client.get_container_client(AZURE_BLOB_STORAGE_CONTAINER)
 
+# Repeated searches are served from memory until the TTL expires or the
+# indexing pipeline publishes a new index watermark
+index_watermark = IndexWatermark(blob_container, INDEX_WATERMARK_BLOB_NAME)
+search_cache = SearchResultCache(
+    ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    watermark=index_watermark,
+    watermark_refresh_seconds=INDEX_WATERMARK_REFRESH_SECONDS,
+)
+
 model_name = ''
 model_version = ''
+rewrite_model_name = ''
 
 # Python issue Logged > https://github.com/Azure/azure-sdk-for-python/issues/34337
 # Once fixed, this If statement can be removed. 
 if (IS_GOV_CLOUD_DEPLOYMENT):
     model_name = AZURE_OPENAI_CHATGPT_MODEL_NAME
     model_version = AZURE_OPENAI_CHATGPT_MODEL_VERSION
+    rewrite_model_name = AZURE_OPENAI_REWRITE_MODEL_NAME
     embedding_model_name = AZURE_OPENAI_EMBEDDINGS_MODEL_NAME
     embedding_model_version = AZURE_OPENAI_EMBEDDINGS_VERSION
 else:
@@ -146,6 +213,14 @@ else:
     model_name = deployment.properties.model.name
     model_version = deployment.properties.model.version
 
+    if AZURE_OPENAI_REWRITE_DEPLOYMENT:
+        rewrite_deployment = openai_mgmt_client.deployments.get(
+            resource_group_name=AZURE_OPENAI_RESOURCE_GROUP,
+            account_name=AZURE_OPENAI_SERVICE,
+            deployment_name=AZURE_OPENAI_REWRITE_DEPLOYMENT)
+
+        rewrite_model_name = rewrite_deployment.properties.model.name
+
     if USE_AZURE_OPENAI_EMBEDDINGS:
         embedding_deployment = openai_mgmt_client.deployments.get(
             resource_group_name=AZURE_OPENAI_RESOURCE_GROUP,
@@ -158,6 +233,65 @@ else:
         embedding_model_name = ""
         embedding_model_version = ""
 
+# Embedding and search calls are idempotent reads, so slow ones can be hedged
+embedding_hedger = HedgedCall("embedding",
+                              enabled=ENABLE_REQUEST_HEDGING,
+                              budget_ratio=REQUEST_HEDGING_BUDGET_PERCENT / 100,
+                              max_workers=REQUEST_HEDGING_MAX_WORKERS)
+search_hedger = HedgedCall("search",
+                           enabled=ENABLE_REQUEST_HEDGING,
+                           budget_ratio=REQUEST_HEDGING_BUDGET_PERCENT / 100,
+                           max_workers=REQUEST_HEDGING_MAX_WORKERS)
+
+# Spread completions across every configured deployment of the chat model. The rewrite
+# shares the chat deployments unless smaller rewrite deployments are configured.
+openai_endpoints = [{
+    "service": AZURE_OPENAI_SERVICE,
+    "key": AZURE_OPENAI_SERVICE_KEY,
+    "deployment": AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+    "tokens_per_minute": AZURE_OPENAI_CHATGPT_TOKENS_PER_MINUTE,
+    "rewrite_deployment": AZURE_OPENAI_REWRITE_DEPLOYMENT,
+}] + AZURE_OPENAI_CHAT_ENDPOINTS
+chat_router = OpenAIRouter("chat", [
+    OpenAIEndpoint(endpoint["service"],
+                   endpoint["key"],
+                   endpoint["deployment"],
+                   endpoint.get("tokens_per_minute", 0),
+                   IS_GOV_CLOUD_DEPLOYMENT)
+    for endpoint in openai_endpoints
+], openai.api_version)
+rewrite_router = chat_router
+if any(endpoint.get("rewrite_deployment") for endpoint in openai_endpoints):
+    rewrite_router = OpenAIRouter("rewrite", [
+        OpenAIEndpoint(endpoint["service"],
+                       endpoint["key"],
+                       endpoint.get("rewrite_deployment") or endpoint["deployment"],
+                       endpoint.get("rewrite_tokens_per_minute", 0),
+                       IS_GOV_CLOUD_DEPLOYMENT)
+        for endpoint in openai_endpoints
+    ], openai.api_version)
+
+token_usage_tracker = TokenUsageTracker(prices=MODEL_TOKEN_PRICES)
+
+chat_flight = SingleFlight(enabled=ENABLE_CHAT_COALESCING)
+
+prefetcher = FollowupPrefetcher(enabled=ENABLE_FOLLOWUP_PREFETCH,
+                                ttl_seconds=FOLLOWUP_PREFETCH_TTL_SECONDS,
+                                usage_tracker=token_usage_tracker)
+
+# Chunk content is dropped with the search cache whenever the index watermark moves
+working_set = ConversationWorkingSet(ttl_seconds=CONVERSATION_WORKING_SET_TTL_SECONDS,
+                                     max_conversations=CONVERSATION_WORKING_SET_MAX_CONVERSATIONS,
+                                     min_reuse=CONVERSATION_WORKING_SET_MIN_REUSE,
+                                     watermark=index_watermark,
+                                     watermark_refresh_seconds=INDEX_WATERMARK_REFRESH_SECONDS)
+
+traffic_recorder = None
+if CHAT_TRAFFIC_RECORD_PATH:
+    traffic_recorder = TrafficRecorder(CHAT_TRAFFIC_RECORD_PATH,
+                                       sample_rate=CHAT_TRAFFIC_RECORD_SAMPLE_RATE,
+                                       include_text=CHAT_TRAFFIC_RECORD_TEXT)
+
 chat_approaches = {
     "rrr": ChatReadRetrieveReadApproach(
         search_client,
@@ -175,7 +309,17 @@ chat_approaches = {
         model_version,
         IS_GOV_CLOUD_DEPLOYMENT,
         TARGET_EMBEDDING_MODEL,
-        ENRICHMENT_APPSERVICE_NAME
+        ENRICHMENT_APPSERVICE_NAME,
+        search_cache,
+        CHAT_REQUEST_DEADLINE_SECONDS,
+        embedding_hedger,
+        search_hedger,
+        rewrite_model_name,
+        QUERY_REWRITE_SKIP_MAX_WORDS,
+        chat_router,
+        rewrite_router,
+        prefetcher,
+        working_set
     )
 }
 
@@ -192,11 +336,24 @@ def static_file(path):
 def chat():
     """Chat with the bot using a given approach"""
     approach = request.json["approach"]
+    overrides = request.json.get("overrides") or {}
+    started = time.monotonic()
     try:
         impl = chat_approaches.get(approach)
         if not impl:
             return jsonify({"error": "unknown approach"}), 400
-        r = impl.run(request.json["history"], request.json.get("overrides") or {})
+        history = request.json["history"]
+        r, shared = chat_flight.do(SingleFlight.make_key(approach, history, overrides),
+                                   lambda: impl.run(history, overrides))
+        # A shared answer cost nothing extra, its tokens were counted for the first caller
+        if not shared:
+            token_usage_tracker.record(approach,
+                                       overrides.get("system_persona", ""),
+                                       int(overrides.get("response_length") or 1024),
+                                       r["usage"])
+        if traffic_recorder:
+            traffic_recorder.record(approach, request.json["history"], overrides,
+                                    (time.monotonic() - started) * 1000, 200, r)
 
         # return jsonify(r)
         # To fix citation bug,below code is added.aparmar
@@ -206,13 +363,65 @@ def chat():
                 "answer": r["answer"],
                 "thoughts": r["thoughts"],
                 "citation_lookup": r["citation_lookup"],
+                "degradations": r["degradations"],
+                "usage": r["usage"],
+                "timings_ms": r["timings_ms"],
             }
         )
 
     except Exception as ex:
         logging.exception("Exception in /chat")
+        if traffic_recorder:
+            traffic_recorder.record(approach, request.json.get("history") or [], overrides,
+                                    (time.monotonic() - started) * 1000, 500)
+        return jsonify({"error": str(ex)}), 500
+
+@app.route("/retrieve", methods=["POST"])
+def retrieve():
+    """Return the grounding documents for a question without generating an answer"""
+    approach = request.json["approach"]
+    overrides = request.json.get("overrides") or {}
+    try:
+        impl = chat_approaches.get(approach)
+        if not impl:
+            return jsonify({"error": "unknown approach"}), 400
+        r = impl.retrieve(request.json["history"], overrides)
+        return jsonify(
+            {
+                "data_points": r["data_points"],
+                "citation_lookup": r["citation_lookup"],
+                "degradations": r["degradations"],
+                "timings_ms": r["timings_ms"],
+            }
+        )
+
+    except Exception as ex:
+        logging.exception("Exception in /retrieve")
         return jsonify({"error": str(ex)}), 500
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Get runtime performance metrics for the chat pipeline"""
+    return jsonify(
+        {
+            "hedging": {
+                "embedding": embedding_hedger.get_metrics(),
+                "search": search_hedger.get_metrics(),
+            },
+            "openai": {
+                "chat": chat_router.get_metrics(),
+                "rewrite": rewrite_router.get_metrics(),
+            },
+            "token_usage": token_usage_tracker.get_metrics(),
+            "chat_coalescing": chat_flight.get_metrics(),
+            "followup_prefetch": prefetcher.get_metrics(),
+            "conversation_working_set": working_set.get_metrics(),
+            "search_cache": {
+                "hits": search_cache.hits,
+                "misses": search_cache.misses,
+            },
+        })
+
 @app.route("/getblobclienturl")
 def get_blob_client_url():
     """Get a URL for a file in Blob Storage with SAS token"""
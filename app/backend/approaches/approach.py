@@ -17,3 +17,14 @@ class Approach:
             overrides: Overrides for the approach. (e.g. temperature, etc.)
         """
         raise NotImplementedError
+
+    def retrieve(self, history: list[dict], overrides: dict) -> any:
+        """
+        Return the documents the approach would ground its answer on, without
+        generating an answer. Not implemented.
+
+        Args:
+            history: The chat history. (e.g. [{"user": "hello", "bot": "hi"}])
+            overrides: Overrides for the approach. (e.g. top, selected_folders, etc.)
+        """
+        raise NotImplementedError
@@ -4,6 +4,8 @@
 import json
 import re
 import logging
+import struct
+import time
 import urllib.parse
 from datetime import datetime, timedelta
 from typing import Any, Sequence
@@ -11,7 +13,14 @@ from typing import Any, Sequence
 import openai
 from approaches.approach import Approach
 from azure.core.credentials import AzureKeyCredential 
-from azure.search.documents import SearchClient  
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from core.shardedsearch import ShardedSearchClient
+from core.searchcache import SearchResultCache
+from core.deadline import Deadline
+from core.hedging import HedgedCall
+from core.openairouter import OpenAIRouter
+from core.prefetch import FollowupPrefetcher
+from core.workingset import ConversationWorkingSet
 from azure.search.documents.indexes import SearchIndexClient  
 from azure.search.documents.models import RawVectorQuery
 from azure.search.documents.models import QueryType
@@ -91,12 +100,35 @@ class ChatReadRetrieveReadApproach(Approach):
     {'role': ASSISTANT, 'content': 'Several steps are being taken to promote energy conservation including reducing energy consumption, increasing energy efficiency, and increasing the use of renewable energy sources.Citations[File0]'}
     ]
     
+    # Stage limits, in seconds, used with the per-request deadline. Earlier stages always leave
+    # ANSWER_RESERVE_SECONDS for the answer and degrade instead when they cannot.
+    REWRITE_TIMEOUT_SECONDS = 10
+    REWRITE_MIN_SECONDS = 2
+    EMBEDDING_TIMEOUT_SECONDS = 10
+    EMBEDDING_MIN_SECONDS = 1
+    SEARCH_TIMEOUT_SECONDS = 10
+    SEARCH_MIN_TIMEOUT_SECONDS = 2
+    SEMANTIC_RANKER_MIN_SECONDS = 3
+    ANSWER_RESERVE_SECONDS = 15
+    ANSWER_MIN_TIMEOUT_SECONDS = 5
+    DEGRADED_ANSWER_MAX_TOKENS = 256
+
+    # Key field of the index, see azure_search/create_vector_index.json
+    ID_FIELD = "id"
+
+    # Words that refer back to something outside the question. A question using
+    # them is not self-contained and always goes through the rewrite.
+    CONTEXT_REFERENCE_WORDS = {
+        "it", "its", "they", "them", "their", "this", "that", "these", "those",
+        "he", "she", "his", "her", "above", "previous", "earlier", "same", "else"
+    }
+
     # # Define a class variable for the base URL
     # EMBEDDING_SERVICE_BASE_URL = 'https://infoasst-cr-{}.azurewebsites.net'
     
     def __init__(
         self,
-        search_client: SearchClient,
+        search_client: ShardedSearchClient,
         oai_service_name: str,
         oai_service_key: str,
         chatgpt_deployment: str,
@@ -111,18 +143,54 @@ class ChatReadRetrieveReadApproach(Approach):
         model_version: str,
         is_gov_cloud_deployment: str,
         TARGET_EMBEDDING_MODEL: str,
-        ENRICHMENT_APPSERVICE_NAME: str
+        ENRICHMENT_APPSERVICE_NAME: str,
+        search_cache: SearchResultCache,
+        request_deadline_seconds: float,
+        embedding_hedger: HedgedCall,
+        search_hedger: HedgedCall,
+        rewrite_model_name: str,
+        rewrite_skip_max_words: int,
+        chat_router: OpenAIRouter,
+        rewrite_router: OpenAIRouter,
+        prefetcher: FollowupPrefetcher,
+        working_set: ConversationWorkingSet
     ):
         self.search_client = search_client
+        self.search_cache = search_cache
+        self.request_deadline_seconds = request_deadline_seconds
+        self.embedding_hedger = embedding_hedger
+        self.search_hedger = search_hedger
         self.chatgpt_deployment = chatgpt_deployment
         self.source_file_field = source_file_field
         self.content_field = content_field
         self.page_number_field = page_number_field
         self.chunk_file_field = chunk_file_field
+        # Only pull back the fields the approach reads. The index marks contentVector,
+        # entities and key_phrases as retrievable, and returning them inflates every hit.
+        # @search.score is always returned and does not need to be selected.
+        self.select_fields = [
+            self.ID_FIELD,
+            self.content_field,
+            self.source_file_field,
+            self.page_number_field,
+            self.chunk_file_field
+        ]
+        # Enough to rank and cite a hit, content comes from the conversation's working set
+        self.ranking_fields = [field for field in self.select_fields if field != self.content_field]
         self.content_storage_container = content_storage_container
         self.blob_client = blob_client
         self.query_term_language = query_term_language
         self.chatgpt_token_limit = get_token_limit(model_name)
+        # Completions are spread over every configured deployment of the model. The keyword
+        # rewrite can run on smaller, faster deployments than the answer, without them
+        # rewrite_router is chat_router.
+        self.chat_router = chat_router
+        self.rewrite_router = rewrite_router
+        self.prefetcher = prefetcher
+        self.working_set = working_set
+        self.rewrite_model_name = rewrite_model_name or model_name
+        self.rewrite_token_limit = get_token_limit(self.rewrite_model_name)
+        self.rewrite_skip_max_words = rewrite_skip_max_words
         #escape target embeddiong model name
         self.escaped_target_model = re.sub(r'[^a-zA-Z0-9_\-.]', '_', TARGET_EMBEDDING_MODEL)
         
@@ -146,141 +214,47 @@ class ChatReadRetrieveReadApproach(Approach):
 
     # def run(self, history: list[dict], overrides: dict) -> any:
     def run(self, history: Sequence[dict[str, str]], overrides: dict[str, Any]) -> Any:
-        use_semantic_captions = True if overrides.get("semantic_captions") else False
-        top = overrides.get("top") or 3
         user_persona = overrides.get("user_persona", "")
         system_persona = overrides.get("system_persona", "")
         response_length = int(overrides.get("response_length") or 1024)
-        folder_filter = overrides.get("selected_folders", "")
-        tags_filter = overrides.get("selected_tags", "")
-
-        user_q = 'Generate search query for: ' + history[-1]["user"]
-        
-        query_prompt=self.query_prompt_template.format(query_term_language=self.query_term_language)
-        
-
-        # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
-        messages = self.get_messages_from_history(
-            query_prompt,
-            self.model_name,
-            history,
-            user_q,
-            self.query_prompt_few_shots,
-            self.chatgpt_token_limit - len(user_q)
-            )
-
-        chat_completion = openai.ChatCompletion.create(
-            deployment_id=self.chatgpt_deployment,
-            model=self.model_name,
-            messages=messages,
-            temperature=0.0,
-            # max_tokens=32, # setting it too low may cause malformed JSON
-            max_tokens=100,
-            n=1)
-
-        generated_query = chat_completion.choices[0].message.content
-        #if we fail to generate a query, return the last user question
-        if generated_query.strip() == "0":
-            generated_query = history[-1]["user"]
-
-        # Generate embedding using REST API
-        url = f'{self.embedding_service_url}/models/{self.escaped_target_model}/embed'
-        data = [f'"{generated_query}"']
-        headers = {
-                'Accept': 'application/json',  
-                'Content-Type': 'application/json',
-            }
-
-        response = requests.post(url, json=data,headers=headers,timeout=60)
-        if response.status_code == 200:
-            response_data = response.json()
-            embedded_query_vector =response_data.get('data')          
-        else:
-            logging.error(f"Error generating embedding:: {response.status_code}")
-            raise Exception('Error generating embedding:', response.status_code)
 
-        #vector set up for pure vector search & Hybrid search & Hybrid semantic
-        vector = RawVectorQuery(vector=embedded_query_vector, k=top, fields="contentVector")
-
-        #Create a filter for the search query
-        if (folder_filter != "") & (folder_filter != "All"):
-            search_filter = f"search.in(folder, '{folder_filter}', ',')"
+        # Every stage works within what is left of the request budget and degrades
+        # rather than overrunning it. Applied degradations are returned to the caller.
+        deadline = Deadline(self.request_deadline_seconds)
+        degradations = []
+        # Token usage and latency of each completion call, by step
+        usage = {}
+
+        # Chunks the conversation retrieved in earlier turns follow it to this turn
+        working_set_key = ConversationWorkingSet.make_key(history, overrides)
+        if len(history) > 1:
+            self.working_set.advance(ConversationWorkingSet.make_key(history[:-1], overrides),
+                                     working_set_key)
+
+        # A follow-up suggested by the previous answer may already have been retrieved
+        prefetch_started = time.monotonic()
+        prefetched = self.prefetcher.take(
+            FollowupPrefetcher.make_key(history, overrides),
+            timeout=deadline.timeout(self.REWRITE_TIMEOUT_SECONDS, reserve=self.ANSWER_RESERVE_SECONDS))
+        if prefetched and not prefetched["degradations"]:
+            generated_query = prefetched["generated_query"]
+            r = prefetched["results"]
+            # The prefetch left the working set alone, the turn that uses it adds its hits
+            self.working_set.put_hits(working_set_key,
+                                      {doc[self.ID_FIELD]: doc[self.content_field] for doc in r})
+            # The rewrite, embedding and search ran before this turn and their usage was
+            # recorded then. The turn only spent the wait for a prefetch still running.
+            timings = {"prefetch_wait": round((time.monotonic() - prefetch_started) * 1000, 1)}
         else:
-            search_filter = None
-        if tags_filter != "" :
-            quoted_tags_filter = tags_filter.replace(",","','")
-            if search_filter is not None:
-                search_filter = search_filter + f" and tags/any(t: search.in(t, '{quoted_tags_filter}', ','))"
-            else:
-                search_filter = f"tags/any(t: search.in(t, '{quoted_tags_filter}', ','))"
-
-        # Hybrid Search
-        # r = self.search_client.search(generated_query, vector_queries =[vector], top=top)
+            # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
+            generated_query = self.generate_search_query(history, deadline, degradations, usage)
 
-        # Pure Vector Search
-        # r=self.search_client.search(search_text=None,vector_queries =[vector], top=top)
-        
-        # vector search with filter
-        # r=self.search_client.search(search_text=None, vectors=[vector], filter="processed_datetime le 2023-09-18T04:06:29.675Z" , top=top)
-        # r=self.search_client.search(search_text=None, vectors=[vector], filter="search.ismatch('upload/ospolicydocs/China, climate change and the energy transition.pdf', 'file_name')", top=top)
-
-        #  hybrid semantic search using semantic reranker
-       
-        if (not self.is_gov_cloud_deployment and overrides.get("semantic_ranker")):
-            r = self.search_client.search(
-                generated_query,
-                query_type=QueryType.SEMANTIC,
-                query_language="en-us",
-                # query_language=self.query_term_language,
-                query_speller="lexicon",
-                semantic_configuration_name="default",
-                top=top,
-                query_caption="extractive|highlight-false"
-                if use_semantic_captions else None,
-                vector_queries =[vector],
-                filter=search_filter
-            )
-        else:
-            r = self.search_client.search(
-                generated_query, top=top,vector_queries =[vector], filter=search_filter
-            )
-
-        citation_lookup = {}  # dict of "FileX" moniker to the actual file name
-        results = []  # list of results to be used in the prompt
-        data_points = []  # list of data points to be used in the response
-        
-        #  #print search results with score
-        # for idx, doc in enumerate(r):  # for each document in the search results
-        #     print(f"File{idx}: ", doc['@search.score'])
-        
-        # cutoff_score=0.01
-        
-        # # Only include results where search.score is greater than cutoff_score
-        # filtered_results = [doc for doc in r if doc['@search.score'] > cutoff_score]
-        # # print("Filtered Results: ", len(filtered_results))
-        
-      
-
-        for idx, doc in enumerate(r):  # for each document in the search results
-            # include the "FileX" moniker in the prompt, and the actual file name in the response
-            results.append(
-                f"File{idx} " + "| " + nonewlines(doc[self.content_field])
-            )
-            data_points.append(
-               "/".join(urllib.parse.unquote(doc[self.source_file_field]).split("/")[4:]
-                ) + "| " + nonewlines(doc[self.content_field])
-                )
-            # uncomment to debug size of each search result content_field
-            # print(f"File{idx}: ", self.num_tokens_from_string(f"File{idx} " + /
-            #  "| " + nonewlines(doc[self.content_field]), "cl100k_base"))
-
-            # add the "FileX" moniker and full file name to the citation lookup
-            citation_lookup[f"File{idx}"] = {
-                "citation": urllib.parse.unquote("https://" + doc[self.source_file_field].split("/")[2] + f"/{self.content_storage_container}/" + doc[self.chunk_file_field]),
-                "source_path": self.get_source_file_with_sas(doc[self.source_file_field]),
-                "page_number": str(doc[self.page_number_field][0]) or "0",
-             }
-            
+            # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
+            timings = {"rewrite": usage.get("rewrite", {}).get("latency_ms", 0)}
+            r = self.retrieve_documents(generated_query, overrides, deadline, degradations, timings,
+                                        reserve=self.ANSWER_RESERVE_SECONDS,
+                                        working_set_key=working_set_key)
+        results, data_points, citation_lookup = self.format_search_results(r)
 
         # create a single string of all the results to be used in the prompt
         results_text = "".join(results)
@@ -355,12 +329,14 @@ class ChatReadRetrieveReadApproach(Approach):
             #print("Few Shot Tokens: ", self.num_tokens_from_string(self.response_prompt_few_shots[0]['content'], "cl100k_base"))
             #print("Message Tokens: ", self.num_tokens_from_string(message_string, "cl100k_base"))
 
-            chat_completion = openai.ChatCompletion.create(
-            deployment_id=self.chatgpt_deployment,
+            answer_started = time.monotonic()
+            chat_completion, answer_endpoint = self.chat_router.create(
             model=self.model_name,
             messages=messages,
             temperature=float(overrides.get("response_temp")) or 0.6,
-            n=1
+            n=1,
+            request_timeout=max(deadline.remaining(), self.ANSWER_MIN_TIMEOUT_SECONDS),
+            **self.get_answer_token_cap(deadline, None, degradations)
         )
 
         elif self.model_name.startswith("gpt-4"):
@@ -386,25 +362,437 @@ class ChatReadRetrieveReadApproach(Approach):
             #print("Few Shot Tokens: ", self.num_tokens_from_string(self.response_prompt_few_shots[0]['content'], "cl100k_base"))
             #print("Message Tokens: ", self.num_tokens_from_string(message_string, "cl100k_base"))
 
-            chat_completion = openai.ChatCompletion.create(
-            deployment_id=self.chatgpt_deployment,
+            answer_started = time.monotonic()
+            chat_completion, answer_endpoint = self.chat_router.create(
             model=self.model_name,
             messages=messages,
             temperature=float(overrides.get("response_temp")) or 0.6,
-            max_tokens=1024,
-            n=1
+            n=1,
+            request_timeout=max(deadline.remaining(), self.ANSWER_MIN_TIMEOUT_SECONDS),
+            **self.get_answer_token_cap(deadline, 1024, degradations)
         )
 
+        usage["answer"] = self.get_completion_usage(chat_completion, answer_endpoint.name,
+                                                    self.model_name, answer_started)
+
+        if overrides.get("suggest_followup_questions"):
+            self.prefetch_followups(history, overrides, chat_completion.choices[0].message.content)
+
         # STEP 4: Format the response
         msg_to_display = '\n\n'.join([str(message) for message in messages])
 
+        degradations_to_display = ""
+        if degradations:
+            degradations_to_display = "Degraded to meet the response deadline:<br>" + "<br>".join(degradations) + "<br><br>"
+
         return {
             "data_points": data_points,
             "answer": f"{urllib.parse.unquote(chat_completion.choices[0].message.content)}",
-            "thoughts": f"Searched for:<br>{generated_query}<br><br>Conversations:<br>" + msg_to_display.replace('\n', '<br>'),
-            "citation_lookup": citation_lookup
+            "thoughts": degradations_to_display + f"Searched for:<br>{generated_query}<br><br>Conversations:<br>" + msg_to_display.replace('\n', '<br>'),
+            "citation_lookup": citation_lookup,
+            "degradations": degradations,
+            "usage": usage,
+            "timings_ms": {
+                **timings,
+                "answer": usage["answer"]["latency_ms"],
+            }
+        }
+
+    def retrieve(self, history: Sequence[dict[str, str]], overrides: dict[str, Any]) -> Any:
+        """
+        Retrieve-only mode: embed the question as asked and run the same filtered hybrid search
+        as run(), through the same projection and result cache, but skip both completions.
+        Returns the ranked data points and citations without an answer.
+        """
+        deadline = Deadline(self.request_deadline_seconds)
+        degradations = []
+        timings = {}
+
+        r = self.retrieve_documents(history[-1]["user"], overrides, deadline, degradations, timings)
+        _, data_points, citation_lookup = self.format_search_results(r)
+
+        return {
+            "data_points": data_points,
+            "citation_lookup": citation_lookup,
+            "degradations": degradations,
+            "timings_ms": timings
+        }
+
+    def prefetch_followups(self, history: Sequence[dict[str, str]], overrides: dict[str, Any], answer: str):
+        """
+        Queue the rewrite and retrieval of each <<<follow-up>>> question in the answer, as the
+        next turn of this conversation would run them.
+        """
+        answered = list(history[:-1]) + [{"user": history[-1]["user"], "bot": answer}]
+        for question in re.findall(r"<<<([^<>]+)>>>", answer):
+            next_history = answered + [{"user": question.strip()}]
+            self.prefetcher.submit(
+                FollowupPrefetcher.make_key(next_history, overrides),
+                lambda next_history=next_history: self.prefetch_retrieval(next_history, overrides),
+                overrides.get("system_persona", ""),
+                int(overrides.get("response_length") or 1024))
+
+    def prefetch_retrieval(self, history: Sequence[dict[str, str]], overrides: dict[str, Any]) -> dict:
+        """Run steps 1 and 2 of run() ahead of time for a follow-up question"""
+        deadline = Deadline(self.request_deadline_seconds)
+        degradations = []
+        usage = {}
+        generated_query = self.generate_search_query(history, deadline, degradations, usage)
+        # Without the working set, so a follow-up that is never asked leaves it untouched
+        r = self.retrieve_documents(generated_query, overrides, deadline, degradations, {},
+                                    reserve=self.ANSWER_RESERVE_SECONDS)
+        return {
+            "generated_query": generated_query,
+            "results": r,
+            "degradations": degradations,
+            "usage": usage
+        }
+
+    def build_search_filter(self, folder_filter: str, tags_filter: str):
+        """
+        Build the OData filter for the selected folders and tags. Returns the filter and the
+        list of selected folders, which the sharded search client uses to skip shards.
+        """
+        selected_folders = None
+        if (folder_filter != "") & (folder_filter != "All"):
+            # folder_hierarchy holds every ancestor of a chunk's folder, so selecting a parent
+            # folder also matches its subfolders. The exact folder match keeps chunks indexed
+            # before folder_hierarchy existed in scope.
+            selected_folders = [folder.strip("/") for folder in folder_filter.split(",")]
+            quoted_folders = ",".join(selected_folders)
+            search_filter = (f"(folder_hierarchy/any(f: search.in(f, '{quoted_folders}', ','))"
+                             f" or search.in(folder, '{quoted_folders}', ','))")
+        else:
+            search_filter = None
+        if tags_filter != "" :
+            quoted_tags_filter = tags_filter.replace(",","','")
+            if search_filter is not None:
+                search_filter = search_filter + f" and tags/any(t: search.in(t, '{quoted_tags_filter}', ','))"
+            else:
+                search_filter = f"tags/any(t: search.in(t, '{quoted_tags_filter}', ','))"
+        return search_filter, selected_folders
+
+    def retrieve_documents(self, search_text: str, overrides: dict[str, Any], deadline: Deadline,
+                           degradations: list[str], timings: dict, reserve: float = 0,
+                           working_set_key: str = None) -> list[dict]:
+        """
+        Embed the search text and run the filtered hybrid (or semantic) search. reserve is the
+        time kept back for any stage that follows, e.g. the answer completion. With a
+        working_set_key, content already retrieved by the conversation is reused. A search
+        that times out returns no results, so the answer is given without sources.
+        """
+        use_semantic_captions = True if overrides.get("semantic_captions") else False
+        top = overrides.get("top") or 3
+
+        # Generate embedding using REST API
+        embedding_started = time.monotonic()
+        embedded_query_vector = self.embed_query(search_text, deadline, degradations, reserve)
+        timings["embedding"] = round((time.monotonic() - embedding_started) * 1000, 1)
+
+        #vector set up for pure vector search & Hybrid search & Hybrid semantic
+        if embedded_query_vector is not None:
+            vector = RawVectorQuery(vector=embedded_query_vector, k=top, fields="contentVector")
+        else:
+            vector = None
+
+        #Create a filter for the search query
+        search_filter, selected_folders = self.build_search_filter(overrides.get("selected_folders", ""),
+                                                                   overrides.get("selected_tags", ""))
+
+        # Hybrid Search
+        # r = self.search_client.search(generated_query, vector_queries =[vector], top=top)
+
+        # Pure Vector Search
+        # r=self.search_client.search(search_text=None,vector_queries =[vector], top=top)
+        
+        # vector search with filter
+        # r=self.search_client.search(search_text=None, vectors=[vector], filter="processed_datetime le 2023-09-18T04:06:29.675Z" , top=top)
+        # r=self.search_client.search(search_text=None, vectors=[vector], filter="search.ismatch('upload/ospolicydocs/China, climate change and the energy transition.pdf', 'file_name')", top=top)
+
+        #  hybrid semantic search using semantic reranker
+       
+        use_semantic_ranker = not self.is_gov_cloud_deployment and overrides.get("semantic_ranker")
+        if use_semantic_ranker and not deadline.allows(self.SEMANTIC_RANKER_MIN_SECONDS, reserve=reserve):
+            use_semantic_ranker = False
+            degradations.append("semantic ranker skipped")
+
+        if use_semantic_ranker:
+            search_kwargs = dict(
+                query_type=QueryType.SEMANTIC,
+                query_language="en-us",
+                # query_language=self.query_term_language,
+                query_speller="lexicon",
+                semantic_configuration_name="default",
+                top=top,
+                query_caption="extractive|highlight-false"
+                if use_semantic_captions else None,
+                filter=search_filter,
+                select=self.select_fields,
+                folders=selected_folders
+            )
+        else:
+            search_kwargs = dict(
+                top=top, filter=search_filter,
+                select=self.select_fields, folders=selected_folders
+            )
+
+        search_started = time.monotonic()
+        search_timeout = deadline.timeout(self.SEARCH_TIMEOUT_SECONDS, reserve=reserve)
+        try:
+            if working_set_key is not None and self.working_set.expects_reuse(working_set_key):
+                # Later turns of a conversation that keep returning the chunks it already holds
+                # rank without content, then only download the chunks it has not retrieved before
+                search_kwargs["select"] = self.ranking_fields
+                r = self.search(search_text, embedded_query_vector, vector, degradations,
+                                timeout=search_timeout, **search_kwargs)
+                r = self.fill_content(working_set_key, r, selected_folders,
+                                      deadline.timeout(self.SEARCH_TIMEOUT_SECONDS, reserve=reserve),
+                                      degradations)
+            else:
+                r = self.search(search_text, embedded_query_vector, vector, degradations,
+                                timeout=search_timeout, **search_kwargs)
+                if working_set_key is not None:
+                    self.working_set.put_hits(working_set_key,
+                                              {doc[self.ID_FIELD]: doc[self.content_field] for doc in r})
+        except (ServiceRequestError, ServiceResponseError) as error:
+            # Timeouts surface as connection errors. Answer without sources rather than fail
+            logging.warning(f"Search failed within the deadline, answering without sources: {str(error)}")
+            degradations.append("search timed out, answered without sources")
+            r = []
+        timings["search"] = round((time.monotonic() - search_started) * 1000, 1)
+        return r
+
+    def fill_content(self, working_set_key: str, r: list[dict], folders: list[str],
+                     timeout: float, degradations: list[str]) -> list[dict]:
+        """
+        Add content to hits ranked without it, from the conversation's working set where
+        possible and with a single lookup for the rest. Hits on shards the lookup could not
+        reach are dropped.
+        """
+        chunk_ids = [doc[self.ID_FIELD] for doc in r]
+        contents = self.working_set.get(working_set_key, chunk_ids)
+        missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in contents]
+        if missing:
+            fetched = self.search_client.get_documents(
+                self.ID_FIELD, missing, folders=folders,
+                select=[self.ID_FIELD, self.content_field], timeout=timeout)
+            if fetched.failed_shards:
+                degradations.append(f"content lookup skipped unavailable index shards "
+                                    f"{', '.join(fetched.failed_shards)}, sources may be incomplete")
+            fetched = {chunk_id: doc[self.content_field] for chunk_id, doc in fetched.items()}
+            self.working_set.put(working_set_key, fetched)
+            contents.update(fetched)
+        # Hits are shared with the search cache, copy rather than modify them.
+        # A chunk deleted between the two queries is dropped.
+        return [{**doc, self.content_field: contents[doc[self.ID_FIELD]]}
+                for doc in r if doc[self.ID_FIELD] in contents]
+
+    def format_search_results(self, r: list[dict]):
+        """
+        Turn search hits into the "FileX" prompt sources, the data points shown in the UI and
+        the citation lookup from "FileX" monikers to the actual files.
+        """
+        citation_lookup = {}  # dict of "FileX" moniker to the actual file name
+        results = []  # list of results to be used in the prompt
+        data_points = []  # list of data points to be used in the response
+        
+        #  #print search results with score
+        # for idx, doc in enumerate(r):  # for each document in the search results
+        #     print(f"File{idx}: ", doc['@search.score'])
+        
+        # cutoff_score=0.01
+        
+        # # Only include results where search.score is greater than cutoff_score
+        # filtered_results = [doc for doc in r if doc['@search.score'] > cutoff_score]
+        # # print("Filtered Results: ", len(filtered_results))
+        
+      
+
+        for idx, doc in enumerate(r):  # for each document in the search results
+            # include the "FileX" moniker in the prompt, and the actual file name in the response
+            results.append(
+                f"File{idx} " + "| " + nonewlines(doc[self.content_field])
+            )
+            data_points.append(
+               "/".join(urllib.parse.unquote(doc[self.source_file_field]).split("/")[4:]
+                ) + "| " + nonewlines(doc[self.content_field])
+                )
+            # uncomment to debug size of each search result content_field
+            # print(f"File{idx}: ", self.num_tokens_from_string(f"File{idx} " + /
+            #  "| " + nonewlines(doc[self.content_field]), "cl100k_base"))
+
+            # add the "FileX" moniker and full file name to the citation lookup
+            citation_lookup[f"File{idx}"] = {
+                "citation": urllib.parse.unquote("https://" + doc[self.source_file_field].split("/")[2] + f"/{self.content_storage_container}/" + doc[self.chunk_file_field]),
+                "source_path": self.get_source_file_with_sas(doc[self.source_file_field]),
+                "page_number": str(doc[self.page_number_field][0]) or "0",
+             }
+        return results, data_points, citation_lookup
+
+    def generate_search_query(self, history: Sequence[dict[str, str]], deadline: Deadline,
+                              degradations: list[str], usage: dict) -> str:
+        """
+        Ask the model to rewrite the conversation into a keyword search query. Falls back to the
+        raw question when the deadline leaves no room for the rewrite, or the rewrite times out
+        or fails on every deployment.
+        """
+        if self.is_self_contained_question(history):
+            return history[-1]["user"]
+
+        if not deadline.allows(self.REWRITE_MIN_SECONDS, reserve=self.ANSWER_RESERVE_SECONDS):
+            degradations.append("query rewrite skipped, searched with the question as asked")
+            return history[-1]["user"]
+
+        user_q = 'Generate search query for: ' + history[-1]["user"]
+
+        query_prompt=self.query_prompt_template.format(query_term_language=self.query_term_language)
+
+        messages = self.get_messages_from_history(
+            query_prompt,
+            self.rewrite_model_name,
+            history,
+            user_q,
+            self.query_prompt_few_shots,
+            self.rewrite_token_limit - len(user_q)
+            )
+
+        try:
+            rewrite_started = time.monotonic()
+            chat_completion, rewrite_endpoint = self.rewrite_router.create(
+                model=self.rewrite_model_name,
+                messages=messages,
+                temperature=0.0,
+                # max_tokens=32, # setting it too low may cause malformed JSON
+                max_tokens=100,
+                n=1,
+                request_timeout=deadline.timeout(self.REWRITE_TIMEOUT_SECONDS, reserve=self.ANSWER_RESERVE_SECONDS))
+        except openai.error.Timeout:
+            logging.warning("Query rewrite timed out, searching with the question as asked")
+            degradations.append("query rewrite timed out, searched with the question as asked")
+            return history[-1]["user"]
+        except openai.error.OpenAIError as error:
+            # Throttled or unavailable on every deployment the router tried
+            logging.warning(f"Query rewrite failed, searching with the question as asked: {str(error)}")
+            degradations.append("query rewrite failed, searched with the question as asked")
+            return history[-1]["user"]
+
+        usage["rewrite"] = self.get_completion_usage(chat_completion, rewrite_endpoint.name,
+                                                     self.rewrite_model_name, rewrite_started)
+
+        generated_query = chat_completion.choices[0].message.content
+        #if we fail to generate a query, return the last user question
+        if generated_query.strip() == "0":
+            generated_query = history[-1]["user"]
+        return generated_query
+
+    def is_self_contained_question(self, history: Sequence[dict[str, str]]) -> bool:
+        """
+        True when the rewrite would add nothing: a short first-turn question with no
+        references to earlier context and nothing the rewrite prompt would strip or translate.
+        """
+        if self.rewrite_skip_max_words <= 0 or len(history) != 1:
+            return False
+        # The rewrite also translates into the query term language
+        if self.query_term_language.lower() != "english":
+            return False
+        question = history[-1]["user"]
+        if not question.isascii():
+            return False
+        # Citations, <<<follow-up>>> markers, quoted phrases, '+' and file names
+        if re.search(r'[\[\]<>"+]|\w\.[a-zA-Z]{2,4}\b', question):
+            return False
+        words = re.findall(r"[a-z0-9']+", question.lower())
+        if not words or len(words) > self.rewrite_skip_max_words:
+            return False
+        return not any(word in self.CONTEXT_REFERENCE_WORDS for word in words)
+
+    def embed_query(self, query: str, deadline: Deadline, degradations: list[str], reserve: float = 0) -> list[float]:
+        """
+        Embed the search query with the enrichment service. Returns None, so the search falls
+        back to keyword (BM25) only, when the deadline leaves no room or the call times out or
+        fails.
+        """
+        if not deadline.allows(self.EMBEDDING_MIN_SECONDS, reserve=reserve):
+            degradations.append("query embedding skipped, keyword search only")
+            return None
+
+        url = f'{self.embedding_service_url}/models/{self.escaped_target_model}/embed'
+        data = [f'"{query}"']
+        # Ask for a packed float32 vector, services that predate it still answer with JSON
+        headers = {
+                'Accept': 'application/octet-stream, application/json;q=0.5',
+                'Content-Type': 'application/json',
+            }
+
+        try:
+            timeout = deadline.timeout(self.EMBEDDING_TIMEOUT_SECONDS, reserve=reserve)
+            response = self.embedding_hedger.call(
+                lambda: requests.post(url, json=data, headers=headers, timeout=timeout))
+        except requests.exceptions.Timeout:
+            logging.warning("Query embedding timed out, falling back to keyword search")
+            degradations.append("query embedding timed out, keyword search only")
+            return None
+        except requests.exceptions.RequestException as error:
+            logging.warning(f"Query embedding failed, falling back to keyword search: {str(error)}")
+            degradations.append("query embedding failed, keyword search only")
+            return None
+
+        if response.status_code != 200:
+            logging.error(f"Error generating embedding:: {response.status_code}")
+            degradations.append("query embedding failed, keyword search only")
+            return None
+        if response.headers.get('Content-Type', '').startswith('application/octet-stream'):
+            dimensions = int(response.headers['X-Embedding-Dimensions'])
+            return list(struct.unpack(f'<{dimensions}f', response.content))
+        response_data = response.json()
+        return response_data.get('data')
+
+    def get_completion_usage(self, chat_completion, deployment: str, model: str, started: float) -> dict:
+        """ Function to return the token usage and latency of a completion call"""
+        completion_usage = chat_completion.get("usage") or {}
+        return {
+            "deployment": deployment,
+            "model": model,
+            "prompt_tokens": completion_usage.get("prompt_tokens", 0),
+            "completion_tokens": completion_usage.get("completion_tokens", 0),
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
         }
 
+    def get_answer_token_cap(self, deadline: Deadline, max_tokens: int, degradations: list[str]) -> dict:
+        """
+        Returns the max_tokens argument for the answer completion. When less than the answer
+        reserve is left, the answer is capped so generation can finish inside the deadline.
+        """
+        if deadline.allows(self.ANSWER_RESERVE_SECONDS):
+            return {"max_tokens": max_tokens} if max_tokens else {}
+        degradations.append(f"answer capped at {self.DEGRADED_ANSWER_MAX_TOKENS} tokens")
+        return {"max_tokens": min(max_tokens or self.DEGRADED_ANSWER_MAX_TOKENS, self.DEGRADED_ANSWER_MAX_TOKENS)}
+
+    def search(self, search_text: str, query_vector: list[float], vector: RawVectorQuery,
+               degradations: list[str], timeout: float = None, **search_kwargs) -> list[dict]:
+        """
+        Run a hybrid search, or a keyword only search when there is no query vector, serving
+        repeats of the same query, vector and filter from the short-lived result cache. The
+        cache is dropped when the index watermark moves. Hits missing the shards that failed
+        are returned as a degradation and not cached.
+        """
+        cache_key = self.search_cache.make_key(search_text, query_vector, **search_kwargs)
+        results = self.search_cache.get(cache_key)
+        if results is None:
+            if timeout is not None:
+                # Bounds the whole call including retries, not part of the cache key
+                search_kwargs["timeout"] = max(timeout, self.SEARCH_MIN_TIMEOUT_SECONDS)
+            results = self.search_hedger.call(
+                lambda: self.search_client.search(search_text,
+                                                  vector_queries=[vector] if vector is not None else None,
+                                                  **search_kwargs))
+            if results.failed_shards:
+                degradations.append(f"search skipped unavailable index shards "
+                                    f"{', '.join(results.failed_shards)}, sources may be incomplete")
+            else:
+                self.search_cache.put(cache_key, results)
+        return results
+
     #Aparmar. Custom method to construct Chat History as opposed to single string of chat History.
     def get_messages_from_history(
         self,
@@ -0,0 +1,28 @@
+import time
+
+
+class Deadline:
+    """
+      The end-to-end time budget of a single request, handed to each stage so it can bound
+      its own timeout and decide whether to degrade.
+      Attributes:
+          budget_seconds (float): The total budget the request started with.
+      Methods:
+          remaining(self): Seconds left before the deadline.
+          timeout(self, stage_limit, reserve=0): The timeout a stage should use, capped by its own
+              limit and leaving reserve seconds for the stages after it.
+          allows(self, seconds, reserve=0): Whether a stage needing seconds still fits.
+    """
+
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def timeout(self, stage_limit: float, reserve: float = 0) -> float:
+        return max(min(stage_limit, self.remaining() - reserve), 0.0)
+
+    def allows(self, seconds: float, reserve: float = 0) -> bool:
+        return self.remaining() - reserve >= seconds
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+
+class HedgedCall:
+    """
+      Hedges an idempotent read: when the first attempt has not returned by the observed p95
+      latency, an identical second attempt is started and whichever returns first wins.
+      Attributes:
+          name (str): Used in logs and metrics.
+          enabled (bool): When False calls run inline with no extra threads.
+          budget_ratio (float): Hedges allowed per call, e.g. 0.05 caps extra load at about 5%.
+          min_samples (int): Latencies observed before the first hedge, until then p95 is unknown.
+          max_workers (int): Attempts run on the hedging pool at once. A call that finds the pool
+              full runs inline on the caller's thread and is not hedged, so the pool never limits
+              or queues the calls of the process. Size it to twice the requests a server process
+              handles at once to hedge every call that needs it.
+      Methods:
+          call(self, attempt, hedge_attempt=None): Runs attempt, hedging with hedge_attempt (or
+              attempt again) when it is slow. Returns the first successful result.
+          get_metrics(self): Call, hedge and win counts plus the current hedge delay.
+    """
+
+    def __init__(self, name: str, enabled: bool = False, budget_ratio: float = 0.05,
+                 min_samples: int = 20, min_delay_seconds: float = 0.01,
+                 window_size: int = 500, max_workers: int = 32):
+        self.name = name
+        self.enabled = enabled
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self._latencies = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        # Token bucket: every call earns budget_ratio of a hedge, capped so a quiet
+        # period cannot save up a burst of hedges
+        self._budget = 0.0
+        self._max_budget = max(budget_ratio * 100, 1.0)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.unhedged_pool_full = 0
+        self.max_workers = max_workers
+        self._in_flight = 0
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix=f"hedge-{name}") if enabled else None
+
+    def hedge_delay(self) -> float:
+        """The observed p95 latency, or None while there are too few samples"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return max(ordered[int(len(ordered) * 0.95) - 1], self.min_delay_seconds)
+
+    def _record(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _timed(self, attempt: Callable):
+        start = time.monotonic()
+        result = attempt()
+        self._record(time.monotonic() - start)
+        return result
+
+    def _pooled(self, attempt: Callable):
+        try:
+            return self._timed(attempt)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _submit(self, attempt: Callable, hedge: bool = False):
+        """
+        Starts attempt on the pool, or returns None when every worker is busy, so an attempt
+        never waits in the pool's queue. A hedge also needs budget, which it then uses up.
+        """
+        with self._lock:
+            if self._in_flight >= self.max_workers:
+                return None
+            if hedge:
+                if self._budget < 1.0:
+                    return None
+                self._budget -= 1.0
+                self.hedges += 1
+            self._in_flight += 1
+        return self.executor.submit(self._pooled, attempt)
+
+    def call(self, attempt: Callable, hedge_attempt: Callable = None):
+        with self._lock:
+            self.calls += 1
+            self._budget = min(self._budget + self.budget_ratio, self._max_budget)
+            has_budget = self._budget >= 1.0
+        delay = self.hedge_delay() if self.enabled and has_budget else None
+        if delay is None:
+            # Nothing to hedge against yet or no budget to hedge with, stay on the caller's thread
+            return self._timed(attempt)
+
+        primary = self._submit(attempt)
+        if primary is None:
+            with self._lock:
+                self.unhedged_pool_full += 1
+            return self._timed(attempt)
+
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        hedge = self._submit(hedge_attempt or attempt, hedge=True)
+        if hedge is None:
+            return primary.result()
+
+        logging.debug(f"Hedging {self.name} call after {delay * 1000:.0f} ms")
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def get_metrics(self) -> dict:
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "unhedged_pool_full": self.unhedged_pool_full,
+                "hedge_rate": self.hedges / self.calls if self.calls else 0.0,
+                "hedge_delay_ms": delay * 1000 if delay is not None else None,
+            }
@@ -8,12 +8,18 @@ MODELS_2_TOKEN_LIMITS = {
     "gpt-35-turbo-16k": 16385,
     "gpt-3.5-turbo-16k": 16385,
     "gpt-4": 8192,
-    "gpt-4-32k": 32768
+    "gpt-4-32k": 32768,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000
 }
 
 AOAI_2_OAI = {
     "gpt-35-turbo": "gpt-3.5-turbo",
-    "gpt-35-turbo-16k": "gpt-3.5-turbo-16k"
+    "gpt-35-turbo-16k": "gpt-3.5-turbo-16k",
+    # The pinned tiktoken predates o200k_base. cl100k_base counts are close enough
+    # for trimming history to the token limit.
+    "gpt-4o": "gpt-4",
+    "gpt-4o-mini": "gpt-4"
 }
 
 
@@ -0,0 +1,186 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+# Weight of the newest sample in the moving average latency of an endpoint
+LATENCY_SMOOTHING = 0.2
+# Cooldown applied after a 5xx or connection error, and after a 429 without Retry-After
+SERVER_ERROR_COOLDOWN_SECONDS = 5
+THROTTLE_COOLDOWN_SECONDS = 10
+
+
+class OpenAIEndpoint:
+    """
+      One Azure OpenAI service and deployment that chat completions can be sent to.
+      Attributes:
+          service (str): Azure OpenAI service name.
+          key (str): API key of the service.
+          deployment (str): Deployment name within the service.
+          tokens_per_minute (int): The deployment's TPM quota, 0 when unknown.
+    """
+
+    def __init__(self, service: str, key: str, deployment: str, tokens_per_minute: int = 0,
+                 is_gov_cloud_deployment: bool = False):
+        self.service = service
+        self.key = key
+        self.deployment = deployment
+        self.tokens_per_minute = tokens_per_minute
+        suffix = "us" if is_gov_cloud_deployment else "com"
+        self.api_base = f"https://{service}.openai.azure.{suffix}/"
+        self.name = f"{service}/{deployment}"
+        self.latency_seconds = None
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self.failures = 0
+        self._tokens = deque()
+
+    def record_tokens(self, now: float, tokens: int):
+        self._tokens.append((now, tokens))
+
+    def tokens_last_minute(self, now: float) -> int:
+        while self._tokens and self._tokens[0][0] <= now - 60:
+            self._tokens.popleft()
+        return sum(tokens for _, tokens in self._tokens)
+
+    def remaining_quota(self, now: float) -> float:
+        """Fraction of the per-minute quota not used by this process, 1 when the quota is unknown"""
+        if not self.tokens_per_minute:
+            return 1.0
+        return max(1 - self.tokens_last_minute(now) / self.tokens_per_minute, 0.0)
+
+
+class OpenAIRouter:
+    """
+      Spreads ChatCompletion calls over several Azure OpenAI deployments of the same model.
+      Endpoints are sampled in proportion to their remaining quota and the faster of two
+      samples is used. On a 429 or 5xx the endpoint cools down and the call fails over to
+      the next one.
+      Attributes:
+          name (str): Used in logs and metrics.
+          endpoints (list[OpenAIEndpoint]): Deployments calls are routed across.
+          api_version (str): Azure OpenAI API version used for every call.
+      Methods:
+          create(self, **kwargs): Runs openai.ChatCompletion.create on a selected endpoint,
+              failing over on throttling and server errors. Returns the completion and the
+              endpoint that served it.
+          get_metrics(self): Health, latency and quota use of each endpoint.
+    """
+
+    def __init__(self, name: str, endpoints: list[OpenAIEndpoint], api_version: str):
+        if not endpoints:
+            raise ValueError(f"OpenAI router {name} needs at least one endpoint")
+        self.name = name
+        self.endpoints = endpoints
+        self.api_version = api_version
+        self._lock = threading.Lock()
+
+    def _ranked(self) -> list[OpenAIEndpoint]:
+        """All endpoints in the order they should be tried"""
+        now = time.monotonic()
+        with self._lock:
+            available = [e for e in self.endpoints if e.cooldown_until <= now]
+            weights = [e.remaining_quota(now) for e in available]
+            if not any(weights):
+                # Every quota looks spent from here, let the service decide
+                weights = [1.0] * len(available)
+            ranked = []
+            if available:
+                first, second = random.choices(available, weights=weights, k=2)
+                ranked.append(min(first, second, key=lambda e: e.latency_seconds or 0.0))
+            # Then the rest by quota left, and endpoints still cooling down last
+            ranked += sorted((e for e in available if e not in ranked),
+                             key=lambda e: e.remaining_quota(now), reverse=True)
+            ranked += sorted((e for e in self.endpoints if e.cooldown_until > now),
+                             key=lambda e: e.cooldown_until)
+        return ranked
+
+    def _record_success(self, endpoint: OpenAIEndpoint, started: float, chat_completion):
+        now = time.monotonic()
+        usage = chat_completion.get("usage") or {}
+        with self._lock:
+            endpoint.calls += 1
+            latency = now - started
+            if endpoint.latency_seconds is None:
+                endpoint.latency_seconds = latency
+            else:
+                endpoint.latency_seconds += LATENCY_SMOOTHING * (latency - endpoint.latency_seconds)
+            endpoint.record_tokens(now, usage.get("total_tokens", 0))
+            # A cooling down endpoint is only tried when every other one has failed,
+            # answering then shows it has recovered
+            endpoint.cooldown_until = 0.0
+
+    def _record_failure(self, endpoint: OpenAIEndpoint, error: Exception):
+        cooldown = SERVER_ERROR_COOLDOWN_SECONDS
+        with self._lock:
+            endpoint.calls += 1
+            if isinstance(error, openai.error.RateLimitError):
+                endpoint.throttled += 1
+                retry_after = (getattr(error, "headers", None) or {}).get("Retry-After")
+                try:
+                    cooldown = float(retry_after)
+                except (TypeError, ValueError):
+                    cooldown = THROTTLE_COOLDOWN_SECONDS
+            else:
+                endpoint.failures += 1
+            endpoint.cooldown_until = time.monotonic() + cooldown
+        logging.warning(f"{self.name} endpoint {endpoint.name} failed, cooling down for "
+                        f"{cooldown:.0f}s: {str(error)}")
+
+    @staticmethod
+    def should_fail_over(error: Exception) -> bool:
+        """Throttling, server and connection errors are worth retrying elsewhere. Timeouts are
+        not, the caller's deadline has already been spent."""
+        if isinstance(error, openai.error.Timeout):
+            return False
+        if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+                              openai.error.APIConnectionError)):
+            return True
+        if isinstance(error, openai.error.APIError):
+            return error.http_status is None or error.http_status >= 500
+        return False
+
+    def create(self, **kwargs):
+        error = None
+        for endpoint in self._ranked():
+            started = time.monotonic()
+            try:
+                chat_completion = openai.ChatCompletion.create(
+                    deployment_id=endpoint.deployment,
+                    api_base=endpoint.api_base,
+                    api_key=endpoint.key,
+                    api_type="azure",
+                    api_version=self.api_version,
+                    **kwargs)
+            except openai.error.OpenAIError as ex:
+                if not self.should_fail_over(ex):
+                    raise
+                self._record_failure(endpoint, ex)
+                error = ex
+                continue
+            self._record_success(endpoint, started, chat_completion)
+            return chat_completion, endpoint
+        raise error
+
+    def get_metrics(self) -> list[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "endpoint": e.name,
+                    "healthy": e.cooldown_until <= now,
+                    "cooldown_seconds": round(max(e.cooldown_until - now, 0.0), 1),
+                    "calls": e.calls,
+                    "throttled": e.throttled,
+                    "failures": e.failures,
+                    "latency_ms": round(e.latency_seconds * 1000, 1) if e.latency_seconds is not None else None,
+                    "tokens_last_minute": e.tokens_last_minute(now),
+                    "tokens_per_minute": e.tokens_per_minute,
+                    "remaining_quota": round(e.remaining_quota(now), 3),
+                }
+                for e in self.endpoints
+            ]
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from core.usagemetrics import TokenUsageTracker
+
+# Overrides that change what is retrieved for a question. Prompt and persona overrides only
+# affect the final completion, so a prefetched retrieval stays valid when they change.
+RETRIEVAL_OVERRIDES = [
+    "top",
+    "semantic_ranker",
+    "semantic_captions",
+    "selected_folders",
+    "selected_tags",
+]
+
+# Approach that prefetch completions are recorded under in the token usage metrics. They are
+# spent before the follow-up is asked, and also for follow-ups that never are.
+USAGE_APPROACH = "followup_prefetch"
+
+
+class FollowupPrefetcher:
+    """
+      Retrieves the suggested follow-up questions of an answer in the background, so that a
+      clicked follow-up can go straight to the answer completion. Entries are scoped to the
+      conversation they were suggested in and expire after ttl_seconds.
+      Attributes:
+          enabled (bool): When False nothing is prefetched.
+          ttl_seconds (float): How long a prefetched retrieval is kept.
+          max_entries (int): Oldest entries are dropped beyond this size.
+          max_workers (int): Follow-ups retrieved at the same time.
+          usage_tracker (TokenUsageTracker): Optional, prefetch completions are recorded in it
+              under the "followup_prefetch" approach, whether or not the follow-up is asked.
+      Methods:
+          make_key(history, overrides): Key of the next turn of a conversation.
+          submit(self, key, work, persona, response_length): Runs work in the background and
+              keeps its result under key.
+          take(self, key, timeout): Removes and returns the result for key, waiting up to
+              timeout for a prefetch that is still running. None when there is none.
+          get_metrics(self): Prefetch, hit and token counts.
+    """
+
+    def __init__(self, enabled: bool = False, ttl_seconds: float = 300, max_entries: int = 500,
+                 max_workers: int = 4, usage_tracker: TokenUsageTracker = None):
+        self.enabled = enabled
+        self.usage_tracker = usage_tracker
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="prefetch") if enabled else None
+        self.prefetched = 0
+        self.hits = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @staticmethod
+    def make_key(history: list[dict], overrides: dict) -> str:
+        """
+        The questions asked so far, including the new one, and the overrides that change
+        retrieval. Answers are left out, the frontend may send them back reformatted.
+        """
+        questions = [re.sub(r"\s+", " ", turn.get("user") or "").strip() for turn in history]
+        retrieval_overrides = {key: overrides.get(key) for key in RETRIEVAL_OVERRIDES}
+        payload = json.dumps([questions, retrieval_overrides], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _run(self, work: Callable, persona: str, response_length: int):
+        try:
+            result = work()
+        except Exception as error:
+            logging.warning(f"Follow-up prefetch failed: {str(error)}")
+            with self._lock:
+                self.failures += 1
+            raise
+        with self._lock:
+            for usage in result.get("usage", {}).values():
+                self.prompt_tokens += usage.get("prompt_tokens", 0)
+                self.completion_tokens += usage.get("completion_tokens", 0)
+        if self.usage_tracker is not None and result.get("usage"):
+            self.usage_tracker.record(USAGE_APPROACH, persona, response_length, result["usage"])
+        return result
+
+    def submit(self, key: str, work: Callable, persona: str = "", response_length: int = 1024):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                return
+            for expired in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[expired]
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            future = self.executor.submit(self._run, work, persona, response_length)
+            self._entries[key] = (now + self.ttl_seconds, future)
+            self.prefetched += 1
+
+    def take(self, key: str, timeout: float):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        expires_at, future = entry
+        if expires_at <= time.monotonic():
+            future.cancel()
+            return None
+        try:
+            # A prefetch still running is already doing the work this turn needs
+            result = future.result(timeout=timeout)
+        except Exception:
+            # Timed out or failed, the turn retrieves for itself
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "prefetched": self.prefetched,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.prefetched if self.prefetched else 0.0,
+                "failures": self.failures,
+                "cached": len(self._entries),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
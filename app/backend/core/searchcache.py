@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from shared_code.index_watermark import IndexWatermark
+
+
+class SearchResultCache:
+    """
+      A short-lived, in-process cache of projected search hits.
+      Attributes:
+          ttl_seconds (float): How long an entry is served for. 0 disables the cache.
+          max_entries (int): Least recently used entries are evicted beyond this size.
+          watermark (IndexWatermark): Read at most every watermark_refresh_seconds. When the
+              indexing pipeline moves it, every cached entry is dropped.
+      Methods:
+          make_key(search_text, vector, **search_kwargs): Builds the cache key for a search.
+          get(key): Returns the cached hits or None.
+          put(key, results): Stores the hits for a search.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int,
+                 watermark: IndexWatermark = None, watermark_refresh_seconds: float = 10):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.watermark = watermark
+        self.watermark_refresh_seconds = watermark_refresh_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._watermark_value = None
+        self._watermark_checked = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    @staticmethod
+    def make_key(search_text: str, vector: list[float], **search_kwargs) -> str:
+        """
+        Key on everything that changes the result: the query text, the query vector and the
+        search arguments (filter, top, semantic flags, projection, shards). vector_queries
+        objects are not serialisable and are represented by the raw vector instead.
+        """
+        search_kwargs.pop("vector_queries", None)
+        digest = hashlib.sha256()
+        digest.update(json.dumps([search_text, search_kwargs], sort_keys=True, default=str).encode("utf-8"))
+        if vector:
+            digest.update(struct.pack(f"<{len(vector)}f", *vector))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        self._check_watermark()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, results: list[dict]):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_watermark(self):
+        """Drop everything once the index has moved past the watermark the entries were cached under"""
+        if self.watermark is None:
+            return
+        now = time.monotonic()
+        if now - self._watermark_checked < self.watermark_refresh_seconds:
+            return
+        self._watermark_checked = now
+        try:
+            current = self.watermark.read()
+        except Exception as error:
+            logging.warning(f"Unable to read index watermark: {str(error)}")
+            return
+        if current != self._watermark_value:
+            self._watermark_value = current
+            self.clear()
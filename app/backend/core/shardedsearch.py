@@ -0,0 +1,125 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.search.documents import SearchClient
+from shared_code.index_shards import IndexShardRouter
+
+# Rank constant from the original reciprocal rank fusion paper
+RRF_K = 60
+
+# Separates the keys listed in a search.in() filter. Document keys may only hold letters,
+# digits, dashes, underscores and equal signs, so a key holding it is malformed.
+KEY_DELIMITER = ","
+
+
+class ShardedSearchResults(list):
+    """
+      Merged search hits. When some shards failed the hits are partial and failed_shards
+      names the shards they are missing.
+    """
+
+    def __init__(self, hits: list[dict], failed_shards: list[str] = None):
+        super().__init__(hits)
+        self.failed_shards = failed_shards or []
+
+
+class ShardedDocuments(dict):
+    """
+      Documents found by key. When some shards failed the documents they hold are missing
+      and failed_shards names those shards.
+    """
+
+    def __init__(self, docs: dict, failed_shards: list[str] = None):
+        super().__init__(docs)
+        self.failed_shards = failed_shards or []
+
+
+class ShardedSearchClient:
+    """
+      Fans a search out across the shards of a sharded index and merges the results.
+      Attributes:
+          router (IndexShardRouter): Maps folder filters to the shards that can match them.
+          clients (dict): A SearchClient per shard index name.
+      Methods:
+          search(self, search_text, folders=None, **kwargs): Searches the relevant shards concurrently
+              and returns the merged top results as ShardedSearchResults.
+          get_documents(self, key_field, keys, folders=None, **kwargs): Looks documents up by key
+              in the relevant shards and returns them as ShardedDocuments.
+    """
+
+    def __init__(self, endpoint: str, credential, router: IndexShardRouter):
+        self.router = router
+        self.clients = {
+            index_name: SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)
+            for index_name in router.index_names
+        }
+        self.executor = ThreadPoolExecutor(max_workers=len(self.clients),
+                                           thread_name_prefix="search-shard")
+
+    def search(self, search_text, folders: list[str] = None, **kwargs) -> ShardedSearchResults:
+        """
+        Run the same query against every shard the folder filter allows and merge the
+        hits with reciprocal rank fusion. Scores from different indexes are not comparable,
+        ranks are. With a single shard the query is passed straight through. Shards that
+        fail are left out of the merge and listed in failed_shards, only when every shard
+        fails is the error raised.
+        """
+        index_names = self.router.get_index_names_for_folders(folders)
+        if len(index_names) == 1:
+            return ShardedSearchResults(self.clients[index_names[0]].search(search_text, **kwargs))
+
+        shard_results, failed_shards = self._fan_out(index_names, search_text, **kwargs)
+        return ShardedSearchResults(self.merge(shard_results, kwargs.get("top") or 50),
+                                    failed_shards=failed_shards)
+
+    def get_documents(self, key_field: str, keys: list[str], folders: list[str] = None, **kwargs) -> ShardedDocuments:
+        """
+        Fetch documents by key with a single filtered query per shard, rather than a lookup
+        per document. Returns the documents found by key. Shards that fail are skipped and
+        listed in failed_shards as in search(). Keys are quoted into the OData filter, a key
+        containing the list delimiter is rejected rather than split into two.
+        """
+        for key in keys:
+            if KEY_DELIMITER in key:
+                raise ValueError(f"Document key {key!r} contains the delimiter {KEY_DELIMITER!r}")
+        quoted_keys = KEY_DELIMITER.join(keys).replace("'", "''")
+        kwargs["filter"] = f"search.in({key_field}, '{quoted_keys}', '{KEY_DELIMITER}')"
+        kwargs["top"] = len(keys)
+        index_names = self.router.get_index_names_for_folders(folders)
+        shard_results, failed_shards = self._fan_out(index_names, None, **kwargs)
+        return ShardedDocuments({doc[key_field]: doc for docs in shard_results for doc in docs},
+                                failed_shards=failed_shards)
+
+    def _fan_out(self, index_names: list[str], search_text, **kwargs) -> tuple[list[list[dict]], list[str]]:
+        """Run the query on each shard concurrently. Returns the results of the shards that
+        answered and the names of those that failed, raising only when every shard fails."""
+        futures = {
+            index_name: self.executor.submit(self._search_shard, index_name, search_text, **kwargs)
+            for index_name in index_names
+        }
+        shard_results = []
+        errors = {}
+        for index_name, future in futures.items():
+            try:
+                shard_results.append(future.result())
+            except Exception as error:
+                logging.error(f"Search failed on shard {index_name}: {str(error)}")
+                errors[index_name] = error
+        if len(errors) == len(futures):
+            raise next(iter(errors.values()))
+        return shard_results, list(errors)
+
+    def _search_shard(self, index_name: str, search_text, **kwargs) -> list[dict]:
+        return list(self.clients[index_name].search(search_text, **kwargs))
+
+    @staticmethod
+    def merge(shard_results: list[list[dict]], top: int) -> list[dict]:
+        """Merge ranked result lists with reciprocal rank fusion and keep the top results"""
+        fused = []
+        for results in shard_results:
+            for rank, doc in enumerate(results):
+                doc["@search.rrf_score"] = 1.0 / (RRF_K + rank + 1)
+                fused.append(doc)
+        fused.sort(key=lambda doc: (doc["@search.rrf_score"], doc.get("@search.score") or 0),
+                   reverse=True)
+        return fused[:top]
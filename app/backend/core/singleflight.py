@@ -0,0 +1,95 @@
+import hashlib
+import json
+import re
+import threading
+from typing import Callable
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+      Coalesces identical requests that are in flight at the same time: the first caller runs
+      the work and every caller that arrives with the same key before it finishes shares its
+      result (or its exception) instead of repeating it.
+      Attributes:
+          enabled (bool): When False every call runs on its own.
+      Methods:
+          do(self, key, work): Runs work, or waits for the in-flight call with the same key.
+              Returns the result and whether it was shared with an earlier caller.
+          make_key(approach, history, overrides): Key that ignores whitespace differences and
+              the order of selected folders and tags.
+          get_metrics(self): Executed and coalesced call counts.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        return re.sub(r"\s+", " ", text or "").strip()
+
+    @staticmethod
+    def make_key(approach: str, history: list[dict], overrides: dict) -> str:
+        normalized_history = [
+            {role: SingleFlight.normalize_text(text) for role, text in turn.items()}
+            for turn in history
+        ]
+        normalized_overrides = dict(overrides)
+        for filter_name in ("selected_folders", "selected_tags"):
+            selected = overrides.get(filter_name) or ""
+            normalized_overrides[filter_name] = sorted(
+                {value.strip() for value in selected.split(",") if value.strip()})
+        payload = json.dumps([approach, normalized_history, normalized_overrides],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def do(self, key: str, work: Callable):
+        if not self.enabled:
+            return work(), False
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = work()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            calls = self.executed + self.coalesced
+            return {
+                "enabled": self.enabled,
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "coalesced_rate": self.coalesced / calls if calls else 0.0,
+                "in_flight": len(self._flights),
+            }
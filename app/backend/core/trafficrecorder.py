@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+
+# Overrides that describe the shape of a request without revealing its content
+SHAPE_OVERRIDES = [
+    "top",
+    "semantic_ranker",
+    "semantic_captions",
+    "suggest_followup_questions",
+    "response_length",
+    "response_temp",
+]
+
+
+class TrafficRecorder:
+    """
+      Appends the shape of each /chat request to a JSON lines file so the workload can be
+      replayed later with tests/replay_chat_traffic.py.
+      Attributes:
+          path (str): File the records are appended to.
+          sample_rate (float): Fraction of requests recorded, 0 to 1.
+          include_text (bool): Also record the raw history and overrides. Only for non
+              production environments, the default records lengths and counts only.
+      Methods:
+          record(self, approach, history, overrides, elapsed_ms, status, result=None): Writes one request.
+    """
+
+    def __init__(self, path: str, sample_rate: float = 1.0, include_text: bool = False):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.include_text = include_text
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def anonymize(value: str) -> str:
+        """Stable, non reversible label so repeated values can still be grouped"""
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()[:12] if value else ""
+
+    def build_record(self, approach: str, history: list[dict], overrides: dict,
+                     elapsed_ms: float, status: int, result: dict = None) -> dict:
+        folders = overrides.get("selected_folders") or ""
+        tags = overrides.get("selected_tags") or ""
+        record = {
+            "timestamp": time.time(),
+            "approach": approach,
+            "turns": [
+                {"user_chars": len(turn.get("user") or ""), "bot_chars": len(turn.get("bot") or "")}
+                for turn in history
+            ],
+            "overrides": {key: overrides.get(key) for key in SHAPE_OVERRIDES if key in overrides},
+            "folder_count": 0 if folders in ("", "All") else len(folders.split(",")),
+            "tag_count": 0 if tags == "" else len(tags.split(",")),
+            "user_persona": self.anonymize(overrides.get("user_persona", "")),
+            "system_persona": self.anonymize(overrides.get("system_persona", "")),
+            "has_prompt_template": overrides.get("prompt_template") is not None,
+            "status": status,
+            "elapsed_ms": round(elapsed_ms, 1),
+        }
+        if result is not None:
+            record["timings_ms"] = result.get("timings_ms", {})
+            record["result"] = {
+                "data_points": len(result.get("data_points", [])),
+                "citations": len(result.get("citation_lookup", {})),
+                "answer_chars": len(result.get("answer", "")),
+                "degradations": result.get("degradations", []),
+                "usage": result.get("usage", {}),
+            }
+        if self.include_text:
+            record["history"] = history
+            record["raw_overrides"] = overrides
+        return record
+
+    def record(self, approach: str, history: list[dict], overrides: dict,
+               elapsed_ms: float, status: int, result: dict = None):
+        if random.random() >= self.sample_rate:
+            return
+        try:
+            line = json.dumps(self.build_record(approach, history, overrides, elapsed_ms, status, result))
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(line + "\n")
+        except Exception as error:
+            # Recording must never fail the request it describes
+            logging.warning(f"Unable to record chat traffic: {str(error)}")
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import defaultdict
+
+# Rolling windows reported by get_metrics, in minutes
+DEFAULT_WINDOWS = {"5m": 5, "1h": 60, "24h": 1440}
+
+
+class TokenUsageTracker:
+    """
+      Aggregates completion token usage into one-minute buckets so usage can be reported over
+      rolling windows without keeping every request.
+      Attributes:
+          prices (dict): Optional cost per 1,000 tokens by model,
+              e.g. {"gpt-4": {"prompt": 0.03, "completion": 0.06}}.
+          windows (dict): Window label to length in minutes.
+      Methods:
+          record(self, approach, persona, response_length, usage): Adds the per-step usage of one request.
+          get_metrics(self): Totals per window, grouped by approach, step, model and persona.
+    """
+
+    def __init__(self, prices: dict = None, windows: dict = None):
+        self.prices = prices or {}
+        self.windows = windows or DEFAULT_WINDOWS
+        self._retention_minutes = max(self.windows.values())
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        price = self.prices.get(model)
+        if not price:
+            return 0.0
+        return (prompt_tokens * price.get("prompt", 0) + completion_tokens * price.get("completion", 0)) / 1000
+
+    def record(self, approach: str, persona: str, response_length: int, usage: dict):
+        """
+        usage maps each step ("rewrite", "answer") to the model, deployment, token counts and
+        latency of its completion call, as returned by the approach.
+        """
+        minute = int(time.time() // 60)
+        with self._lock:
+            bucket = self._buckets.setdefault(minute, defaultdict(lambda: defaultdict(float)))
+            for step, step_usage in usage.items():
+                key = (approach, step, step_usage.get("model", ""), persona or "", response_length)
+                totals = bucket[key]
+                totals["calls"] += 1
+                totals["prompt_tokens"] += step_usage.get("prompt_tokens", 0)
+                totals["completion_tokens"] += step_usage.get("completion_tokens", 0)
+                totals["latency_ms"] += step_usage.get("latency_ms", 0)
+                totals["cost"] += self.cost(step_usage.get("model", ""),
+                                            step_usage.get("prompt_tokens", 0),
+                                            step_usage.get("completion_tokens", 0))
+            for expired in [m for m in self._buckets if m <= minute - self._retention_minutes]:
+                del self._buckets[expired]
+
+    def get_metrics(self) -> dict:
+        now = int(time.time() // 60)
+        with self._lock:
+            buckets = list(self._buckets.items())
+
+        metrics = {}
+        for label, minutes in self.windows.items():
+            grouped = defaultdict(lambda: defaultdict(float))
+            for minute, bucket in buckets:
+                if minute > now - minutes:
+                    for key, totals in bucket.items():
+                        for name, value in totals.items():
+                            grouped[key][name] += value
+
+            rows = []
+            for (approach, step, model, persona, response_length), totals in grouped.items():
+                calls = totals["calls"]
+                rows.append({
+                    "approach": approach,
+                    "step": step,
+                    "model": model,
+                    "persona": persona,
+                    "response_length": response_length,
+                    "calls": int(calls),
+                    "prompt_tokens": int(totals["prompt_tokens"]),
+                    "completion_tokens": int(totals["completion_tokens"]),
+                    "avg_prompt_tokens": totals["prompt_tokens"] / calls,
+                    "avg_completion_tokens": totals["completion_tokens"] / calls,
+                    "avg_latency_ms": totals["latency_ms"] / calls,
+                    "cost": round(totals["cost"], 6),
+                })
+            metrics[label] = sorted(rows, key=lambda row: row["prompt_tokens"] + row["completion_tokens"],
+                                    reverse=True)
+        return metrics
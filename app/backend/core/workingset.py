@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from shared_code.index_watermark import IndexWatermark
+
+
+class ConversationWorkingSet:
+    """
+      The chunks a conversation has already retrieved, by chunk id. Later turns rank without
+      downloading content and only fetch the chunks the conversation has not seen yet.
+      Attributes:
+          ttl_seconds (float): How long an idle conversation is kept. 0 disables the working set.
+          max_conversations (int): Least recently used conversations are dropped beyond this.
+          max_chunks (int): Chunks kept per conversation, least recently used are dropped.
+          min_reuse (float): Share of its previous turn's hits a conversation must already have
+              held before its next turn ranks without content.
+          watermark (IndexWatermark): Read at most every watermark_refresh_seconds. When the
+              indexing pipeline moves it, every conversation is dropped.
+      Methods:
+          make_key(history, overrides): Key of a conversation after the given turns.
+          advance(self, previous_key, key): Carries a conversation over to its next turn's key.
+          expects_reuse(self, key): Whether the conversation's next hits are likely already held.
+          get(self, key, chunk_ids): Content of the given chunks the conversation already holds.
+          put(self, key, contents): Adds chunk id to content pairs to the conversation.
+          put_hits(self, key, contents): Adds the content of a turn's hits, noting how many
+              the conversation already held.
+          get_metrics(self): Reused and fetched chunk counts.
+    """
+
+    def __init__(self, ttl_seconds: float = 1800, max_conversations: int = 1000, max_chunks: int = 50,
+                 min_reuse: float = 0.5, watermark: IndexWatermark = None,
+                 watermark_refresh_seconds: float = 10):
+        self.ttl_seconds = ttl_seconds
+        self.max_conversations = max_conversations
+        self.max_chunks = max_chunks
+        self.min_reuse = min_reuse
+        self.watermark = watermark
+        self.watermark_refresh_seconds = watermark_refresh_seconds
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._watermark_value = None
+        self._watermark_checked = 0.0
+        self.reused = 0
+        self.fetched = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_conversations > 0
+
+    @staticmethod
+    def make_key(history: list[dict], overrides: dict) -> str:
+        """
+        Key of a conversation after the given turns, scoped to its folder and tag filter so
+        content retrieved under one filter is never served under another. A client-supplied
+        conversation_id override keeps the key stable across turns. Without one, the key is
+        every question asked so far and advance() carries the conversation to it each turn.
+        Content held is only as current as the index watermark, which drops it when the
+        index changes.
+        """
+        scope = [overrides.get("selected_folders") or "", overrides.get("selected_tags") or ""]
+        conversation_id = overrides.get("conversation_id")
+        if conversation_id:
+            payload = json.dumps(["id", str(conversation_id), scope])
+        else:
+            questions = [re.sub(r"\s+", " ", turn.get("user") or "").strip() for turn in history]
+            payload = json.dumps(["questions", questions, scope])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def advance(self, previous_key: str, key: str):
+        """Moves what a conversation holds from the key of its previous turn to its new key"""
+        if previous_key == key:
+            return
+        with self._lock:
+            entry = self._entry(previous_key)
+            if entry is not None:
+                del self._conversations[previous_key]
+                self._conversations[key] = entry
+
+    def _entry(self, key: str, create: bool = False) -> list:
+        """[expiry, chunks by id, share of the last turn's hits already held] of a conversation"""
+        now = time.monotonic()
+        entry = self._conversations.get(key)
+        if entry is not None and entry[0] <= now:
+            del self._conversations[key]
+            entry = None
+        if entry is None:
+            if not create:
+                return None
+            entry = self._conversations[key] = [0.0, OrderedDict(), 0.0]
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        entry[0] = now + self.ttl_seconds
+        self._conversations.move_to_end(key)
+        return entry
+
+    def expects_reuse(self, key: str) -> bool:
+        """
+        Ranking without content costs a second round trip for the chunks not held, which only
+        pays off when most hits are already held. The previous turn's share predicts the next.
+        """
+        if not self.enabled:
+            return False
+        self._check_watermark()
+        with self._lock:
+            entry = self._entry(key)
+            return entry is not None and bool(entry[1]) and entry[2] >= self.min_reuse
+
+    def get(self, key: str, chunk_ids: list[str]) -> dict:
+        self._check_watermark()
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return {}
+            chunks = entry[1]
+            found = {}
+            for chunk_id in chunk_ids:
+                if chunk_id in chunks:
+                    chunks.move_to_end(chunk_id)
+                    found[chunk_id] = chunks[chunk_id]
+            if chunk_ids:
+                entry[2] = len(found) / len(chunk_ids)
+            self.reused += len(found)
+            return found
+
+    def put(self, key: str, contents: dict):
+        if not self.enabled:
+            return
+        self._check_watermark()
+        with self._lock:
+            self._put(self._entry(key, create=True), contents)
+
+    def put_hits(self, key: str, contents: dict):
+        if not self.enabled:
+            return
+        self._check_watermark()
+        with self._lock:
+            entry = self._entry(key, create=True)
+            if contents:
+                entry[2] = sum(1 for chunk_id in contents if chunk_id in entry[1]) / len(contents)
+            self._put(entry, contents)
+
+    def _put(self, entry: list, contents: dict):
+        chunks = entry[1]
+        chunks.update(contents)
+        while len(chunks) > self.max_chunks:
+            chunks.popitem(last=False)
+        self.fetched += len(contents)
+
+    def clear(self):
+        with self._lock:
+            self._conversations.clear()
+
+    def _check_watermark(self):
+        """Drop every conversation once the index has moved past the watermark its content was read at"""
+        if self.watermark is None:
+            return
+        now = time.monotonic()
+        if now - self._watermark_checked < self.watermark_refresh_seconds:
+            return
+        self._watermark_checked = now
+        try:
+            current = self.watermark.read()
+        except Exception as error:
+            logging.warning(f"Unable to read index watermark: {str(error)}")
+            return
+        if current != self._watermark_value:
+            self._watermark_value = current
+            self.clear()
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            chunks = self.reused + self.fetched
+            return {
+                "enabled": self.enabled,
+                "conversations": len(self._conversations),
+                "reused_chunks": self.reused,
+                "fetched_chunks": self.fetched,
+                "reuse_rate": self.reused / chunks if chunks else 0.0,
+            }
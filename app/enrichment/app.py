@@ -5,30 +5,37 @@ import json
 import logging
 import os
 import threading
-import time
 import re
 from datetime import datetime
 from typing import List
 import base64
-import requests
 import random
 from urllib.parse import unquote
-from azure.storage.blob import BlobServiceClient
 from azure.storage.queue import QueueClient, TextBase64EncodePolicy
-from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
-from data_model import (EmbeddingResponse, ModelInfo, ModelListResponse,
-                        StatusResponse)
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+from batching import MicroBatcher
+from chunk_fetcher import ChunkFetcher, create_pooled_blob_service_client
+from index_writer import IndexingError, IndexWriter
+from inference_pool import InferencePool
+from embedding_cache import EmbeddingCache
+from data_model import (BatchEmbeddingResponse, EmbeddingResponse, ModelInfo,
+                        ModelListResponse, StatusResponse)
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from fastapi_utils.tasks import repeat_every
 from model_handling import load_models
+from pipeline import DocumentJob, EmbeddingPipeline
+from queue_consumer import QueueConsumer
+from openai_batching import encode_in_batches
 import openai
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 from sentence_transformers import SentenceTransformer
 from shared_code.utilities_helper import UtilitiesHelper
+from shared_code.index_shards import IndexShardRouter
+from shared_code.index_watermark import IndexWatermark
 from shared_code.status_log import State, StatusClassification, StatusLog
 from shared_code.tags_helper import TagsHelper
+from vector_encoding import DIMENSIONS_HEADER, DTYPE_HEADER, DTYPES, encode_vector_base64, pack_vector
 
 # === ENV Setup ===
 
@@ -37,6 +44,30 @@ ENV = {
     "EMBEDDINGS_QUEUE": None,
     "LOG_LEVEL": "DEBUG", # Will be overwritten by LOG_LEVEL in Environment
     "DEQUEUE_MESSAGE_BATCH_SIZE": 1,
+    "EMBEDDINGS_QUEUE_CONCURRENCY": 4,
+    "EMBEDDINGS_QUEUE_VISIBILITY_TIMEOUT": 300,
+    "EMBEDDINGS_QUEUE_MAX_IDLE_SECONDS": 60,
+    "EMBEDDING_BATCH_SIZE": 32,
+    "AZURE_OPENAI_EMBEDDING_MAX_BATCH_SIZE": 16,
+    "EMBEDDING_MICROBATCH_MAX_SIZE": 32,
+    "EMBEDDING_MICROBATCH_MAX_WAIT_MS": 5,
+    "EMBEDDING_MICROBATCH_CONCURRENCY": 0, # 0 encodes one batch per inference worker at once
+    "INFERENCE_WORKERS": 0,
+    "INFERENCE_TORCH_THREADS": 0,
+    "EMBEDDING_BACKEND": "torch",
+    "ONNX_QUANTIZE": "true",
+    "ONNX_MIN_SIMILARITY": 0.99,
+    "EMBEDDING_CACHE_PATH": "", # SQLite file of the embedding cache, empty disables the cache
+    "EMBEDDING_CACHE_MAX_ENTRIES": 1000000,
+    "EMBEDDING_CACHE_BLOB_PREFIX": "",
+    "CHUNK_FETCH_CONCURRENCY": 16,
+    "PIPELINE_EMBED_WORKERS": 1,
+    "PIPELINE_INDEX_WORKERS": 2,
+    "PIPELINE_QUEUE_SIZE": 8,
+    "INDEX_BATCH_SIZE": 200,
+    "INDEX_MAX_BATCH_BYTES": 12000000,
+    "INDEX_UPLOAD_CONCURRENCY": 4,
+    "INDEX_MAX_RETRIES": 5,
     "AZURE_BLOB_STORAGE_ACCOUNT": None,
     "AZURE_BLOB_STORAGE_CONTAINER": None,
     "AZURE_BLOB_STORAGE_ENDPOINT": None,
@@ -53,6 +84,9 @@ ENV = {
     "AZURE_OPENAI_SERVICE_KEY": None,
     "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME": None,
     "AZURE_SEARCH_INDEX": None,
+    "AZURE_SEARCH_INDEX_SHARD_COUNT": 1,
+    "AZURE_SEARCH_INDEX_SHARD_ROUTING": "folder",
+    "INDEX_WATERMARK_BLOB_NAME": "_index/watermark.json",
     "AZURE_SEARCH_SERVICE_KEY": None,
     "AZURE_SEARCH_SERVICE": None,
     "BLOB_CONNECTION_STRING": None,
@@ -123,9 +157,20 @@ utilities_helper = UtilitiesHelper(
     azure_blob_storage_key=ENV["AZURE_BLOB_STORAGE_KEY"],
 )
 
+index_shard_router = IndexShardRouter(ENV["AZURE_SEARCH_INDEX"],
+                                      ENV["AZURE_SEARCH_INDEX_SHARD_COUNT"],
+                                      ENV["AZURE_SEARCH_INDEX_SHARD_ROUTING"])
+
 statusLog = StatusLog(ENV["COSMOSDB_URL"], ENV["COSMOSDB_KEY"], ENV["COSMOSDB_LOG_DATABASE_NAME"], ENV["COSMOSDB_LOG_CONTAINER_NAME"])
 
 tagsHelper = TagsHelper(ENV["COSMOSDB_URL"], ENV["COSMOSDB_KEY"], ENV["COSMOSDB_TAGS_DATABASE_NAME"], ENV["COSMOSDB_TAGS_CONTAINER_NAME"])
+
+# One pooled storage client for the service, chunks are downloaded through it concurrently
+blob_service_client = create_pooled_blob_service_client(ENV["BLOB_CONNECTION_STRING"],
+                                                        int(ENV["CHUNK_FETCH_CONCURRENCY"]))
+content_container_client = blob_service_client.get_container_client(ENV["AZURE_BLOB_STORAGE_CONTAINER"])
+chunk_fetcher = ChunkFetcher(content_container_client, max_in_flight=int(ENV["CHUNK_FETCH_CONCURRENCY"]))
+
 # === API Setup ===
 
 start_time = datetime.now()
@@ -136,6 +181,22 @@ IS_READY = False
 log.debug("Loading embedding models...")
 models, model_info = load_models()
 
+# Optionally serve the sentence-transformers models with ONNX Runtime, int8 quantized by default
+if ENV["EMBEDDING_BACKEND"].lower() == "onnx":
+    # Imported here so deployments on the default backend never load onnx and onnxruntime
+    from onnx_backend import load_onnx_models
+    models = load_onnx_models(models,
+                              models_path="models/",
+                              quantize=str_to_bool.get(str(ENV["ONNX_QUANTIZE"]).lower(), True),
+                              min_similarity=float(ENV["ONNX_MIN_SIMILARITY"]))
+
+# Optionally run sentence-transformers inference in a pool of worker processes
+inference_pool = None
+if int(ENV["INFERENCE_WORKERS"]) > 0:
+    inference_pool = InferencePool(models,
+                                   workers=int(ENV["INFERENCE_WORKERS"]),
+                                   torch_threads=int(ENV["INFERENCE_TORCH_THREADS"]))
+
 # Add Azure OpenAI Embedding & additional Model
 models["azure-openai_" + ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"]] = AzOAIEmbedding(
     ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"])
@@ -147,6 +208,33 @@ model_info["azure-openai_" + ENV["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"]] = {
 }
 
 log.debug("Models loaded")
+
+# Persistent cache of embeddings by model and text, with an optional tier shared through blob storage
+embedding_cache = None
+if ENV["EMBEDDING_CACHE_PATH"]:
+    embedding_cache = EmbeddingCache(
+        ENV["EMBEDDING_CACHE_PATH"],
+        max_entries=int(ENV["EMBEDDING_CACHE_MAX_ENTRIES"]),
+        container_client=content_container_client if ENV["EMBEDDING_CACHE_BLOB_PREFIX"] else None,
+        blob_prefix=ENV["EMBEDDING_CACHE_BLOB_PREFIX"])
+
+# Concurrent /embed requests for the same model share one encode call
+batchers = {}
+batchers_lock = threading.Lock()
+
+def get_batcher(model: str) -> MicroBatcher:
+    """Returns the micro-batcher of a model, creating it on first use"""
+    with batchers_lock:
+        if model not in batchers:
+            batchers[model] = MicroBatcher(
+                model,
+                lambda texts: encode_texts(model, texts),
+                max_batch_size=int(ENV["EMBEDDING_MICROBATCH_MAX_SIZE"]),
+                max_wait_ms=float(ENV["EMBEDDING_MICROBATCH_MAX_WAIT_MS"]),
+                max_concurrent_batches=(int(ENV["EMBEDDING_MICROBATCH_CONCURRENCY"])
+                                        or max(1, int(ENV["INFERENCE_WORKERS"]))))
+        return batchers[model]
+
 IS_READY = True
 
 # Create API
@@ -189,6 +277,26 @@ def health():
     return output
 
 
+@app.get("/metrics", tags=["health"])
+def metrics():
+    """Returns queue depth and batch size metrics of the embedding micro-batchers, the hit
+    rate of the embedding cache, throughput of the document pipeline stages and counts of
+    the embeddings queue consumer
+
+    Returns:
+        dict: Batching metrics by model, embedding cache, pipeline and queue metrics
+    """
+    with batchers_lock:
+        model_batchers = dict(batchers)
+    return {
+        "batching": {model: batcher.get_metrics() for model, batcher in model_batchers.items()},
+        "embedding_cache": embedding_cache.get_metrics() if embedding_cache is not None else None,
+        "pipeline": {"fetch": chunk_fetcher.get_metrics(), **pipeline.get_metrics()},
+        "index_writer": index_writer.get_metrics(),
+        "queue": queue_consumer.get_metrics(),
+    }
+
+
 # Models and Embeddings
 @app.get("/models", response_model=ModelListResponse, tags=["models"])
 def get_models():
@@ -216,29 +324,90 @@ def get_model(model: str):
     return model_info[model]
 
 
+def get_cache_model_name(model: str) -> str:
+    """Name vectors of a model are cached under, distinct per backend producing them"""
+    # Only ONNX Runtime models have an onnx_path, the export they were loaded from
+    onnx_path = getattr(models[model], "onnx_path", None)
+    if onnx_path:
+        return f"{model}@{os.path.splitext(os.path.basename(onnx_path))[0]}"
+    return model
+
+
+def encode_texts(model: str, texts: List[str]) -> List[List[float]]:
+    """Embeds a list of texts using a given model, one vector per text in input order.
+    Texts already in the embedding cache, or repeated in the list, are not embedded again
+    Args:
+        model (str): The name of the model
+        texts (List[str]): A list of texts
+
+    Returns:
+        List[List[float]]: The embedding of each text
+    """
+    if embedding_cache is None:
+        return encode_uncached(model, texts)
+    cache_model_name = get_cache_model_name(model)
+    keys = [EmbeddingCache.make_key(text) for text in texts]
+    vectors = embedding_cache.get_many(cache_model_name, keys)
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        embedded = dict(zip(missing, encode_uncached(model, list(missing.values()))))
+        embedding_cache.put_many(cache_model_name, embedded)
+        vectors.update(embedded)
+    return [vectors[key] for key in keys]
+
+
+def encode_uncached(model: str, texts: List[str]) -> List[List[float]]:
+    """Embeds a list of texts using a given model, one vector per text in input order"""
+    model_obj = models[model]
+    if model.startswith("azure-openai_"):
+        return encode_in_batches(model_obj.encode, texts, int(ENV["AZURE_OPENAI_EMBEDDING_MAX_BATCH_SIZE"]))
+    if inference_pool is not None:
+        return inference_pool.encode(model, texts)
+    return model_obj.encode(texts).tolist()
+
+
 @app.post("/models/{model}/embed", response_model=EmbeddingResponse, tags=["models"])
-def embed_texts(model: str, texts: List[str]):
-    """Embeds a list of texts using a given model
+def embed_texts(model: str, texts: List[str], request: Request, encoding: str = "float", dtype: str = "float32"):
+    """Embeds a text using a given model. Only the first text is embedded, use
+    /models/{model}/embed_batch to embed several.
+
+    With Accept: application/octet-stream the vector is returned as raw little-endian dtype
+    values, its dimensions and dtype in the X-Embedding-Dimensions and X-Embedding-Dtype
+    headers. With encoding=base64 data holds the same bytes base64 encoded. Both skip response
+    validation and are several times smaller than a JSON float array.
     Args:
         model (str): The name of the model
         texts (List[str]): A list of texts
+        encoding (str): float for a JSON float array, base64 for packed binary
+        dtype (str): float32 or float16, for binary responses
 
     Returns:
-        EmbeddingResponse: The embeddings of the texts
+        EmbeddingResponse: The embedding of the first text
     """
 
     output = {}
     if model not in models:
         return {"message": f"Model {model} not found"}
+    binary = "application/octet-stream" in request.headers.get("accept", "")
+    if (binary or encoding == "base64") and dtype not in DTYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported dtype {dtype}, use one of {', '.join(DTYPES)}")
 
-    model_obj = models[model]
     try:
-        if model.startswith("azure-openai_"):
-            embeddings = model_obj.encode(texts)
-            embeddings = embeddings['data'][0]['embedding']
-        else:
-            embeddings = model_obj.encode(texts)
-            embeddings = embeddings.tolist()[0]
+        embeddings = get_batcher(model).submit(texts[:1])[0]
+
+        if binary:
+            return Response(content=pack_vector(embeddings, dtype),
+                            media_type="application/octet-stream",
+                            headers={DIMENSIONS_HEADER: str(len(embeddings)), DTYPE_HEADER: dtype})
+        if encoding == "base64":
+            return JSONResponse(content={
+                "model": model,
+                "model_info": model_info[model],
+                "data": encode_vector_base64(embeddings, dtype),
+                "encoding": "base64",
+                "dtype": dtype,
+                "dimensions": len(embeddings),
+            })
 
         output = {
             "model": model,
@@ -253,17 +422,61 @@ def embed_texts(model: str, texts: List[str]):
     return output
 
 
+@app.post("/models/{model}/embed_batch", response_model=BatchEmbeddingResponse, tags=["models"])
+def embed_batch(model: str, texts: List[str]):
+    """Embeds a list of texts using a given model
+    Args:
+        model (str): The name of the model
+        texts (List[str]): A list of texts
+
+    Returns:
+        BatchEmbeddingResponse: The embedding of each text, with its index in texts
+    """
+
+    output = {}
+    if model not in models:
+        return {"message": f"Model {model} not found"}
+
+    try:
+        embeddings = encode_texts(model, texts)
+
+        output = {
+            "model": model,
+            "model_info": model_info[model],
+            "data": [{"index": i, "embedding": embedding} for i, embedding in enumerate(embeddings)]
+        }
+
+    except Exception as error:
+        logging.error(f"Failed to embed: {str(error)}")
+        raise HTTPException(status_code=500, detail=f"Failed to embed: {str(error)}") from error
+
+    return output
 
-def index_sections(chunks):
-    """ Pushes a batch of content to the search index
-    """    
-    search_client = SearchClient(endpoint=ENV["AZURE_SEARCH_SERVICE_ENDPOINT"],
-                                    index_name=ENV["AZURE_SEARCH_INDEX"],
-                                    credential=search_creds)    
 
-    results = search_client.upload_documents(documents=chunks)
-    succeeded = sum([1 for r in results if r.succeeded])
-    log.debug(f"\tIndexed {len(results)} chunks, {succeeded} succeeded")
+def embed_chunks(model: str, index_chunks):
+    """ Adds the content vector to a batch of index chunks, embedding their content in one call
+    """
+    embeddings = encode_texts(model, [index_chunk['content'] for index_chunk in index_chunks])
+    for index_chunk, embedding in zip(index_chunks, embeddings):
+        index_chunk['contentVector'] = embedding
+    return index_chunks
+
+# Pushes chunks to the search index shards they route to, in size-bounded concurrent batches
+index_writer = IndexWriter(ENV["AZURE_SEARCH_SERVICE_ENDPOINT"],
+                           search_creds,
+                           index_shard_router,
+                           max_batch_bytes=int(ENV["INDEX_MAX_BATCH_BYTES"]),
+                           concurrency=int(ENV["INDEX_UPLOAD_CONCURRENCY"]),
+                           max_retries=int(ENV["INDEX_MAX_RETRIES"]))
+
+# Chunks are fetched by the poller, then embedded and uploaded by the pipeline's own workers
+pipeline = EmbeddingPipeline(embed_chunks,
+                             index_writer.write,
+                             embed_workers=int(ENV["PIPELINE_EMBED_WORKERS"]),
+                             embed_batch_size=int(ENV["EMBEDDING_BATCH_SIZE"]),
+                             index_workers=int(ENV["PIPELINE_INDEX_WORKERS"]),
+                             index_batch_size=int(ENV["INDEX_BATCH_SIZE"]),
+                             queue_size=int(ENV["PIPELINE_QUEUE_SIZE"]))
 
 def get_tags_and_upload_to_cosmos(blob_service_client, blob_path):
     """ Gets the tags from the blob metadata and uploads them to cosmos db"""
@@ -285,6 +498,47 @@ def get_tags_and_upload_to_cosmos(blob_service_client, blob_path):
     tagsHelper.upsert_document(blob_path, tags_list)
     return tags_list
 
+def build_index_chunk(chunk_name, chunk_dict, file_directory, folder_hierarchy, tags_by_file):
+    """ Creates the search index document of a chunk, without its content vector. Tags are looked
+    up once per source file, tags_by_file holds those already looked up
+    """
+    try:
+        text = (
+            chunk_dict["translated_title"] + " \n " +
+            chunk_dict["translated_subtitle"] + " \n " +
+            chunk_dict["translated_section"] + " \n " +
+            chunk_dict["translated_content"]
+        )
+    except KeyError:
+        text = (
+            chunk_dict["title"] + " \n " +
+            chunk_dict["subtitle"] + " \n " +
+            chunk_dict["section"] + " \n " +
+            chunk_dict["content"]
+        )
+
+    if chunk_dict["file_name"] not in tags_by_file:
+        tags_by_file[chunk_dict["file_name"]] = get_tags_and_upload_to_cosmos(blob_service_client,
+                                                                              chunk_dict["file_name"])
+
+    index_chunk = {}
+    index_chunk['id'] = statusLog.encode_document_id(chunk_name)
+    index_chunk['processed_datetime'] = f"{chunk_dict['processed_datetime']}+00:00"
+    index_chunk['file_name'] = chunk_dict["file_name"]
+    index_chunk['file_uri'] = chunk_dict["file_uri"]
+    index_chunk['folder'] = file_directory[:-1]
+    index_chunk['folder_hierarchy'] = folder_hierarchy
+    index_chunk['tags'] = tags_by_file[chunk_dict["file_name"]]
+    index_chunk['chunk_file'] = chunk_name
+    index_chunk['file_class'] = chunk_dict["file_class"]
+    index_chunk['title'] = chunk_dict["title"]
+    index_chunk['pages'] = chunk_dict["pages"]
+    index_chunk['translated_title'] = chunk_dict["translated_title"]
+    index_chunk['content'] = text
+    index_chunk['entities'] = chunk_dict["entities"]
+    index_chunk['key_phrases'] = chunk_dict["key_phrases"]
+    return index_chunk
+
 @app.on_event("startup") 
 def startup_event():
     poll_thread = threading.Thread(target=poll_queue_thread)
@@ -292,150 +546,148 @@ def startup_event():
     poll_thread.start()
 
 def poll_queue_thread():
-    while True:
-        poll_queue()
-        time.sleep(5)     
-        
-def poll_queue() -> None:
-    """Polls the queue for messages and embeds them"""
-    
-    if IS_READY == False:
-        log.debug("Skipping poll_queue call, models not yet loaded")
-        return
-    
-    queue_client = QueueClient.from_connection_string(
-        conn_str=ENV["BLOB_CONNECTION_STRING"], queue_name=ENV["EMBEDDINGS_QUEUE"]
-    )
-
-    log.debug("Polling embeddings queue for messages...")
-    response = queue_client.receive_messages(max_messages=int(ENV["DEQUEUE_MESSAGE_BATCH_SIZE"]))
-    messages = [x for x in response]
-
-    if not messages:
-        log.debug("No messages to process. Waiting for a couple of minutes...")
-        time.sleep(120)  # Sleep for 2 minutes
-        return
+    queue_consumer.run()
 
+def process_message(message) -> None:
+    """Embeds and indexes the chunks of the document of a queue message. Failures are
+    requeued with a backoff, up to MAX_EMBEDDING_REQUEUE_COUNT times"""
     target_embeddings_model = re.sub(r'[^a-zA-Z0-9_\-.]', '_', ENV["TARGET_EMBEDDINGS_MODEL"])
 
-    # Remove from queue to prevent duplicate processing from any additional instances
-    for message in messages:
-        queue_client.delete_message(message)
-    
-    for message in messages:       
-        message_b64 = message.content
-        message_json = json.loads(base64.b64decode(message_b64))
+    try:
+        message_json = json.loads(base64.b64decode(message.content))
         blob_path = message_json["blob_name"]
+    except (ValueError, KeyError, TypeError) as error:
+        # Nothing to retry or report against, the message is dropped
+        log.error(f"Dropping malformed embeddings queue message {message.id}: {str(error)}")
+        return
 
-        try:  
-            statusLog.upsert_document(blob_path, f'Embeddings process started with model {target_embeddings_model}', StatusClassification.INFO, State.PROCESSING)
-        
-            file_name, file_extension, file_directory  = utilities_helper.get_filename_and_extension(blob_path)
-            chunk_folder_path = file_directory + file_name + file_extension
-            blob_service_client = BlobServiceClient.from_connection_string(ENV["BLOB_CONNECTION_STRING"])
-            container_client = blob_service_client.get_container_client(ENV["AZURE_BLOB_STORAGE_CONTAINER"])
-            index_chunks = []
-
-            # Iterate over the chunks in the container
-            chunk_list = container_client.list_blobs(name_starts_with=chunk_folder_path)
-            chunks = list(chunk_list)
-            i = 0
-            for chunk in chunks:
-
-                statusLog.update_document_state( blob_path, f"Indexing {i+1}/{len(chunks)}")
-                # open the file and extract the content
-                blob_path_plus_sas = utilities_helper.get_blob_and_sas(
-                    ENV["AZURE_BLOB_STORAGE_CONTAINER"] + '/' + chunk.name)
-                response = requests.get(blob_path_plus_sas)
-                response.raise_for_status()
-                chunk_dict = json.loads(response.text)
-
-                # create the json to be indexed
-                try:
-                    text = (
-                        chunk_dict["translated_title"] + " \n " +
-                        chunk_dict["translated_subtitle"] + " \n " +
-                        chunk_dict["translated_section"] + " \n " +
-                        chunk_dict["translated_content"]
-                    )
-                except KeyError:
-                    text = (
-                        chunk_dict["title"] + " \n " +
-                        chunk_dict["subtitle"] + " \n " +
-                        chunk_dict["section"] + " \n " +
-                        chunk_dict["content"]
-                    )
-
-                # create embedding
-                embedding = embed_texts(target_embeddings_model, [text])
-                embedding_data = embedding['data']
-
-                tag_list = get_tags_and_upload_to_cosmos(blob_service_client, chunk_dict["file_name"])
-
-                index_chunk = {}
-                index_chunk['id'] = statusLog.encode_document_id(chunk.name)
-                index_chunk['processed_datetime'] = f"{chunk_dict['processed_datetime']}+00:00"
-                index_chunk['file_name'] = chunk_dict["file_name"]
-                index_chunk['file_uri'] = chunk_dict["file_uri"]
-                index_chunk['folder'] = file_directory[:-1]
-                index_chunk['tags'] = tag_list
-                index_chunk['chunk_file'] = chunk.name
-                index_chunk['file_class'] = chunk_dict["file_class"]
-                index_chunk['title'] = chunk_dict["title"]
-                index_chunk['pages'] = chunk_dict["pages"]
-                index_chunk['translated_title'] = chunk_dict["translated_title"]
-                index_chunk['content'] = text
-                index_chunk['contentVector'] = embedding_data
-                index_chunk['entities'] = chunk_dict["entities"]
-                index_chunk['key_phrases'] = chunk_dict["key_phrases"]
-                index_chunks.append(index_chunk)
+    try:  
+        statusLog.upsert_document(blob_path, f'Embeddings process started with model {target_embeddings_model}', StatusClassification.INFO, State.PROCESSING)
+
+        file_name, file_extension, file_directory  = utilities_helper.get_filename_and_extension(blob_path)
+        chunk_folder_path = file_directory + file_name + file_extension
+        folder_hierarchy = utilities_helper.get_folder_hierarchy(file_directory)
+        job = DocumentJob(blob_path, target_embeddings_model)
+        pending_chunks = []
+        tags_by_file = {}
+        embedding_batch_size = int(ENV["EMBEDDING_BATCH_SIZE"])
+
+        # Iterate over the chunks in the container
+        chunk_list = content_container_client.list_blobs(name_starts_with=chunk_folder_path)
+        chunks = list(chunk_list)
+        i = 0
+        try:
+            # download the chunks ahead of embedding, in listing order
+            for chunk_name, chunk_dict in chunk_fetcher.fetch(chunk.name for chunk in chunks):
+                if job.failed:
+                    break
+                index_chunk = build_index_chunk(chunk_name, chunk_dict, file_directory,
+                                                folder_hierarchy, tags_by_file)
+                pending_chunks.append(index_chunk)
                 i += 1
-                
-                # push batch of content to index
-                if i % 200 == 0:
-                    index_sections(index_chunks)
-                    index_chunks = []
-
-            # push remainder chunks content to index
-            if len(index_chunks) > 0:
-                index_sections(index_chunks)
 
-            statusLog.upsert_document(blob_path,
-                                      'Embeddings process complete',
-                                      StatusClassification.INFO, State.COMPLETE)
+                # hand a batch of chunks to the pipeline to embed and index
+                if len(pending_chunks) >= embedding_batch_size:
+                    statusLog.update_document_state(blob_path, f"Indexing {i}/{len(chunks)}")
+                    pipeline.submit(job, pending_chunks)
+                    pending_chunks = []
 
+            # submit the remainder chunks
+            if len(pending_chunks) > 0:
+                statusLog.update_document_state(blob_path, f"Indexing {i}/{len(chunks)}")
+                pipeline.submit(job, pending_chunks)
         except Exception as error:
-            # Dequeue message and update the embeddings queued count to limit the max retries
-            try:
-                requeue_count = message_json['embeddings_queued_count']
-            except KeyError:
-                requeue_count = 0
-            requeue_count += 1
-
-            if requeue_count <= int(ENV["MAX_EMBEDDING_REQUEUE_COUNT"]):
-                message_json['embeddings_queued_count'] = requeue_count
-                # Requeue with a random backoff within limits
-                queue_client = QueueClient.from_connection_string(
-                    ENV["BLOB_CONNECTION_STRING"], 
-                    ENV["EMBEDDINGS_QUEUE"], 
-                    message_encode_policy=TextBase64EncodePolicy())
-                message_string = json.dumps(message_json)
-                max_seconds = int(ENV["EMBEDDING_REQUEUE_BACKOFF"]) * (requeue_count**2)
-                backoff = random.randint(
-                    int(ENV["EMBEDDING_REQUEUE_BACKOFF"]) * requeue_count, max_seconds)                
-                queue_client.send_message(message_string, visibility_timeout=backoff)
-                statusLog.upsert_document(blob_path, f'Message requed to embeddings queue, attempt {str(requeue_count)}. Visible in {str(backoff)} seconds. Error: {str(error)}.',
-                                          StatusClassification.ERROR,
-                                          State.QUEUED)
-            else:
-                # max retries has been reached
-                statusLog.upsert_document(
-                    blob_path,
-                    f"An error occurred, max requeue limit was reached. Error description: {str(error)}",
-                    StatusClassification.ERROR,
-                    State.ERROR,
-                )
+            job.fail(error)
+            raise
+        finally:
+            job.close()
+
+        # wait for the pipeline to embed and index every chunk
+        job.wait()
+
+        statusLog.upsert_document(blob_path, f'Indexed {job.indexed} of {len(chunks)} chunks',
+                                  StatusClassification.DEBUG, State.PROCESSING)
 
+        # let readers know cached search results may now be stale
+        IndexWatermark(content_container_client, ENV["INDEX_WATERMARK_BLOB_NAME"]).publish(blob_path)
+
+        statusLog.upsert_document(blob_path,
+                                  'Embeddings process complete',
+                                  StatusClassification.INFO, State.COMPLETE)
+
+    except Exception as error:
+        if isinstance(error, IndexingError):
+            # only raised by job.wait(), once every chunk has been through the pipeline
+            record_status(blob_path, f"Indexed {job.indexed} of {len(chunks)} chunks",
+                          StatusClassification.ERROR, State.PROCESSING)
+            # record every chunk the search service rejected and why, over as many status
+            # entries as it takes to keep each one a readable size
+            messages = error.describe(lambda key: base64.urlsafe_b64decode(key).decode(),
+                                      max_length=STATUS_MAX_LENGTH)
+            for number, message in enumerate(messages, 1):
+                record_status(blob_path,
+                              f"{len(error.failed)} chunks failed to index ({number}/{len(messages)}): {message}",
+                              StatusClassification.ERROR, State.PROCESSING)
+
+        # Dequeue message and update the embeddings queued count to limit the max retries
+        try:
+            requeue_count = message_json['embeddings_queued_count']
+        except KeyError:
+            requeue_count = 0
+        requeue_count += 1
+
+        if requeue_count <= int(ENV["MAX_EMBEDDING_REQUEUE_COUNT"]):
+            message_json['embeddings_queued_count'] = requeue_count
+            # Requeue with a random backoff within limits
+            queue_client = QueueClient.from_connection_string(
+                ENV["BLOB_CONNECTION_STRING"], 
+                ENV["EMBEDDINGS_QUEUE"], 
+                message_encode_policy=TextBase64EncodePolicy())
+            message_string = json.dumps(message_json)
+            max_seconds = int(ENV["EMBEDDING_REQUEUE_BACKOFF"]) * (requeue_count**2)
+            backoff = random.randint(
+                int(ENV["EMBEDDING_REQUEUE_BACKOFF"]) * requeue_count, max_seconds)                
+            # If this fails the message is not deleted and will be retried, once it succeeds
+            # nothing below may raise or the requeued message would be duplicated
+            queue_client.send_message(message_string, visibility_timeout=backoff)
+            record_status(blob_path, f'Message requed to embeddings queue, attempt {str(requeue_count)}. Visible in {str(backoff)} seconds. Error: {str(error)}.',
+                          StatusClassification.ERROR,
+                          State.QUEUED)
+        else:
+            # max retries has been reached
+            record_status(
+                blob_path,
+                f"An error occurred, max requeue limit was reached. Error description: {str(error)}",
+                StatusClassification.ERROR,
+                State.ERROR,
+            )
+
+    try:
         statusLog.save_document(blob_path)
+    except Exception as error:
+        log.warning(f"Unable to save the status of {blob_path}: {str(error)}")
 
+# Longest list of failed chunks written to one status log entry
+STATUS_MAX_LENGTH = 4000
 
+def record_status(blob_path, status, status_classification, state):
+    """ Records a status once the outcome of a message is decided. A status log outage is
+    logged rather than raised, so the message is not processed or requeued again
+    """
+    try:
+        statusLog.upsert_document(blob_path, status, status_classification, state)
+    except Exception as error:
+        log.warning(f"Unable to record status of {blob_path}: {str(error)}")
+
+# Messages are processed concurrently, each under a lease that is extended while it is worked on
+queue_consumer = QueueConsumer(
+    QueueClient.from_connection_string(conn_str=ENV["BLOB_CONNECTION_STRING"], queue_name=ENV["EMBEDDINGS_QUEUE"]),
+    process_message,
+    concurrency=int(ENV["EMBEDDINGS_QUEUE_CONCURRENCY"]),
+    max_messages_per_receive=int(ENV["DEQUEUE_MESSAGE_BATCH_SIZE"]),
+    max_dequeue_count=int(ENV["MAX_EMBEDDING_REQUEUE_COUNT"]),
+    poison_queue_client=QueueClient.from_connection_string(conn_str=ENV["BLOB_CONNECTION_STRING"],
+                                                           queue_name=ENV["EMBEDDINGS_QUEUE"] + "-poison"),
+    visibility_timeout=int(ENV["EMBEDDINGS_QUEUE_VISIBILITY_TIMEOUT"]),
+    max_idle_seconds=float(ENV["EMBEDDINGS_QUEUE_MAX_IDLE_SECONDS"]),
+    is_ready=lambda: IS_READY)
@@ -0,0 +1,117 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List
+
+# Upper bounds of the batch size histogram reported in metrics
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent embedding requests for one model into a single encode call.
+
+    Requests wait up to max_wait_ms for others to join them, or until max_batch_size texts
+    are queued, are encoded in one forward pass and each caller gets back its own vectors.
+    Up to max_concurrent_batches batches encode at once, e.g. one per inference worker.
+    The next batch is only collected once one of them finishes, so requests keep joining it
+    while every slot is busy.
+    """
+    def __init__(self, name: str, encode: Callable[[List[str]], List[List[float]]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5, max_concurrent_batches: int = 1) -> None:
+        self.name = name
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.max_concurrent_batches = max_concurrent_batches
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max_concurrent_batches)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_batches,
+                                           thread_name_prefix=f"batcher-{name}-encode")
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.batched_requests = 0
+        self.max_queue_depth = 0
+        self.queue_wait_seconds = 0.0
+        self.batch_size_counts = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS + ["more"]}
+        worker = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        worker.start()
+
+    def submit(self, texts: List[str]) -> List[List[float]]:
+        """Embeds texts as part of the next batch, blocking until its vectors are ready"""
+        future = Future()
+        self._queue.put((texts, future, time.monotonic()))
+        with self._lock:
+            self.requests += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return future.result()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait_seconds
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _record(self, batch: list, size: int):
+        now = time.monotonic()
+        bucket = next((b for b in BATCH_SIZE_BUCKETS if size <= b), "more")
+        with self._lock:
+            self.batches += 1
+            self.texts += size
+            self.batched_requests += len(batch)
+            self.queue_wait_seconds += sum(now - enqueued for _, _, enqueued in batch)
+            self.batch_size_counts[bucket] += 1
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            batch = self._collect()
+            self.executor.submit(self._encode_batch, batch)
+
+    def _encode_batch(self, batch: list):
+        try:
+            texts = [text for item_texts, _, _ in batch for text in item_texts]
+            self._record(batch, len(texts))
+            try:
+                embeddings = self.encode(texts)
+            except Exception as error:
+                logging.error(f"Batch of {len(texts)} texts failed to embed with {self.name}: {str(error)}")
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                return
+            offset = 0
+            for item_texts, future, _ in batch:
+                future.set_result(embeddings[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+        finally:
+            self._slots.release()
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_concurrent_batches": self.max_concurrent_batches,
+                "max_queue_depth": self.max_queue_depth,
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "avg_requests_per_batch": self.batched_requests / self.batches if self.batches else 0.0,
+                "avg_queue_wait_ms": (self.queue_wait_seconds * 1000 / self.batched_requests
+                                      if self.batched_requests else 0.0),
+                "batch_sizes": {f"<={bucket}" if bucket != "more" else f">{BATCH_SIZE_BUCKETS[-1]}": count
+                                for bucket, count in self.batch_size_counts.items()},
+            }
@@ -0,0 +1,73 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Compares embedding throughput and accuracy of the PyTorch and ONNX Runtime backends for a
+sentence-transformers model. Run from app/enrichment, e.g.
+    python benchmark_onnx.py --model BAAI/bge-small-en-v1.5 --texts 512
+'''
+import argparse
+import os
+import random
+import re
+import time
+
+import torch
+from sentence_transformers import SentenceTransformer
+from onnx_backend import PARITY_SENTENCES, OnnxEmbeddingModel, export_onnx, parity
+
+WORDS = [
+    "policy", "energy", "transport", "budget", "report", "program", "funding", "annual",
+    "regional", "services", "public", "health", "housing", "plan", "review", "data",
+    "water", "climate", "education", "safety", "infrastructure", "grant", "agency", "the",
+    "of", "and", "for", "in", "was", "will", "be", "to", "by", "with", "from", "their",
+]
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="BAAI/bge-small-en-v1.5", help="sentence-transformers model name")
+    parser.add_argument("--models_path", default="models/", help="Where exported models are written")
+    parser.add_argument("--texts", type=int, default=512, help="Number of texts to embed")
+    parser.add_argument("--words", type=int, default=200, help="Words per text, about one chunk")
+    parser.add_argument("--batch_size", type=int, default=32, help="Texts per forward pass")
+    parser.add_argument("--threads", type=int, default=0, help="Inference threads, 0 for the torch default")
+    return parser.parse_args()
+
+def make_texts(count: int, words: int) -> list:
+    rng = random.Random(42)
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(count)]
+
+def throughput(model, texts: list, batch_size: int) -> float:
+    """Texts embedded per second, after a warm up pass"""
+    model.encode(texts[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size)
+    return len(texts) / (time.perf_counter() - start)
+
+def main():
+    args = parse_arguments()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    st_model = SentenceTransformer(args.model)
+    output_dir = os.path.join(args.models_path, re.sub(r'[^a-zA-Z0-9_\-.]', '_', args.model), "onnx")
+    texts = make_texts(args.texts, args.words)
+    parity_texts = PARITY_SENTENCES + texts[:8]
+
+    backends = [
+        ("pytorch", st_model),
+        ("onnx", OnnxEmbeddingModel(st_model, export_onnx(st_model, output_dir, quantize=False))),
+        ("onnx-int8", OnnxEmbeddingModel(st_model, export_onnx(st_model, output_dir, quantize=True))),
+    ]
+    baseline = None
+    print(f"{args.model}: {args.texts} texts of {args.words} words, batch size {args.batch_size}, "
+          f"{torch.get_num_threads()} threads")
+    print(f"{'backend':<12}{'texts/s':>10}{'speedup':>10}{'min cosine':>12}")
+    for name, model in backends:
+        rate = throughput(model, texts, args.batch_size)
+        baseline = baseline or rate
+        similarity = parity(st_model, model, parity_texts)
+        print(f"{name:<12}{rate:>10.1f}{rate / baseline:>9.2f}x{similarity:>12.5f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Tuple
+
+import requests
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient
+from requests.adapters import HTTPAdapter
+
+
+def create_pooled_blob_service_client(connection_string: str, pool_size: int) -> BlobServiceClient:
+    """A blob service client whose connection pool can hold pool_size concurrent downloads.
+    The default pool keeps 10 connections, extra downloads would open and drop their own."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return BlobServiceClient.from_connection_string(
+        connection_string, transport=RequestsTransport(session=session, session_owner=False))
+
+
+class ChunkFetcher(object):
+    """Downloads chunk blobs with up to max_in_flight downloads at once across all documents,
+    yielding each parsed chunk in the order its name was given.
+
+    Downloads run ahead of the consumer by at most max_in_flight chunks, so storage latency
+    overlaps with embedding the chunks already fetched instead of adding to it.
+    """
+    def __init__(self, container_client, max_in_flight: int = 16) -> None:
+        self.container_client = container_client
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="chunk-fetch")
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.bytes = 0
+        self.download_seconds = 0.0
+        self.consumer_wait_seconds = 0.0
+
+    def _download(self, blob_name: str) -> dict:
+        started = time.monotonic()
+        content = self.container_client.download_blob(blob_name).readall()
+        with self._lock:
+            self.chunks += 1
+            self.bytes += len(content)
+            self.download_seconds += time.monotonic() - started
+        return json.loads(content.decode("utf-8"))
+
+    def _result(self, future) -> dict:
+        started = time.monotonic()
+        result = future.result()
+        with self._lock:
+            self.consumer_wait_seconds += time.monotonic() - started
+        return result
+
+    def fetch(self, blob_names: Iterable[str]) -> Iterator[Tuple[str, dict]]:
+        """Yields (blob name, chunk) pairs in input order"""
+        blob_names = iter(blob_names)
+        in_flight = deque()
+        try:
+            for blob_name in blob_names:
+                in_flight.append((blob_name, self.executor.submit(self._download, blob_name)))
+                if len(in_flight) >= self.max_in_flight:
+                    name, future = in_flight.popleft()
+                    yield name, self._result(future)
+            while in_flight:
+                name, future = in_flight.popleft()
+                yield name, self._result(future)
+        finally:
+            # The consumer stopped early or a download failed, drop what is still queued
+            for _, future in in_flight:
+                future.cancel()
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "chunks": self.chunks,
+                "bytes": self.bytes,
+                "avg_download_ms": self.download_seconds * 1000 / self.chunks if self.chunks else 0.0,
+                "chunks_per_download_second": self.chunks / self.download_seconds if self.download_seconds else 0.0,
+                # Time consumers waited on downloads, near zero when fetching keeps ahead
+                "consumer_wait_seconds": self.consumer_wait_seconds,
+            }
@@ -25,6 +25,12 @@ class EmbeddingResponse(pydantic.BaseModel):
     model_info: ModelInfo
 
 
+class BatchEmbeddingResponse(pydantic.BaseModel):
+    data: List[Embedding]
+    model: str
+    model_info: ModelInfo
+
+
 class EmbeddingRequest(pydantic.BaseModel):
     sentences: List[str]
 
@@ -0,0 +1,167 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from azure.core.exceptions import ResourceNotFoundError
+
+
+class EmbeddingCache(object):
+    """A persistent cache of embeddings keyed by model and the SHA-256 of the exact text.
+
+    Vectors are kept as float32 in a local SQLite file, shared by the worker processes of
+    the service and kept across restarts. An optional blob tier under a prefix of a container
+    shares vectors between instances: local misses are looked up there and new vectors are
+    written to both tiers. Blob writes run in the background, at most max_pending_blob_writes
+    of them queued, so callers only wait for the local tier.
+    """
+    def __init__(self, path: str, max_entries: int = 1000000, container_client=None,
+                 blob_prefix: str = "", blob_workers: int = 8, max_pending_blob_writes: int = 10000) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.container_client = container_client
+        self.blob_prefix = blob_prefix
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, created REAL NOT NULL, "
+            "PRIMARY KEY (model, hash)) WITHOUT ROWID")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)")
+        self._connection.commit()
+        self.max_pending_blob_writes = max_pending_blob_writes
+        self._executor = ThreadPoolExecutor(max_workers=blob_workers) if container_client else None
+        self._blob_writer = ThreadPoolExecutor(max_workers=blob_workers,
+                                               thread_name_prefix="embedding-cache-upload") if container_client else None
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.local_hits = 0
+        self.blob_hits = 0
+        self.misses = 0
+        self.pending_blob_writes = 0
+        self.dropped_blob_writes = 0
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _pack(vector: List[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _unpack(data: bytes) -> List[float]:
+        vector = array("f")
+        vector.frombytes(data)
+        return vector.tolist()
+
+    def _blob_name(self, model: str, key: str) -> str:
+        return f"{self.blob_prefix}{model}/{key}"
+
+    def _get_blob(self, model: str, key: str):
+        try:
+            return self.container_client.get_blob_client(self._blob_name(model, key)).download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+        except Exception as error:
+            logging.warning(f"Unable to read cached embedding {key} of {model}: {str(error)}")
+            return None
+
+    def _put_blob(self, model: str, key: str, data: bytes):
+        try:
+            self.container_client.get_blob_client(self._blob_name(model, key)).upload_blob(data, overwrite=True)
+        except Exception as error:
+            # The vector is still cached locally, other instances will embed it themselves
+            logging.warning(f"Unable to share cached embedding {key} of {model}: {str(error)}")
+        finally:
+            with self._lock:
+                self.pending_blob_writes -= 1
+
+    def get_many(self, model: str, keys: List[str]) -> Dict[str, List[float]]:
+        """Returns the cached vectors of the given keys, omitting keys not cached"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk]).fetchall()
+                found.update((key, data) for key, data in rows)
+        local_hits = len(found)
+
+        missing = [key for key in keys if key not in found]
+        shared = {}
+        if missing and self._executor is not None:
+            blobs = self._executor.map(lambda key: self._get_blob(model, key), missing)
+            shared = {key: data for key, data in zip(missing, blobs) if data is not None}
+            if shared:
+                self._put_local(model, shared)
+            found.update(shared)
+
+        with self._lock:
+            self.local_hits += local_hits
+            self.blob_hits += len(shared)
+            self.misses += len(keys) - len(found)
+        return {key: self._unpack(data) for key, data in found.items()}
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]):
+        """Caches vectors by key locally, and queues them for the blob tier"""
+        packed = {key: self._pack(vector) for key, vector in vectors.items()}
+        self._put_local(model, packed)
+        if self._blob_writer is None:
+            return
+        for key, data in packed.items():
+            with self._lock:
+                # Behind on uploads, other instances will embed what is dropped themselves
+                if self.pending_blob_writes >= self.max_pending_blob_writes:
+                    self.dropped_blob_writes += 1
+                    continue
+                self.pending_blob_writes += 1
+            self._blob_writer.submit(self._put_blob, model, key, data)
+
+    def _put_local(self, model: str, packed: Dict[str, bytes]):
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector, created) VALUES (?, ?, ?, ?)",
+                [(model, key, data, now) for key, data in packed.items()])
+            self._connection.commit()
+            self._writes_since_prune += len(packed)
+            if self._writes_since_prune >= max(1000, self.max_entries // 100):
+                self._writes_since_prune = 0
+                self._prune()
+
+    def _prune(self):
+        """Drops the oldest vectors beyond max_entries, called with the lock held"""
+        count = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE (model, hash) IN "
+                "(SELECT model, hash FROM embeddings ORDER BY created LIMIT ?)",
+                (count - self.max_entries,))
+            self._connection.commit()
+            logging.info(f"Pruned {count - self.max_entries} cached embeddings")
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            lookups = self.local_hits + self.blob_hits + self.misses
+            return {
+                "lookups": lookups,
+                "local_hits": self.local_hits,
+                "blob_hits": self.blob_hits,
+                "misses": self.misses,
+                "hit_rate": (self.local_hits + self.blob_hits) / lookups if lookups else 0.0,
+                "pending_blob_writes": self.pending_blob_writes,
+                "dropped_blob_writes": self.dropped_blob_writes,
+            }
@@ -0,0 +1,201 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from azure.search.documents import SearchClient
+
+# Per-document status codes worth retrying, see
+# https://learn.microsoft.com/rest/api/searchservice/addupdate-or-delete-documents#response
+RETRYABLE_STATUS_CODES = {409, 422, 429, 503}
+# Request status codes that mean the service is throttling or briefly unavailable
+THROTTLED_STATUS_CODES = {429, 503}
+# Bytes added to each document by the upload action wrapper
+ACTION_OVERHEAD_BYTES = 32
+
+
+class IndexingError(Exception):
+    """Documents that could not be indexed, by key, with the error of each"""
+    def __init__(self, failed: Dict[str, str]) -> None:
+        self.failed = failed
+        key, error = next(iter(failed.items()))
+        super().__init__(f"{len(failed)} chunks failed to index, first {key}: {error}")
+
+    def describe(self, name: Callable[[str], str] = str, max_length: int = 4000) -> List[str]:
+        """Every failed chunk as "name (error)", joined into messages of at most max_length
+        characters. A chunk too long for one message gets a message of its own."""
+        messages = []
+        current = ""
+        for key, error in self.failed.items():
+            entry = f"{name(key)} ({error})"
+            if current and len(current) + len(entry) + 2 > max_length:
+                messages.append(current)
+                current = ""
+            current = f"{current}; {entry}" if current else entry
+        if current:
+            messages.append(current)
+        return messages
+
+
+class IndexWriter(object):
+    """Uploads documents to the search index shards they route to.
+
+    Documents are grouped into requests under max_batch_bytes of serialized payload and
+    max_batch_documents, which are uploaded concurrently through one client per index. Only
+    the documents that failed with a transient status are retried, with exponential backoff,
+    and throttled requests wait as long as the service asks in Retry-After.
+    """
+    def __init__(self, endpoint: str, credential, shard_router, key_field: str = "id",
+                 max_batch_bytes: int = 12000000, max_batch_documents: int = 1000, concurrency: int = 4,
+                 max_retries: int = 5, backoff_seconds: float = 1, max_backoff_seconds: float = 60) -> None:
+        self.endpoint = endpoint
+        self.credential = credential
+        self.shard_router = shard_router
+        self.key_field = key_field
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_documents = max_batch_documents
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="index-upload")
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.batches = 0
+        self.requests = 0
+        self.retried_documents = 0
+        self.throttled_requests = 0
+        self.bytes = 0
+
+    def _client(self, index_name: str) -> SearchClient:
+        with self._lock:
+            if index_name not in self._clients:
+                self._clients[index_name] = SearchClient(endpoint=self.endpoint,
+                                                         index_name=index_name,
+                                                         credential=self.credential)
+            return self._clients[index_name]
+
+    def _batches(self, documents: List[dict]) -> List[tuple]:
+        """Splits documents into (size in bytes, documents) batches under the request limits"""
+        batches = []
+        batch, batch_bytes = [], 0
+        for document in documents:
+            size = len(json.dumps(document, separators=(",", ":"), default=str)) + ACTION_OVERHEAD_BYTES
+            if batch and (batch_bytes + size > self.max_batch_bytes or len(batch) >= self.max_batch_documents):
+                batches.append((batch_bytes, batch))
+                batch, batch_bytes = [], 0
+            batch.append(document)
+            batch_bytes += size
+        if batch:
+            batches.append((batch_bytes, batch))
+        return batches
+
+    def _backoff(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff_seconds)
+            except ValueError:
+                pass
+        delay = min(self.backoff_seconds * (2 ** attempt), self.max_backoff_seconds)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _upload(self, index_name: str, batch_bytes: int, documents: List[dict]) -> Dict[str, str]:
+        """Uploads a batch, retrying failed documents. Returns the errors of those that never succeeded"""
+        client = self._client(index_name)
+        pending = documents
+        errors = {}
+        with self._lock:
+            self.batches += 1
+            self.bytes += batch_bytes
+        for attempt in range(self.max_retries + 1):
+            with self._lock:
+                self.requests += 1
+                if attempt > 0:
+                    self.retried_documents += len(pending)
+            try:
+                results = client.upload_documents(documents=pending)
+            except HttpResponseError as error:
+                if error.status_code not in THROTTLED_STATUS_CODES:
+                    raise
+                with self._lock:
+                    self.throttled_requests += 1
+                retry_after = error.response.headers.get("Retry-After") if error.response is not None else None
+                errors.update({document[self.key_field]: f"{error.status_code} {error.message}" for document in pending})
+                logging.warning(f"Indexing into {index_name} throttled with {error.status_code}, "
+                                f"retrying {len(pending)} documents")
+                if attempt < self.max_retries:
+                    time.sleep(self._backoff(attempt, retry_after))
+                continue
+            except (ServiceRequestError, ServiceResponseError) as error:
+                errors.update({document[self.key_field]: str(error) for document in pending})
+                logging.warning(f"Indexing into {index_name} failed to connect, retrying {len(pending)} documents")
+                if attempt < self.max_retries:
+                    time.sleep(self._backoff(attempt))
+                continue
+
+            failed = {result.key: result for result in results if not result.succeeded}
+            for key, result in failed.items():
+                errors[key] = f"{result.status_code} {result.error_message}"
+            for document in pending:
+                if document[self.key_field] not in failed:
+                    errors.pop(document[self.key_field], None)
+            retryable = [document for document in pending
+                         if document[self.key_field] in failed
+                         and failed[document[self.key_field]].status_code in RETRYABLE_STATUS_CODES]
+            if not retryable or attempt == self.max_retries:
+                break
+            logging.warning(f"Retrying {len(retryable)} of {len(pending)} documents in {index_name}")
+            pending = retryable
+            time.sleep(self._backoff(attempt))
+        return errors
+
+    def write(self, documents: List[dict]) -> Dict[str, str]:
+        """Indexes documents, returning the error of each document that could not be indexed
+        by key. Empty when every document succeeded"""
+        documents_by_index = {}
+        for document in documents:
+            index_name = self.shard_router.get_index_name(document['folder'], document['file_name'])
+            documents_by_index.setdefault(index_name, []).append(document)
+
+        futures = [
+            (batch, self.executor.submit(self._upload, index_name, batch_bytes, batch))
+            for index_name, index_documents in documents_by_index.items()
+            for batch_bytes, batch in self._batches(index_documents)
+        ]
+        errors = {}
+        for batch, future in futures:
+            try:
+                errors.update(future.result())
+            except Exception as error:
+                logging.error(f"Failed to index {len(batch)} documents: {str(error)}")
+                errors.update({document[self.key_field]: str(error) for document in batch})
+
+        with self._lock:
+            self.documents += len(documents)
+            self.failed += len(errors)
+            self.succeeded += len(documents) - len(errors)
+        logging.debug(f"Indexed {len(documents) - len(errors)} of {len(documents)} chunks "
+                      f"in {len(futures)} requests")
+        return errors
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "documents": self.documents,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "batches": self.batches,
+                "requests": self.requests,
+                "retried_documents": self.retried_documents,
+                "throttled_requests": self.throttled_requests,
+                "avg_batch_bytes": self.bytes / self.batches if self.batches else 0.0,
+            }
@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import torch
+
+# Models of the worker processes. Set in the parent before the pool forks, so every worker
+# maps the same weights instead of loading its own copy.
+_models = {}
+
+
+def _init_worker(torch_threads: int):
+    """Runs once in each worker process"""
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already set, e.g. inherited from a parent that has run inference
+        pass
+
+
+def _encode(model: str, texts: List[str]) -> List[List[float]]:
+    return _models[model].encode(texts).tolist()
+
+
+def _ready(_) -> int:
+    return os.getpid()
+
+
+class InferencePool(object):
+    """A pool of worker processes that run sentence-transformers inference outside the
+    interpreter serving HTTP requests and polling the queue.
+
+    Workers are forked after the models are loaded and share their weights. Each worker runs
+    torch with torch_threads intra-op threads, so workers * torch_threads should not exceed
+    the cores available. Every task goes to the worker with the fewest tasks in flight, in
+    round-robin order among equals, so concurrent small batches run on separate workers.
+    """
+    def __init__(self, models: dict, workers: int, torch_threads: int = 0,
+                 min_texts_per_task: int = 8) -> None:
+        self.workers = workers
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.min_texts_per_task = min_texts_per_task
+        for name, model in models.items():
+            model.share_memory()
+            _models[name] = model
+        context = multiprocessing.get_context("fork")
+        self.executors = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                initargs=(self.torch_threads,))
+            for _ in range(workers)
+        ]
+        self._lock = threading.Lock()
+        self._in_flight = [0] * workers
+        self._next_worker = 0
+        # Fork every worker now, before the service starts threads of its own
+        pids = {executor.submit(_ready, None).result() for executor in self.executors}
+        logging.info(f"Started {len(pids)} inference workers with {self.torch_threads} torch threads each")
+
+    def _acquire_worker(self) -> int:
+        with self._lock:
+            order = [(self._next_worker + i) % self.workers for i in range(self.workers)]
+            worker = min(order, key=lambda w: self._in_flight[w])
+            self._in_flight[worker] += 1
+            self._next_worker = (worker + 1) % self.workers
+            return worker
+
+    def _release_worker(self, worker: int):
+        with self._lock:
+            self._in_flight[worker] -= 1
+
+    def _submit(self, model: str, texts: List[str]):
+        worker = self._acquire_worker()
+        future = self.executors[worker].submit(_encode, model, texts)
+        future.add_done_callback(lambda _: self._release_worker(worker))
+        return future
+
+    def encode(self, model: str, texts: List[str]) -> List[List[float]]:
+        """Embeds texts, splitting large batches across the workers. Returns one vector per
+        text in input order"""
+        task_size = max(self.min_texts_per_task, math.ceil(len(texts) / self.workers))
+        futures = [
+            self._submit(model, texts[start:start + task_size])
+            for start in range(0, len(texts), task_size)
+        ]
+        embeddings = []
+        for future in futures:
+            embeddings.extend(future.result())
+        return embeddings
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown()
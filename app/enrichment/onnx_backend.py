@@ -0,0 +1,185 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+import onnxruntime
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Normalize, Pooling
+
+# Sentences used to compare ONNX and PyTorch embeddings before an ONNX model is served
+PARITY_SENTENCES = [
+    "What are the future plans for public transportation development?",
+    "How much renewable energy was generated last year?",
+    "The agency will publish its annual report on water quality in the spring.",
+    "Funding for the housing program was increased by 12 percent compared to 2022.",
+    "Summary",
+    "Table 4: Regional budget allocations by department and fiscal quarter, including "
+    "capital expenditure, operating costs and grants awarded to local governments.",
+    "¿Cuáles son los requisitos para solicitar una subvención?",
+    "Les écoles publiques recevront un financement supplémentaire.",
+]
+
+
+class _TokenEmbeddings(torch.nn.Module):
+    """Exposes only the token embeddings of a transformer, with positional inputs"""
+    def __init__(self, auto_model, input_names: List[str]) -> None:
+        super().__init__()
+        self.auto_model = auto_model
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return self.auto_model(**dict(zip(self.input_names, inputs)))[0]
+
+
+class OnnxEmbeddingModel(object):
+    """A sentence-transformers model served with ONNX Runtime
+
+    Tokenization, pooling and normalization follow the original model, only the transformer
+    runs in ONNX Runtime. encode has the same signature and output as SentenceTransformer.encode.
+    """
+    def __init__(self, st_model: SentenceTransformer, onnx_path: str) -> None:
+        transformer = st_model[0]
+        self.tokenizer = transformer.tokenizer
+        self.max_seq_length = transformer.max_seq_length
+        self.onnx_path = onnx_path
+        self.dimension = st_model.get_sentence_embedding_dimension()
+        pooling = next(module for module in st_model if isinstance(module, Pooling))
+        if pooling.pooling_mode_cls_token:
+            self.pooling = "cls"
+        elif pooling.pooling_mode_mean_tokens:
+            self.pooling = "mean"
+        else:
+            raise ValueError("Only CLS and mean pooling are supported by the ONNX backend")
+        self.normalize = any(isinstance(module, Normalize) for module in st_model)
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def session(self) -> onnxruntime.InferenceSession:
+        # Sessions are not fork safe, every inference worker process opens its own and
+        # uses as many threads as torch was given there
+        if self._session is None or self._session_pid != os.getpid():
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            options.inter_op_num_threads = 1
+            self._session = onnxruntime.InferenceSession(self.onnx_path, sess_options=options,
+                                                         providers=["CPUExecutionProvider"])
+            self._session_pid = os.getpid()
+        return self._session
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def share_memory(self):
+        """Nothing to share, each process maps the ONNX file"""
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        session = self.session
+        features = self.tokenizer(texts, padding=True, truncation=True,
+                                  max_length=self.max_seq_length, return_tensors="np")
+        input_names = [session_input.name for session_input in session.get_inputs()]
+        token_embeddings = session.run(None, {name: features[name].astype(np.int64) for name in input_names})[0]
+        if self.pooling == "cls":
+            embeddings = token_embeddings[:, 0]
+        else:
+            mask = features["attention_mask"][..., None].astype(token_embeddings.dtype)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        """Embeds a list of texts, one row per text in input order"""
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        # Batch texts of similar length together to limit padding, as sentence-transformers does
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            indices = order[start:start + batch_size]
+            embeddings[indices] = self._encode_batch([texts[i] for i in indices])
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx(st_model: SentenceTransformer, output_dir: str, quantize: bool) -> str:
+    """Exports the transformer of a sentence-transformers model to ONNX, and optionally a
+    dynamically int8 quantized copy. Existing exports are reused. Returns the path to serve."""
+    os.makedirs(output_dir, exist_ok=True)
+    onnx_path = os.path.join(output_dir, "model.onnx")
+    quantized_path = os.path.join(output_dir, "model-int8.onnx")
+
+    if not os.path.exists(onnx_path):
+        transformer = st_model[0]
+        sample = transformer.tokenizer(["export sample"], return_tensors="pt")
+        input_names = list(sample.keys())
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]}
+        module = _TokenEmbeddings(transformer.auto_model, input_names).eval()
+        with torch.no_grad():
+            torch.onnx.export(module, tuple(sample[name] for name in input_names), onnx_path,
+                              input_names=input_names, output_names=["token_embeddings"],
+                              dynamic_axes=dynamic_axes, opset_version=14)
+        logging.info(f"Exported {onnx_path}")
+
+    if not quantize:
+        return onnx_path
+    if not os.path.exists(quantized_path):
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+        logging.info(f"Quantized {quantized_path}")
+    return quantized_path
+
+
+def parity(reference, candidate, sentences: List[str] = None) -> float:
+    """Lowest cosine similarity between the embeddings of two models over the sentences"""
+    sentences = sentences or PARITY_SENTENCES
+    expected = np.asarray(reference.encode(sentences), dtype=np.float32)
+    actual = np.asarray(candidate.encode(sentences), dtype=np.float32)
+    similarity = (expected * actual).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+    return float(similarity.min())
+
+
+def _prepare(model_path: str, quantize: bool) -> tuple:
+    """Exports a saved model and measures its parity, in a spawned process. Returns the path
+    to serve and the parity"""
+    model = SentenceTransformer(model_path)
+    onnx_path = export_onnx(model, os.path.join(model_path, "onnx"), quantize)
+    return onnx_path, parity(model, OnnxEmbeddingModel(model, onnx_path))
+
+
+def load_onnx_models(models: dict, models_path: str, quantize: bool, min_similarity: float) -> dict:
+    """Replaces each sentence-transformers model with its ONNX Runtime counterpart. A model
+    that fails to export or does not match the PyTorch output closely enough keeps running
+    in PyTorch.
+
+    Export and the parity check run torch inference, which starts OpenMP and intra-op thread
+    pools that inference workers forked from this process would inherit in a broken state.
+    They run in a spawned process instead, loading the models load_models saved under
+    models_path, so this process never runs inference before the pool forks."""
+    onnx_models = {}
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for name, model in models.items():
+            try:
+                onnx_path, similarity = executor.submit(
+                    _prepare, os.path.join(models_path, name), quantize).result()
+                onnx_model = OnnxEmbeddingModel(model, onnx_path)
+            except Exception as error:
+                logging.error(f"Failed to load {name} with ONNX Runtime, using PyTorch - {str(error)}")
+                onnx_models[name] = model
+                continue
+            if similarity < min_similarity:
+                logging.error(f"ONNX model {name} has a cosine similarity of {similarity:.5f} to PyTorch, "
+                              f"below {min_similarity}, using PyTorch")
+                onnx_models[name] = model
+                continue
+            logging.info(f"Serving {name} with ONNX Runtime from {onnx_path}, parity {similarity:.5f}")
+            onnx_models[name] = onnx_model
+    return onnx_models
@@ -0,0 +1,24 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from typing import Callable, List
+
+
+def encode_in_batches(encode: Callable, texts: List[str], max_batch_size: int) -> List[List[float]]:
+    """Embeds texts with an Azure OpenAI embeddings call, which caps the number of inputs per
+    request, one vector per text in input order
+    Args:
+        encode (Callable): Sends one embeddings request for a list of texts
+        texts (List[str]): A list of texts
+        max_batch_size (int): Most texts sent in one request
+
+    Returns:
+        List[List[float]]: The embedding of each text
+    """
+    embeddings = []
+    for start in range(0, len(texts), max_batch_size):
+        response = encode(texts[start:start + max_batch_size])
+        # Each item carries the position of its input, do not rely on response order
+        data = sorted(response['data'], key=lambda item: item['index'])
+        embeddings.extend(item['embedding'] for item in data)
+    return embeddings
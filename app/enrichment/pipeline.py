@@ -0,0 +1,226 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List
+
+from index_writer import IndexingError
+
+
+class DocumentJob(object):
+    """Tracks the chunks of one document through the pipeline. Completes once every batch
+    submitted for it has left the last stage, or fails with the first error of any stage."""
+    def __init__(self, name: str, model: str) -> None:
+        self.name = name
+        self.model = model
+        self.indexed = 0
+        self.error = None
+        self._pending = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def add(self):
+        with self._lock:
+            self._pending += 1
+
+    def add_indexed(self, count: int):
+        with self._lock:
+            self.indexed += count
+
+    def complete(self):
+        with self._lock:
+            self._pending -= 1
+            if self._closed and self._pending == 0:
+                self._done.set()
+
+    def fail(self, error: Exception):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+        self._done.set()
+
+    def close(self):
+        """No more batches will be submitted"""
+        with self._lock:
+            self._closed = True
+            if self._pending == 0:
+                self._done.set()
+
+    def wait(self):
+        """Blocks until the document is done, raising the error that failed it"""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class PipelineItem(object):
+    """A batch of index chunks of one document"""
+    def __init__(self, job: DocumentJob, chunks: List[dict]) -> None:
+        self.job = job
+        self.chunks = chunks
+
+
+class Stage(object):
+    """A pipeline stage with its own worker threads and a bounded input queue.
+
+    Each worker takes the next item, adds whatever else is already queued up to max_chunks
+    chunks, and hands the items to work. Items returned by work go to the next stage, whose
+    full queue blocks this stage in turn. Items of failed documents are dropped.
+    """
+    def __init__(self, name: str, work: Callable[[List[PipelineItem]], List[PipelineItem]],
+                 workers: int, queue_size: int, max_chunks: int, next_stage: "Stage" = None) -> None:
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.max_chunks = max_chunks
+        self.next_stage = next_stage
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.calls = 0
+        self.chunks = 0
+        self.failed_calls = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        for i in range(workers):
+            worker = threading.Thread(target=self._run, name=f"pipeline-{name}-{i}", daemon=True)
+            worker.start()
+
+    def put(self, item: PipelineItem):
+        """Queues an item, blocking while the stage is full"""
+        started = time.monotonic()
+        self._queue.put(item)
+        waited = time.monotonic() - started
+        with self._lock:
+            self.blocked_seconds += waited
+
+    def _collect(self) -> List[PipelineItem]:
+        items = [self._queue.get()]
+        size = len(items[0].chunks)
+        while size < self.max_chunks:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            size += len(item.chunks)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            for item in items:
+                if item.job.failed:
+                    item.job.complete()
+            items = [item for item in items if not item.job.failed]
+            if not items:
+                continue
+            by_job = {}
+            for item in items:
+                by_job.setdefault(id(item.job), []).append(item)
+            if not self._process(items, fail=len(by_job) == 1):
+                # Retry each document on its own, so one bad document does not fail the others
+                for job_items in by_job.values():
+                    self._process(job_items)
+
+    def _process(self, items: List[PipelineItem], fail: bool = True) -> bool:
+        """Runs work on the items and forwards its results. On error the items' documents are
+        failed, unless fail is False, and False is returned"""
+        started = time.monotonic()
+        try:
+            results = self.work(items)
+        except Exception as error:
+            logging.error(f"Pipeline stage {self.name} failed on {sum(len(item.chunks) for item in items)} "
+                          f"chunks: {str(error)}")
+            with self._lock:
+                self.failed_calls += 1
+            if fail:
+                for item in items:
+                    item.job.fail(error)
+                    item.job.complete()
+            return False
+        with self._lock:
+            self.calls += 1
+            self.chunks += sum(len(item.chunks) for item in items)
+            self.busy_seconds += time.monotonic() - started
+        for item in results:
+            if self.next_stage is not None:
+                self.next_stage.put(item)
+            else:
+                item.job.complete()
+        return True
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "calls": self.calls,
+                "failed_calls": self.failed_calls,
+                "chunks": self.chunks,
+                "avg_chunks_per_call": self.chunks / self.calls if self.calls else 0.0,
+                "chunks_per_busy_second": self.chunks / self.busy_seconds if self.busy_seconds else 0.0,
+                "utilization": self.busy_seconds / (elapsed * self.workers) if elapsed else 0.0,
+                "producers_blocked_seconds": self.blocked_seconds,
+            }
+
+
+class EmbeddingPipeline(object):
+    """Streams the chunks of documents through an embed stage and an index-upload stage.
+
+    Callers fetch and prepare chunks, submitting them in batches; embedding and uploading run
+    on the stages' own workers, so storage, model and search I/O overlap across batches and
+    documents. Bounded queues hold back callers when a later stage falls behind.
+    """
+    def __init__(self, embed: Callable[[str, List[dict]], List[dict]], index: Callable[[List[dict]], Dict[str, str]],
+                 embed_workers: int = 1, embed_batch_size: int = 32,
+                 index_workers: int = 2, index_batch_size: int = 200, queue_size: int = 8,
+                 key_field: str = "id") -> None:
+        self.embed = embed
+        self.index = index
+        self.key_field = key_field
+        self.index_stage = Stage("index", self._index, index_workers, queue_size,
+                                 max_chunks=index_batch_size)
+        self.embed_stage = Stage("embed", self._embed, embed_workers, queue_size,
+                                 max_chunks=embed_batch_size, next_stage=self.index_stage)
+
+    def _embed(self, items: List[PipelineItem]) -> List[PipelineItem]:
+        # Items of several documents are embedded in one call when they share a model
+        by_model = {}
+        for item in items:
+            by_model.setdefault(item.job.model, []).append(item)
+        for model, model_items in by_model.items():
+            self.embed(model, [chunk for item in model_items for chunk in item.chunks])
+        return items
+
+    def _index(self, items: List[PipelineItem]) -> List[PipelineItem]:
+        # index returns the chunks it could not index, only their own documents fail
+        errors = self.index([chunk for item in items for chunk in item.chunks])
+        for item in items:
+            failed = {chunk[self.key_field]: errors[chunk[self.key_field]]
+                      for chunk in item.chunks if chunk[self.key_field] in errors}
+            item.job.add_indexed(len(item.chunks) - len(failed))
+            if failed:
+                item.job.fail(IndexingError(failed))
+        return items
+
+    def submit(self, job: DocumentJob, chunks: List[dict]):
+        """Queues a batch of index chunks of a document, blocking while the pipeline is full"""
+        job.add()
+        self.embed_stage.put(PipelineItem(job, chunks))
+
+    def get_metrics(self) -> dict:
+        return {
+            "embed": self.embed_stage.get_metrics(),
+            "index": self.index_stage.get_metrics(),
+        }
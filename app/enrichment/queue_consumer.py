@@ -0,0 +1,172 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from azure.core.exceptions import ResourceNotFoundError
+
+# Azure Storage queues return at most 32 messages per receive
+MAX_MESSAGES_PER_RECEIVE = 32
+
+
+class QueueConsumer(object):
+    """Processes queue messages concurrently under a lease.
+
+    Received messages stay invisible for visibility_timeout seconds, and a background thread
+    keeps extending that while they are processed. A message is deleted only once its handler
+    returns; if the handler raises or the instance dies the lease runs out and the message
+    becomes visible again for another attempt. A message received more than max_dequeue_count
+    times is not handled again but moved to the poison queue, or dropped without one, so a
+    message that keeps failing cannot come back forever. The queue is polled again as soon as
+    a slot is free while messages keep coming, and with an exponentially growing delay, up to
+    max_idle_seconds, while it is empty.
+    """
+    def __init__(self, queue_client, handle: Callable, concurrency: int = 4, max_messages_per_receive: int = 32,
+                 max_dequeue_count: int = 5, poison_queue_client=None,
+                 visibility_timeout: int = 300, min_idle_seconds: float = 1, max_idle_seconds: float = 60,
+                 is_ready: Callable[[], bool] = lambda: True) -> None:
+        self.queue_client = queue_client
+        self.handle = handle
+        self.max_dequeue_count = max_dequeue_count
+        self.poison_queue_client = poison_queue_client
+        self.concurrency = concurrency
+        self.max_messages_per_receive = min(max_messages_per_receive, MAX_MESSAGES_PER_RECEIVE)
+        self.visibility_timeout = visibility_timeout
+        self.min_idle_seconds = min_idle_seconds
+        self.max_idle_seconds = max_idle_seconds
+        self.is_ready = is_ready
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="queue-message")
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        # Held while a lease is extended or released, as both change its pop receipt
+        self._lease_lock = threading.Lock()
+        # Pop receipts of the messages being processed by message id, renewed with each extension
+        self._leases = {}
+        self.received = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.lost_leases = 0
+        self.poisoned = 0
+        self.empty_polls = 0
+
+    def run(self):
+        """Polls the queue forever"""
+        renewer = threading.Thread(target=self._renew_leases, name="queue-lease-renewer", daemon=True)
+        renewer.start()
+        idle_seconds = self.min_idle_seconds
+        while True:
+            if not self.is_ready():
+                logging.debug("Skipping queue poll, models not yet loaded")
+                time.sleep(self.min_idle_seconds)
+                continue
+            # Wait for a free slot, then take as many as are free
+            self._slots.acquire()
+            free = 1
+            while free < self.max_messages_per_receive and self._slots.acquire(blocking=False):
+                free += 1
+            try:
+                messages = list(self.queue_client.receive_messages(
+                    messages_per_page=free, max_messages=free, visibility_timeout=self.visibility_timeout))
+            except Exception as error:
+                logging.error(f"Unable to receive queue messages: {str(error)}")
+                messages = []
+            for _ in range(free - len(messages)):
+                self._slots.release()
+
+            if not messages:
+                with self._lock:
+                    self.empty_polls += 1
+                logging.debug(f"No messages to process, polling again in {idle_seconds} seconds")
+                time.sleep(idle_seconds)
+                idle_seconds = min(idle_seconds * 2, self.max_idle_seconds)
+                continue
+
+            idle_seconds = self.min_idle_seconds
+            with self._lock:
+                self.received += len(messages)
+                for message in messages:
+                    self._leases[message.id] = message.pop_receipt
+            for message in messages:
+                self.executor.submit(self._process, message)
+
+    def _dead_letter(self, message):
+        logging.error(f"Queue message {message.id} was received {message.dequeue_count} times, "
+                      f"moving it to the poison queue")
+        if self.poison_queue_client is not None:
+            try:
+                self.poison_queue_client.send_message(message.content)
+            except ResourceNotFoundError:
+                self.poison_queue_client.create_queue()
+                self.poison_queue_client.send_message(message.content)
+        with self._lock:
+            self.poisoned += 1
+
+    def _process(self, message):
+        try:
+            if self.max_dequeue_count and (message.dequeue_count or 0) > self.max_dequeue_count:
+                self._dead_letter(message)
+            else:
+                self.handle(message)
+        except Exception as error:
+            # Leave the message to reappear once its lease runs out
+            logging.error(f"Failed to process queue message {message.id}, it will be retried: {str(error)}")
+            with self._lock:
+                self.failed += 1
+                self._leases.pop(message.id, None)
+            return
+        finally:
+            self._slots.release()
+
+        with self._lease_lock:
+            with self._lock:
+                pop_receipt = self._leases.pop(message.id, None)
+            try:
+                self.queue_client.delete_message(message.id, pop_receipt=pop_receipt)
+                with self._lock:
+                    self.succeeded += 1
+            except Exception as error:
+                # The lease was lost, another instance may process the message again
+                logging.warning(f"Unable to delete queue message {message.id}: {str(error)}")
+                with self._lock:
+                    self.lost_leases += 1
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.visibility_timeout / 3)
+            with self._lock:
+                message_ids = list(self._leases)
+            for message_id in message_ids:
+                with self._lease_lock:
+                    with self._lock:
+                        pop_receipt = self._leases.get(message_id)
+                    if pop_receipt is None:
+                        # Done since the snapshot
+                        continue
+                    try:
+                        renewed = self.queue_client.update_message(
+                            message_id, pop_receipt=pop_receipt, visibility_timeout=self.visibility_timeout)
+                    except Exception as error:
+                        logging.warning(f"Unable to extend the lease of queue message {message_id}: {str(error)}")
+                        with self._lock:
+                            self.lost_leases += 1
+                        continue
+                    with self._lock:
+                        if message_id in self._leases:
+                            self._leases[message_id] = renewed.pop_receipt
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "in_flight": len(self._leases),
+                "received": self.received,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "lost_leases": self.lost_leases,
+                "poisoned": self.poisoned,
+                "empty_polls": self.empty_polls,
+            }
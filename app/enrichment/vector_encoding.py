@@ -0,0 +1,28 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import base64
+import struct
+from typing import List
+
+# Binary vector types and their struct format character, always little-endian
+DTYPES = {"float32": "f", "float16": "e"}
+
+# Response headers of a binary embedding
+DIMENSIONS_HEADER = "X-Embedding-Dimensions"
+DTYPE_HEADER = "X-Embedding-Dtype"
+
+
+def pack_vector(vector: List[float], dtype: str = "float32") -> bytes:
+    """Packs a vector as little-endian float32 or float16"""
+    return struct.pack(f"<{len(vector)}{DTYPES[dtype]}", *vector)
+
+
+def unpack_vector(data: bytes, dtype: str = "float32") -> List[float]:
+    """Inverse of pack_vector"""
+    size = struct.calcsize(DTYPES[dtype])
+    return list(struct.unpack(f"<{len(data) // size}{DTYPES[dtype]}", data))
+
+
+def encode_vector_base64(vector: List[float], dtype: str = "float32") -> str:
+    return base64.b64encode(pack_vector(vector, dtype)).decode("ascii")
@@ -39,6 +39,8 @@ export type AskResponse = {
     // citation_lookup: {}
     // added this for citation bug. aparmar.
     citation_lookup: { [key: string]: { citation: string; source_path: string; page_number: string } };
+    // stages that were skipped or cut short to meet the response deadline
+    degradations?: string[];
     
     error?: string;
 };
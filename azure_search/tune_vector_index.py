@@ -0,0 +1,282 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Offline HNSW tuning harness for the vector index.
+
+Builds local HNSW indexes over exported chunk vectors across a grid of
+m / efConstruction / efSearch values, measures recall@k against brute-force
+ground truth and per-query latency, then recommends a profile and writes an
+updated copy of create_vector_index.json. Nothing here touches the live
+search service except the optional "export" command, which only reads.
+'''
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+import numpy as np
+import hnswlib
+from rich.console import Console
+from rich.table import Table
+import rich.traceback
+
+rich.traceback.install()
+console = Console()
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_TEMPLATE_PATH = os.path.join(DIR, "create_vector_index.json")
+VECTOR_FIELD = "contentVector"
+
+# Ranges accepted by Azure AI Search for hnswParameters
+M_RANGE = (4, 10)
+EF_CONSTRUCTION_RANGE = (100, 1000)
+EF_SEARCH_RANGE = (100, 1000)
+
+DEFAULT_M = [4, 6, 8, 10]
+DEFAULT_EF_CONSTRUCTION = [200, 400, 800]
+DEFAULT_EF_SEARCH = [100, 200, 300, 500, 800]
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help="Export chunk vectors from an existing index to a .npy file")
+    export_parser.add_argument("--search_service_endpoint", required=True, help="Azure Search Endpoint")
+    export_parser.add_argument("--search_index", required=True, help="Azure Search Index")
+    export_parser.add_argument("--search_key", required=True, help="Azure Search Key")
+    export_parser.add_argument("--output", required=True, help="Path of the .npy file to write")
+    export_parser.add_argument("--limit", type=int, default=100000,
+                               help="Maximum number of vectors to export (default 100000)")
+
+    tune_parser = subparsers.add_parser(
+        "tune",
+        help="Run the parameter grid over exported vectors")
+    tune_parser.add_argument("--vectors", required=True,
+                             help="Exported vectors (.npy, or .json/.jsonl of index documents)")
+    tune_parser.add_argument("--queries",
+                             help="Optional query vectors in the same formats. "
+                             "Defaults to a held-out sample of --vectors")
+    tune_parser.add_argument("--num_queries", type=int, default=500,
+                             help="Number of held-out queries when --queries is not given (default 500)")
+    tune_parser.add_argument("--k", type=int, default=10, help="Recall@k cut-off (default 10)")
+    tune_parser.add_argument("--target_recall", type=float, default=0.95,
+                             help="Minimum recall@k for a profile to be recommended (default 0.95)")
+    tune_parser.add_argument("--m", type=int, nargs="+", default=DEFAULT_M)
+    tune_parser.add_argument("--ef_construction", type=int, nargs="+", default=DEFAULT_EF_CONSTRUCTION)
+    tune_parser.add_argument("--ef_search", type=int, nargs="+", default=DEFAULT_EF_SEARCH)
+    tune_parser.add_argument("--threads", type=int, default=-1,
+                             help="Threads used to build each index (default all cores)")
+    tune_parser.add_argument("--seed", type=int, default=42)
+    tune_parser.add_argument("--report", default="hnsw_tuning_report.json",
+                             help="Where to write the full grid results")
+    tune_parser.add_argument("--output_index", default="create_vector_index.tuned.json",
+                             help="Where to write the index definition with the recommended profile")
+
+    return parser.parse_args()
+
+
+def export_vectors(search_service_endpoint, search_index, search_key, output, limit):
+    """Read contentVector for up to limit documents and save them as float32 .npy"""
+    # Imported here so the tune command works without the search SDK installed
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+
+    search_client = SearchClient(
+        endpoint=search_service_endpoint,
+        index_name=search_index,
+        credential=AzureKeyCredential(search_key),
+    )
+    vectors = []
+    results = search_client.search("*", select=[VECTOR_FIELD], top=limit)
+    for result in results:
+        vector = result.get(VECTOR_FIELD)
+        if vector:
+            vectors.append(vector)
+    if not vectors:
+        raise ValueError(f"No {VECTOR_FIELD} values returned from index {search_index}")
+    np.save(output, np.asarray(vectors, dtype=np.float32))
+    console.print(f"Exported {len(vectors)} vectors to {output}")
+
+
+def load_vectors(path):
+    """Load vectors from .npy or from a JSON / JSON lines export of index documents"""
+    if path.endswith(".npy"):
+        return np.load(path).astype(np.float32)
+
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            documents = [json.loads(line) for line in file if line.strip()]
+        else:
+            documents = json.load(file)
+            if isinstance(documents, dict):
+                documents = documents.get("value", [])
+
+    vectors = [doc[VECTOR_FIELD] if isinstance(doc, dict) else doc for doc in documents]
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def normalize(vectors):
+    """L2 normalise rows so inner product equals cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def brute_force_neighbours(corpus, queries, k):
+    """Exact top-k cosine neighbours, computed in blocks to bound memory"""
+    neighbours = np.empty((len(queries), k), dtype=np.int64)
+    block = 256
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ corpus.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        neighbours[start:start + block] = np.take_along_axis(top, order, axis=1)
+    return neighbours
+
+
+def recall_at_k(found, truth):
+    """Mean fraction of the true top-k present in the approximate top-k"""
+    hits = [len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]
+    return float(np.mean(hits))
+
+
+def run_grid(corpus, queries, truth, args):
+    """Build one index per (m, efConstruction) and sweep efSearch over it"""
+    results = []
+    dimensions = corpus.shape[1]
+    labels = np.arange(len(corpus))
+
+    for m, ef_construction in itertools.product(args.m, args.ef_construction):
+        index = hnswlib.Index(space="cosine", dim=dimensions)
+        index.init_index(max_elements=len(corpus), M=m,
+                         ef_construction=ef_construction, random_seed=args.seed)
+        build_start = time.perf_counter()
+        index.add_items(corpus, labels, num_threads=args.threads)
+        build_seconds = time.perf_counter() - build_start
+
+        for ef_search in args.ef_search:
+            index.set_ef(max(ef_search, args.k))
+            latencies = []
+            found = []
+            # Queries are issued one at a time to mirror the per-request service pattern
+            for query in queries:
+                query_start = time.perf_counter()
+                neighbour_labels, _ = index.knn_query(query, k=args.k, num_threads=1)
+                latencies.append((time.perf_counter() - query_start) * 1000)
+                found.append(neighbour_labels[0])
+
+            results.append({
+                "m": m,
+                "efConstruction": ef_construction,
+                "efSearch": ef_search,
+                "recall": recall_at_k(found, truth),
+                "latency_ms_p50": float(np.percentile(latencies, 50)),
+                "latency_ms_p95": float(np.percentile(latencies, 95)),
+                "latency_ms_p99": float(np.percentile(latencies, 99)),
+                "build_seconds": build_seconds,
+            })
+            console.print(f"m={m} efConstruction={ef_construction} efSearch={ef_search} "
+                          f"recall@{args.k}={results[-1]['recall']:.4f} "
+                          f"p95={results[-1]['latency_ms_p95']:.3f}ms")
+    return results
+
+
+def recommend(results, target_recall):
+    """Cheapest profile meeting the recall target, else the highest recall profile"""
+    eligible = [r for r in results if r["recall"] >= target_recall]
+    if eligible:
+        return min(eligible, key=lambda r: (r["latency_ms_p95"], r["build_seconds"])), True
+    return max(results, key=lambda r: (r["recall"], -r["latency_ms_p95"])), False
+
+
+def write_index_definition(profile, output_path):
+    """Copy the index template with the recommended hnswParameters substituted.
+    The template holds envsubst placeholders, so it is edited as text rather than parsed."""
+    with open(INDEX_TEMPLATE_PATH, "r", encoding="utf-8") as file:
+        template = file.read()
+    for name in ("m", "efConstruction", "efSearch"):
+        template = re.sub(rf'("{name}"\s*:\s*)\d+', rf'\g<1>{profile[name]}', template, count=1)
+    with open(output_path, "w", encoding="utf-8") as file:
+        file.write(template)
+
+
+def print_results(results, k):
+    """Render the grid as a table sorted by latency"""
+    table = Table(title="HNSW parameter grid")
+    for column in ("m", "efConstruction", "efSearch", f"recall@{k}", "p50 ms", "p95 ms", "build s"):
+        table.add_column(column, justify="right")
+    for r in sorted(results, key=lambda r: r["latency_ms_p95"]):
+        table.add_row(str(r["m"]), str(r["efConstruction"]), str(r["efSearch"]),
+                      f"{r['recall']:.4f}", f"{r['latency_ms_p50']:.3f}",
+                      f"{r['latency_ms_p95']:.3f}", f"{r['build_seconds']:.1f}")
+    console.print(table)
+
+
+def validate_grid(args):
+    """Reject values the search service would not accept"""
+    for name, values, (low, high) in (("m", args.m, M_RANGE),
+                                      ("efConstruction", args.ef_construction, EF_CONSTRUCTION_RANGE),
+                                      ("efSearch", args.ef_search, EF_SEARCH_RANGE)):
+        for value in values:
+            if not low <= value <= high:
+                raise ValueError(f"{name}={value} is outside the supported range {low}-{high}")
+
+
+def tune(args):
+    """Run the tuning grid and emit the report and index definition"""
+    validate_grid(args)
+    rng = np.random.default_rng(args.seed)
+    corpus = normalize(load_vectors(args.vectors))
+
+    if args.queries:
+        queries = normalize(load_vectors(args.queries))
+    else:
+        # Hold the query sample out of the corpus so a query never finds itself
+        held_out = rng.choice(len(corpus), size=min(args.num_queries, len(corpus) // 10 or 1),
+                              replace=False)
+        queries = corpus[held_out]
+        corpus = np.delete(corpus, held_out, axis=0)
+
+    if len(corpus) < args.k:
+        raise ValueError(f"Need at least k={args.k} corpus vectors, got {len(corpus)}")
+
+    console.print(f"Corpus: {len(corpus)} x {corpus.shape[1]}, queries: {len(queries)}")
+    truth = brute_force_neighbours(corpus, queries, args.k)
+    results = run_grid(corpus, queries, truth, args)
+    print_results(results, args.k)
+
+    profile, met_target = recommend(results, args.target_recall)
+    if met_target:
+        console.print(f"[green]Recommended: m={profile['m']} efConstruction={profile['efConstruction']} "
+                      f"efSearch={profile['efSearch']} (recall@{args.k}={profile['recall']:.4f})[/green]")
+    else:
+        console.print(f"[yellow]No profile reached recall@{args.k} >= {args.target_recall}; "
+                      f"recommending the highest recall profile instead[/yellow]")
+
+    with open(args.report, "w", encoding="utf-8") as file:
+        json.dump({
+            "k": args.k,
+            "target_recall": args.target_recall,
+            "corpus_size": int(len(corpus)),
+            "query_count": int(len(queries)),
+            "recommended": profile,
+            "met_target": met_target,
+            "results": results,
+        }, file, indent=2)
+    write_index_definition(profile, args.output_index)
+    console.print(f"Wrote {args.report} and {args.output_index}")
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    if arguments.command == "export":
+        export_vectors(arguments.search_service_endpoint, arguments.search_index,
+                       arguments.search_key, arguments.output, arguments.limit)
+    else:
+        tune(arguments)
@@ -0,0 +1,62 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+""" Library of code to route chunks and queries across sharded search indexes """
+import hashlib
+from enum import Enum
+
+
+class ShardRouting(Enum):
+    """ Enum for how chunks are assigned to a shard """
+    FOLDER = "folder"
+    HASH = "hash"
+
+
+class IndexShardRouter:
+    """ Maps documents and folder filters to one of N search indexes.
+    With a shard count of 1 every call resolves to the base index name, so an
+    unsharded deployment behaves exactly as before. Indexing (enrichment app and
+    functions) and querying (webapp) must use the same settings. """
+
+    def __init__(self, base_index_name, shard_count=1, routing=ShardRouting.FOLDER.value):
+        """ Constructor function """
+        self.base_index_name = base_index_name
+        self.shard_count = max(int(shard_count or 1), 1)
+        self.routing = ShardRouting((routing or ShardRouting.FOLDER.value).lower())
+
+    @property
+    def index_names(self):
+        """ Returns the names of all the shard indexes """
+        if self.shard_count == 1:
+            return [self.base_index_name]
+        return [f"{self.base_index_name}-{i}" for i in range(self.shard_count)]
+
+    def _shard_number(self, key):
+        """ Stable hash of a routing key to a shard number """
+        digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+        return int(digest, 16) % self.shard_count
+
+    def _top_level_folder(self, folder):
+        """ The first segment of a folder path, which is the unit folder routing shards on """
+        return (folder or "").strip("/").split("/")[0]
+
+    def get_index_name(self, folder, file_name):
+        """ Returns the index a chunk belongs in. Folder routing keeps every subfolder of a
+        top level folder together, hash routing spreads documents evenly. Either way all the
+        chunks of one document land in the same shard. """
+        if self.shard_count == 1:
+            return self.base_index_name
+        if self.routing == ShardRouting.FOLDER:
+            key = self._top_level_folder(folder)
+        else:
+            key = file_name
+        return self.index_names[self._shard_number(key)]
+
+    def get_index_names_for_folders(self, folders):
+        """ Returns the shards that can hold chunks in any of the given folders. Only folder
+        routing can rule shards out, hash routing and an empty folder list need all shards. """
+        if self.shard_count == 1 or self.routing != ShardRouting.FOLDER or not folders:
+            return self.index_names
+        names = {self.index_names[self._shard_number(self._top_level_folder(folder))]
+                 for folder in folders}
+        return [name for name in self.index_names if name in names]
@@ -0,0 +1,38 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+""" Library of code to publish and read the search index watermark """
+import json
+import logging
+from datetime import datetime
+from azure.core.exceptions import ResourceNotFoundError
+
+DEFAULT_WATERMARK_BLOB_NAME = "_index/watermark.json"
+
+
+class IndexWatermark:
+    """ A small blob that the indexing pipeline rewrites every time it changes the
+    search index. Readers compare its ETag to know when results they cached may be stale. """
+
+    def __init__(self, container_client, blob_name=DEFAULT_WATERMARK_BLOB_NAME):
+        """ Constructor function """
+        self.blob_client = container_client.get_blob_client(blob_name or DEFAULT_WATERMARK_BLOB_NAME)
+
+    def publish(self, document_path=""):
+        """ Moves the watermark forward after content has been written to the index """
+        content = {
+            "updated": str(datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')),
+            "document_path": document_path
+        }
+        try:
+            self.blob_client.upload_blob(json.dumps(content), overwrite=True)
+        except Exception as error:
+            # A missed watermark only delays cache invalidation until the cache TTL expires
+            logging.warning(f"Unable to publish index watermark: {str(error)}")
+
+    def read(self):
+        """ Returns the current watermark ETag, or None if nothing has been published """
+        try:
+            return self.blob_client.get_blob_properties().etag
+        except ResourceNotFoundError:
+            return None
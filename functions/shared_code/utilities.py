@@ -102,6 +102,10 @@ class Utilities:
     def get_filename_and_extension(self, path):
         """ Function to return the file name & type"""
         return self.utilities_helper.get_filename_and_extension(path)
+
+    def get_folder_hierarchy(self, directory):
+        """ Function to return the folder and each of its ancestors"""
+        return self.utilities_helper.get_folder_hierarchy(directory)
     
     def  get_blob_and_sas(self, blob_path):
         """ Function to retrieve the uri and sas token for a given blob in azure storage"""
@@ -28,6 +28,11 @@ class UtilitiesHelper:
                 directory = ""
             file_name, file_extension = os.path.splitext(base_name)
             return file_name, file_extension, directory
+
+    def get_folder_hierarchy(self, directory):
+        """ Function to return the folder and each of its ancestors, e.g. 'a/b/' -> ['a', 'a/b']"""
+        segments = [segment for segment in directory.split("/") if segment != ""]
+        return ["/".join(segments[:i + 1]) for i in range(len(segments))]
     
     def  get_blob_and_sas(self, blob_path):
         """ Function to retrieve the uri and sas token for a given blob in azure storage"""
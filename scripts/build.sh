@@ -34,6 +34,8 @@ mkdir -p ./shared_code
 cp  ../../functions/shared_code/status_log.py ./shared_code
 cp  ../../functions/shared_code/__init__.py ./shared_code
 cp ../../functions/shared_code/tags_helper.py ./shared_code
+cp ../../functions/shared_code/index_shards.py ./shared_code
+cp ../../functions/shared_code/index_watermark.py ./shared_code
 
 # zip the webapp content from app/backend to the ./artifacts folders
 zip -q -r ${BINARIES_OUTPUT_PATH}/webapp.zip .
@@ -53,6 +55,8 @@ mkdir -p ./shared_code
 cp  ../../functions/shared_code/status_log.py ./shared_code
 cp  ../../functions/shared_code/utilities_helper.py ./shared_code
 cp  ../../functions/shared_code/tags_helper.py ./shared_code
+cp  ../../functions/shared_code/index_shards.py ./shared_code
+cp  ../../functions/shared_code/index_watermark.py ./shared_code
 zip -q -r ${BINARIES_OUTPUT_PATH}/enrichment.zip . -x "models/*" @
 echo "Successfully zipped enrichment app"
 echo -e "\n"
\ No newline at end of file
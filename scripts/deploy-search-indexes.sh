@@ -31,30 +31,48 @@ export AZURE_SEARCH_ADMIN_KEY=$search_key
 # Fetch existing index definition if it exists
 index_vector_json=$(cat ${DIR}/../azure_search/create_vector_index.json | envsubst | tr -d "\n" | tr -d "\r")
 index_vector_name=$(echo $index_vector_json | jq -r .name )
-existing_index=$(curl -s --header "api-key: $AZURE_SEARCH_ADMIN_KEY" $search_url/indexes/$index_vector_name?api-version=2023-07-01-Preview)
-
-if [[ "$existing_index" != *"No index with the name"* ]]; then
-    existing_dimensions=$(echo "$existing_index" | jq -r '.fields | map(select(.name == "contentVector")) | .[0].dimensions')
-    existing_index_name=$(echo "$existing_index" | jq -r '.name')
-    # Compare existing dimensions with current $EMBEDDING_VECTOR_SIZE
-    if [[ -n "$existing_dimensions" ]] && [[ "$existing_dimensions" != "$EMBEDDING_VECTOR_SIZE" ]]; then
-        echo "Dimensions mismatch: Existing dimensions: $existing_dimensions, Current dimensions: $EMBEDDING_VECTOR_SIZE"
-        read -p "Do you want to continue? This will delete the existing index and data! (y/n) " -n 1 -r
-        echo
-        if [[ ! $REPLY =~ ^[Yy]$ ]]; then
-            echo "Operation aborted by the user."
-            exit 0
-        else
-            echo "Deleting the existing index $existing_index_name..."
-            curl -X DELETE --header "api-key: $AZURE_SEARCH_ADMIN_KEY" $search_url/indexes/$existing_index_name?api-version=2023-07-01-Preview
-            echo "Index $index_vector_name deleted."
+
+# One index per shard when the index is sharded
+shard_count=${SEARCH_INDEX_SHARD_COUNT:-1}
+if [[ "$shard_count" -gt 1 ]]; then
+    index_names=()
+    for ((i = 0; i < shard_count; i++)); do
+        index_names+=("${index_vector_name}-${i}")
+    done
+else
+    index_names=("$index_vector_name")
+fi
+
+# Check every index that will be deployed, each shard holds vectors of its own
+for index_name in "${index_names[@]}"; do
+    existing_index=$(curl -s --header "api-key: $AZURE_SEARCH_ADMIN_KEY" $search_url/indexes/$index_name?api-version=2023-07-01-Preview)
+
+    if [[ "$existing_index" != *"No index with the name"* ]]; then
+        existing_dimensions=$(echo "$existing_index" | jq -r '.fields | map(select(.name == "contentVector")) | .[0].dimensions')
+        existing_index_name=$(echo "$existing_index" | jq -r '.name')
+        # Compare existing dimensions with current $EMBEDDING_VECTOR_SIZE
+        if [[ -n "$existing_dimensions" ]] && [[ "$existing_dimensions" != "$EMBEDDING_VECTOR_SIZE" ]]; then
+            echo "Dimensions mismatch in $index_name: Existing dimensions: $existing_dimensions, Current dimensions: $EMBEDDING_VECTOR_SIZE"
+            read -p "Do you want to continue? This will delete the existing index and data! (y/n) " -n 1 -r
+            echo
+            if [[ ! $REPLY =~ ^[Yy]$ ]]; then
+                echo "Operation aborted by the user."
+                exit 0
+            else
+                echo "Deleting the existing index $existing_index_name..."
+                curl -X DELETE --header "api-key: $AZURE_SEARCH_ADMIN_KEY" $search_url/indexes/$existing_index_name?api-version=2023-07-01-Preview
+                echo "Index $index_name deleted."
+            fi
         fi
     fi
-fi    
+done
 
-# Create vector index
-echo "Creating index $index_vector_name ..."
-curl -s -X PUT --header "Content-Type: application/json" --header "api-key: $AZURE_SEARCH_ADMIN_KEY" --data "$index_vector_json" $search_url/indexes/$index_vector_name?api-version=2023-07-01-Preview
+# Create vector index, or one index per shard
+for index_name in "${index_names[@]}"; do
+    echo "Creating index $index_name ..."
+    index_json=$(echo "$index_vector_json" | jq -c --arg name "$index_name" '.name = $name')
+    curl -s -X PUT --header "Content-Type: application/json" --header "api-key: $AZURE_SEARCH_ADMIN_KEY" --data "$index_json" $search_url/indexes/$index_name?api-version=2023-07-01-Preview
 
-echo -e "\n"
-echo "Successfully deployed $index_vector_name."
+    echo -e "\n"
+    echo "Successfully deployed $index_name."
+done
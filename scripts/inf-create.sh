@@ -170,6 +170,8 @@ declare -A REPLACE_TOKENS=(
     [\${AZURE_OPENAI_EMBEDDINGS_MODEL_VERSION}]=${AZURE_OPENAI_EMBEDDINGS_MODEL_VERSION}
     [\${CHATGPT_MODEL_MODEL_NAME}]=${AZURE_OPENAI_CHATGPT_MODEL_NAME}
     [\${CHATGPT_MODEL_VERSION}]=${AZURE_OPENAI_CHATGPT_MODEL_VERSION}
+    [\${AZURE_OPENAI_REWRITE_DEPLOYMENT}]=${AZURE_OPENAI_REWRITE_DEPLOYMENT}
+    [\${AZURE_OPENAI_REWRITE_MODEL_NAME}]=${AZURE_OPENAI_REWRITE_MODEL_NAME}
     [\${CHATGPT_MODEL_CAPACITY}]=${AZURE_OPENAI_CHATGPT_MODEL_CAPACITY}
     [\${USE_EXISTING_AOAI}]=${USE_EXISTING_AOAI}
     [\${AZURE_OPENAI_SERVICE_KEY}]=${AZURE_OPENAI_SERVICE_KEY}
@@ -191,6 +193,8 @@ declare -A REPLACE_TOKENS=(
     [\${APPLICATION_TITLE}]=${APPLICATION_TITLE}
     [\${AZURE_KV_ACCESS_OBJ_ID}]=${AZURE_KV_ACCESS_OBJ_ID}
     [\${AZURE_MANAGEMENT_URL}]=${AZURE_MANAGEMENT_URL}
+    [\${SEARCH_INDEX_SHARD_COUNT}]=${SEARCH_INDEX_SHARD_COUNT}
+    [\${SEARCH_INDEX_SHARD_ROUTING}]=${SEARCH_INDEX_SHARD_ROUTING}
 )
 parameter_json=$(cat "$DIR/../infra/main.parameters.json.template")
 for token in "${!REPLACE_TOKENS[@]}"
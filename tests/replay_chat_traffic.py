@@ -0,0 +1,243 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+'''
+Replays /chat traffic recorded by the webapp (CHAT_TRAFFIC_RECORD_PATH) against a
+backend and compares latency distributions between runs
+'''
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from rich.console import Console
+from rich.table import Table
+import rich.traceback
+
+rich.traceback.install()
+console = Console()
+
+class TestFailedError(Exception):
+    """Exception raised when a replay regresses past the allowed threshold."""
+
+# Define top-level variables
+TIMEOUT_VALUE = 180
+PERCENTILES = [50, 90, 95, 99]
+# Filler vocabulary used to rebuild anonymized questions at their recorded length
+FILLER_WORDS = [
+    "policy", "energy", "transport", "budget", "report", "program", "funding", "annual",
+    "regional", "services", "public", "health", "housing", "plan", "review", "data",
+    "water", "climate", "education", "safety", "infrastructure", "grant", "agency", "the",
+    "what", "how", "for", "and", "of", "in", "are", "is", "were", "last", "year",
+]
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = subparsers.add_parser("replay", help="Replay a recording against a backend")
+    replay_parser.add_argument(
+        "--backend_url",
+        required=True,
+        help="Base URL of the webapp, e.g. http://localhost:5000 or a staging slot")
+    replay_parser.add_argument(
+        "--recording",
+        required=True,
+        help="JSON lines file written by the webapp traffic recorder")
+    replay_parser.add_argument(
+        "--output",
+        required=True,
+        help="Where to write the replay results")
+    replay_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay rate multiplier, 1 keeps the recorded arrival times, 0 sends as fast as possible")
+    replay_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Maximum requests in flight (default 16)")
+    replay_parser.add_argument(
+        "--limit",
+        type=int,
+        default=0,
+        help="Only replay the first N records")
+    replay_parser.add_argument(
+        "--seed",
+        type=int,
+        default=42)
+
+    compare_parser = subparsers.add_parser("compare", help="Diff the latency of two replay results")
+    compare_parser.add_argument("--baseline", required=True, help="Results of the reference build")
+    compare_parser.add_argument("--candidate", required=True, help="Results of the build under test")
+    compare_parser.add_argument(
+        "--max_regression_percent",
+        type=float,
+        default=0,
+        help="Fail when the candidate p95 is slower than the baseline by more than this (0 disables)")
+
+    return parser.parse_args()
+
+def load_recording(path, limit):
+    """Load the recorded requests in arrival order"""
+    with open(path, "r", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    records.sort(key=lambda record: record["timestamp"])
+    return records[:limit] if limit else records
+
+def filler_text(rng, length):
+    """Text of roughly the given length built from the filler vocabulary"""
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(FILLER_WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:max(length, 1)]
+
+def build_request(record, rng):
+    """Rebuild a /chat request body from a record, synthesizing text when it was anonymized"""
+    if "history" in record:
+        history = record["history"]
+        overrides = record.get("raw_overrides", {})
+    else:
+        history = []
+        for turn in record["turns"]:
+            history_turn = {"user": filler_text(rng, turn["user_chars"])}
+            if turn["bot_chars"]:
+                history_turn["bot"] = filler_text(rng, turn["bot_chars"])
+            history.append(history_turn)
+        overrides = dict(record.get("overrides", {}))
+        # Folder and tag names are not recorded, search across everything
+        overrides["selected_folders"] = "All"
+        overrides["selected_tags"] = ""
+    return {"history": history, "approach": record["approach"], "overrides": overrides}
+
+def send_request(backend_url, body):
+    """Issue one /chat request and time it"""
+    started = time.perf_counter()
+    try:
+        response = requests.post(f"{backend_url}/chat", json=body, timeout=TIMEOUT_VALUE)
+        status = response.status_code
+        timings = response.json().get("timings_ms", {}) if status == 200 else {}
+    except requests.exceptions.RequestException:
+        status = 0
+        timings = {}
+    return {
+        "status": status,
+        "latency_ms": (time.perf_counter() - started) * 1000,
+        "timings_ms": timings,
+    }
+
+def replay(args):
+    """Re-drive the recorded workload, preserving (scaled) inter-arrival times"""
+    rng = random.Random(args.seed)
+    records = load_recording(args.recording, args.limit)
+    if not records:
+        raise TestFailedError(f"No records found in {args.recording}")
+    console.print(f"Replaying {len(records)} requests against {args.backend_url} at {args.speed}x")
+
+    results = []
+    lock = threading.Lock()
+
+    def run(record, body):
+        result = send_request(args.backend_url, body)
+        result["recorded_latency_ms"] = record.get("elapsed_ms")
+        with lock:
+            results.append(result)
+
+    first_timestamp = records[0]["timestamp"]
+    replay_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for record in records:
+            body = build_request(record, rng)
+            if args.speed > 0:
+                due = (record["timestamp"] - first_timestamp) / args.speed
+                delay = due - (time.perf_counter() - replay_started)
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(run, record, body)
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump({"backend_url": args.backend_url, "recording": args.recording,
+                   "speed": args.speed, "results": results}, file, indent=2)
+
+    print_summary({"replay": summarize(results)})
+    console.print(f"Wrote {args.output}")
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(int(round(pct / 100 * len(ordered))) - 1, 0)]
+
+def summarize(results):
+    """Latency percentiles overall and per stage, plus the error rate"""
+    succeeded = [r for r in results if r["status"] == 200]
+    summary = {
+        "requests": len(results),
+        "error_rate": 1 - len(succeeded) / len(results) if results else 0.0,
+        "total": {p: percentile([r["latency_ms"] for r in succeeded], p) for p in PERCENTILES},
+    }
+    stages = sorted({stage for r in succeeded for stage in r["timings_ms"]})
+    for stage in stages:
+        summary[stage] = {p: percentile([r["timings_ms"].get(stage, 0) for r in succeeded], p)
+                          for p in PERCENTILES}
+    return summary
+
+def print_summary(summaries):
+    """Render one or more summaries side by side"""
+    table = Table(title="Latency (ms)")
+    table.add_column("run")
+    table.add_column("stage")
+    for p in PERCENTILES:
+        table.add_column(f"p{p}", justify="right")
+    for name, summary in summaries.items():
+        for stage, values in summary.items():
+            if isinstance(values, dict):
+                table.add_row(name, stage, *[f"{values[p]:.0f}" for p in PERCENTILES])
+        table.add_row(name, "error rate", f"{summary['error_rate']:.2%}", "", "", "")
+    console.print(table)
+
+def compare(args):
+    """Diff latency distributions between a baseline and a candidate replay"""
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = summarize(json.load(file)["results"])
+    with open(args.candidate, "r", encoding="utf-8") as file:
+        candidate = summarize(json.load(file)["results"])
+
+    print_summary({"baseline": baseline, "candidate": candidate})
+
+    table = Table(title="Candidate vs baseline")
+    table.add_column("stage")
+    for p in PERCENTILES:
+        table.add_column(f"p{p} change", justify="right")
+    for stage, values in candidate.items():
+        if isinstance(values, dict) and stage in baseline:
+            table.add_row(stage, *[
+                f"{(values[p] - baseline[stage][p]) / baseline[stage][p]:+.1%}" if baseline[stage][p] else "n/a"
+                for p in PERCENTILES])
+    console.print(table)
+
+    if args.max_regression_percent and baseline["total"][95]:
+        regression = (candidate["total"][95] - baseline["total"][95]) / baseline["total"][95] * 100
+        if regression > args.max_regression_percent:
+            raise TestFailedError(f"p95 latency regressed by {regression:.1f}%, "
+                                  f"limit is {args.max_regression_percent}%")
+        console.print(f"[green]p95 latency change {regression:+.1f}% is within the limit[/green]")
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    try:
+        if arguments.command == "replay":
+            replay(arguments)
+        else:
+            compare(arguments)
+    except (Exception, TestFailedError) as ex:
+        console.log(f'[red]❌ {ex}[/red]')
+        raise ex
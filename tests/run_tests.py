@@ -27,6 +27,8 @@ OUTPUT_CONTAINER_NAME = "content"
 FILE_PATH = "./test_data"  # Folder containing the files to upload
 UPLOAD_FOLDER_NAME = "functional-test"
 MAX_DURATION = 2700  # 45 minutes
+# Only return the fields the checks read, never the content vectors
+SEARCH_SELECT_FIELDS = ["file_name"]
 
 search_queries = {
     "pdf": "Each brushstroke and note played adds to the vibrant tapestry of human culture,",  
@@ -152,7 +154,7 @@ def check_index(search_service_endpoint, search_index, search_key ):
         )
         console.print("Begining index search")
         for extension, query in search_queries.items():
-            search_results = search_client.search(query, top=20)
+            search_results = search_client.search(query, top=20, select=SEARCH_SELECT_FIELDS)
 
             if search_results:
                 # Iterate through search results
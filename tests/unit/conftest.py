@@ -0,0 +1,185 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+import sys
+import threading
+import time
+
+import openai
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+
+# The webapp, the enrichment service and the functions are deployed separately, each
+# with its own folder as the import root
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+for folder in ("app/backend", "app/enrichment", "functions"):
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+class FakeWatermark:
+    """An index watermark whose etag tests move by hand"""
+
+    def __init__(self, etag: str = None):
+        self.etag = etag
+        self.reads = 0
+
+    def read(self) -> str:
+        self.reads += 1
+        return self.etag
+
+
+class FakeIndexingResult:
+    """The outcome of uploading one document"""
+
+    def __init__(self, key: str, status_code: int, error_message: str = None):
+        self.key = key
+        self.succeeded = status_code < 300
+        self.status_code = status_code
+        self.error_message = error_message
+
+
+class FakeSearchClient:
+    """Stands in for azure.search.documents.SearchClient on one index of a FakeSearchService"""
+
+    def __init__(self, service: "FakeSearchService", index_name: str):
+        self.service = service
+        self.index_name = index_name
+
+    def search(self, search_text, **kwargs):
+        with self.service.lock:
+            self.service.searches.append((self.index_name, search_text, kwargs))
+        hits = self.service.hits.get(self.index_name, [])
+        if isinstance(hits, Exception):
+            raise hits
+        return iter(hits)
+
+    def upload_documents(self, documents):
+        with self.service.lock:
+            self.service.uploads.append((self.index_name, [document["id"] for document in documents]))
+            response = self.service.upload_responses.pop(0) if self.service.upload_responses else {}
+        if isinstance(response, Exception):
+            raise response
+        return [FakeIndexingResult(document["id"], response.get(document["id"], 201), "error")
+                for document in documents]
+
+
+class FakeSearchService:
+    """The indexes of a search service. Searches of an index return the hits set for it, or
+    raise the exception set for it, and are recorded in searches. Each upload is answered with
+    the next of the set upload responses: an exception, or the status code of each document
+    by key with 201 for keys not given. Uploaded keys are recorded in uploads"""
+
+    def __init__(self):
+        self.hits = {}
+        self.searches = []
+        self.upload_responses = []
+        self.uploads = []
+        self.lock = threading.Lock()
+
+    def client(self, endpoint, index_name, credential) -> FakeSearchClient:
+        """Patch over SearchClient in the module under test"""
+        return FakeSearchClient(self, index_name)
+
+
+class FakeBlobClient:
+    """Stands in for azure.storage.blob.BlobClient on one blob of a FakeContainerClient"""
+
+    def __init__(self, container: "FakeContainerClient", name: str):
+        self.container = container
+        self.name = name
+        self.encoding = None
+
+    def download_blob(self, encoding: str = None):
+        self.encoding = encoding
+        with self.container.lock:
+            self.container.downloads.append(self.name)
+            if self.name not in self.container.blobs:
+                raise ResourceNotFoundError("not found")
+        return self
+
+    def readall(self):
+        data = self.container.blobs[self.name]
+        return data.decode(self.encoding) if self.encoding else data
+
+    def upload_blob(self, data, overwrite=False):
+        self.container.uploads_released.wait()
+        with self.container.lock:
+            self.container.blobs[self.name] = data
+
+
+class FakeContainerClient:
+    """Stands in for azure.storage.blob.ContainerClient, keeping blobs by name in memory.
+    Downloads are recorded in downloads. Uploads wait while uploads_released is clear"""
+
+    def __init__(self):
+        self.blobs = {}
+        self.downloads = []
+        self.lock = threading.Lock()
+        self.uploads_released = threading.Event()
+        self.uploads_released.set()
+
+    def get_blob_client(self, name: str) -> FakeBlobClient:
+        return FakeBlobClient(self, name)
+
+    def download_blob(self, name: str, encoding: str = None) -> FakeBlobClient:
+        return self.get_blob_client(name).download_blob(encoding)
+
+
+class FakeOpenAI:
+    """Answers ChatCompletion.create with the next of the set responses, the content of the
+    completion or an exception to raise, and "answer" once they run out. The arguments of
+    each call are recorded in calls"""
+
+    def __init__(self):
+        self.responses = []
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def create(self, **kwargs):
+        with self.lock:
+            self.calls.append(kwargs)
+            response = self.responses.pop(0) if self.responses else "answer"
+        if isinstance(response, Exception):
+            raise response
+        return openai.util.convert_to_openai_object({
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": response}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110},
+        })
+
+
+@pytest.fixture
+def search_service() -> FakeSearchService:
+    return FakeSearchService()
+
+
+@pytest.fixture
+def watermark() -> FakeWatermark:
+    return FakeWatermark("1")
+
+
+@pytest.fixture
+def container_client() -> FakeContainerClient:
+    return FakeContainerClient()
+
+
+@pytest.fixture
+def openai_service(monkeypatch) -> FakeOpenAI:
+    service = FakeOpenAI()
+    monkeypatch.setattr(openai.ChatCompletion, "create", service.create)
+    return service
+
+
+def _wait_until(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def wait_until():
+    """Polls condition until it holds, failing the test after timeout seconds"""
+    return _wait_until
@@ -0,0 +1,70 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_vectors(wait_until):
+    calls = []
+    release = threading.Event()
+
+    def encode(texts):
+        calls.append(list(texts))
+        release.wait()
+        return [[float(len(text))] for text in texts]
+
+    batcher = MicroBatcher("test", encode, max_batch_size=32, max_wait_ms=50)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        first = executor.submit(batcher.submit, ["a"])
+        wait_until(lambda: calls)
+        # Queued while the first batch is encoding, so they are batched together
+        second = executor.submit(batcher.submit, ["bb", "ccc"])
+        third = executor.submit(batcher.submit, ["dddd"])
+        wait_until(lambda: batcher.get_metrics()["queue_depth"] == 2)
+        release.set()
+        assert first.result() == [[1.0]]
+        assert second.result() == [[2.0], [3.0]]
+        assert third.result() == [[4.0]]
+    assert calls == [["a"], ["bb", "ccc", "dddd"]]
+
+
+def test_request_over_max_batch_size_is_encoded_whole():
+    calls = []
+    batcher = MicroBatcher("test", lambda texts: calls.append(len(texts)) or [[0.0]] * len(texts),
+                           max_batch_size=2, max_wait_ms=0)
+    assert batcher.submit(["a", "b", "c"]) == [[0.0]] * 3
+    assert calls == [3]
+
+
+def test_encode_error_is_raised_to_every_request_of_the_batch():
+    def fail(texts):
+        raise RuntimeError("failed")
+
+    batcher = MicroBatcher("test", fail)
+    with pytest.raises(RuntimeError):
+        batcher.submit(["a"])
+
+
+def test_batches_encode_concurrently_up_to_the_limit(wait_until):
+    encoding = []
+    release = threading.Event()
+
+    def encode(texts):
+        encoding.append(list(texts))
+        release.wait()
+        return [[0.0]] * len(texts)
+
+    batcher = MicroBatcher("test", encode, max_batch_size=1, max_wait_ms=0, max_concurrent_batches=2)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(batcher.submit, [text]) for text in ["a", "b", "c"]]
+        # Two batches encode at once, the third waits for a free slot
+        wait_until(lambda: len(encoding) == 2)
+        wait_until(lambda: batcher.get_metrics()["queue_depth"] == 1)
+        release.set()
+        assert [future.result() for future in futures] == [[[0.0]]] * 3
+    assert sorted(encoding) == [["a"], ["b"], ["c"]]
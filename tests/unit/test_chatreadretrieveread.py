@@ -0,0 +1,300 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import base64
+from types import SimpleNamespace
+
+import openai
+import pytest
+import requests
+from azure.core.exceptions import ServiceResponseError
+
+from approaches import chatreadretrieveread
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from core import messagebuilder, shardedsearch
+from core.hedging import HedgedCall
+from core.openairouter import OpenAIEndpoint, OpenAIRouter
+from core.prefetch import FollowupPrefetcher
+from core.searchcache import SearchResultCache
+from core.workingset import ConversationWorkingSet
+from core.shardedsearch import ShardedSearchClient
+from shared_code.index_shards import IndexShardRouter
+
+
+class FakeEmbeddingService:
+    """Answers each POST to /embed with the next of the set responses, a status code or an
+    exception to raise, and the vector [0.5, 0.5] once they run out"""
+
+    def __init__(self):
+        self.responses = []
+        self.calls = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.calls.append(json)
+        response = self.responses.pop(0) if self.responses else 200
+        if isinstance(response, Exception):
+            raise response
+        return SimpleNamespace(status_code=response, headers={"Content-Type": "application/json"},
+                               json=lambda: {"data": [0.5, 0.5]})
+
+
+def hit(chunk: str) -> dict:
+    return {
+        "id": chunk,
+        "content": f"content of {chunk}",
+        "file_uri": f"https://account.blob.core.windows.net/upload/folder/{chunk}.pdf",
+        "pages": [1],
+        "chunk_file": f"folder/{chunk}.pdf/0.json",
+        "@search.score": 1.0,
+    }
+
+
+@pytest.fixture
+def embedding_service(monkeypatch) -> FakeEmbeddingService:
+    service = FakeEmbeddingService()
+    monkeypatch.setattr(chatreadretrieveread.requests, "post", service.post)
+    return service
+
+
+@pytest.fixture
+def make_approach(monkeypatch, search_service, openai_service, embedding_service):
+    """Builds the approach over fake search, OpenAI and embedding services"""
+    # Count words rather than tokens, tiktoken downloads its encodings on first use
+    monkeypatch.setattr(messagebuilder, "num_tokens_from_messages",
+                        lambda message, model: sum(len(value.split()) for value in message.values()))
+    monkeypatch.setattr(shardedsearch, "SearchClient", search_service.client)
+    search_service.hits = {"index": [hit("a"), hit("b")]}
+    blob_client = SimpleNamespace(account_name="account",
+                                  credential=SimpleNamespace(account_key=base64.b64encode(b"key").decode()))
+
+    router = OpenAIRouter("chat", [OpenAIEndpoint("myopenai", "key", "gpt-35-turbo-16k")], "2023-06-01-preview")
+
+    def make(request_deadline_seconds: float = 60, rewrite_skip_max_words: int = 6):
+        return ChatReadRetrieveReadApproach(
+            ShardedSearchClient("https://search", None, IndexShardRouter("index")),
+            "myopenai",
+            "key",
+            "gpt-35-turbo-16k",
+            "file_uri",
+            "content",
+            "pages",
+            "chunk_file",
+            "content",
+            blob_client,
+            "English",
+            "gpt-35-turbo-16k",
+            "0613",
+            False,
+            "BAAI/bge-small-en-v1.5",
+            "enrichment",
+            SearchResultCache(ttl_seconds=0, max_entries=0),
+            request_deadline_seconds,
+            HedgedCall("embedding"),
+            HedgedCall("search"),
+            "",
+            rewrite_skip_max_words,
+            router,
+            router,
+            FollowupPrefetcher(),
+            ConversationWorkingSet())
+    return make
+
+
+def run(approach: ChatReadRetrieveReadApproach, question: str = "What is the policy?", **overrides):
+    history = [{"user": "Hello", "bot": "Hi"}, {"user": question}]
+    return approach.run(history, {"response_temp": 0.6, **overrides})
+
+
+def test_turn_within_the_deadline_is_not_degraded(make_approach, search_service, openai_service):
+    openai_service.responses = ["policy keywords", "The policy is [File0]"]
+    r = run(make_approach())
+    assert r["degradations"] == []
+    assert r["answer"] == "The policy is [File0]"
+    assert search_service.searches[0][1] == "policy keywords"
+    assert "vector_queries" in search_service.searches[0][2]
+
+
+def test_spent_deadline_skips_every_optional_stage(make_approach, search_service, openai_service,
+                                                   embedding_service):
+    r = run(make_approach(request_deadline_seconds=0), semantic_ranker=True)
+    assert r["degradations"] == [
+        "query rewrite skipped, searched with the question as asked",
+        "query embedding skipped, keyword search only",
+        "semantic ranker skipped",
+        f"answer capped at {ChatReadRetrieveReadApproach.DEGRADED_ANSWER_MAX_TOKENS} tokens",
+    ]
+    assert embedding_service.calls == []
+    index_name, search_text, search_kwargs = search_service.searches[0]
+    assert search_text == "What is the policy?"
+    assert search_kwargs["vector_queries"] is None
+    assert search_kwargs["timeout"] == ChatReadRetrieveReadApproach.SEARCH_MIN_TIMEOUT_SECONDS
+    # Only the answer completion ran, capped
+    assert len(openai_service.calls) == 1
+    assert openai_service.calls[0]["max_tokens"] == ChatReadRetrieveReadApproach.DEGRADED_ANSWER_MAX_TOKENS
+
+
+def test_rewrite_timeout_searches_with_the_question(make_approach, search_service, openai_service):
+    openai_service.responses = [openai.error.Timeout("timed out"), "The policy is [File0]"]
+    r = run(make_approach())
+    assert r["degradations"] == ["query rewrite timed out, searched with the question as asked"]
+    assert search_service.searches[0][1] == "What is the policy?"
+
+
+@pytest.mark.parametrize("error", [openai.error.RateLimitError("throttled"),
+                                   openai.error.ServiceUnavailableError("unavailable")])
+def test_failed_rewrite_searches_with_the_question(make_approach, search_service, openai_service, error):
+    openai_service.responses = [error, "The policy is [File0]"]
+    r = run(make_approach())
+    assert r["degradations"] == ["query rewrite failed, searched with the question as asked"]
+    assert search_service.searches[0][1] == "What is the policy?"
+    assert r["answer"] == "The policy is [File0]"
+
+
+def test_embedding_timeout_searches_by_keyword(make_approach, search_service, embedding_service):
+    embedding_service.responses = [requests.exceptions.Timeout("timed out")]
+    r = run(make_approach())
+    assert r["degradations"] == ["query embedding timed out, keyword search only"]
+    assert search_service.searches[0][2]["vector_queries"] is None
+
+
+@pytest.mark.parametrize("response", [500, requests.exceptions.ConnectionError("refused")])
+def test_failed_embedding_searches_by_keyword(make_approach, search_service, embedding_service, response):
+    embedding_service.responses = [response]
+    r = run(make_approach())
+    assert r["degradations"] == ["query embedding failed, keyword search only"]
+    assert search_service.searches[0][2]["vector_queries"] is None
+
+
+def test_search_timeout_answers_without_sources(make_approach, search_service, openai_service):
+    search_service.hits = {"index": ServiceResponseError("timed out")}
+    r = run(make_approach())
+    assert r["degradations"] == ["search timed out, answered without sources"]
+    assert r["data_points"] == []
+    assert r["answer"] == "answer"
+
+
+def test_usage_is_reported_for_each_completion(make_approach, openai_service):
+    r = run(make_approach())
+    assert set(r["usage"]) == {"rewrite", "answer"}
+    assert r["usage"]["answer"]["model"] == "gpt-35-turbo-16k"
+    assert r["usage"]["answer"]["prompt_tokens"] == 100
+    assert r["usage"]["answer"]["completion_tokens"] == 10
+
+
+def test_prefetched_follow_up_skips_retrieval(make_approach, search_service, openai_service):
+    approach = make_approach()
+    approach.prefetcher = FollowupPrefetcher(enabled=True)
+    # The first question is searched as asked, the follow-up is rewritten by the prefetch
+    openai_service.responses = ["The policy is [File0] <<<Who approves it?>>>", "approver keywords",
+                                "The manager [File0]"]
+    history = [{"user": "What is the travel policy?"}]
+    overrides = {"response_temp": 0.6, "suggest_followup_questions": True}
+    r = approach.run(history, overrides)
+    history = [{**history[0], "bot": r["answer"]}, {"user": "Who approves it?"}]
+    r = approach.run(history, overrides)
+
+    assert r["answer"] == "The manager [File0]"
+    searched = [search[1] for search in search_service.searches]
+    assert searched == ["What is the travel policy?", "approver keywords"]
+    # The rewrite was recorded by the prefetcher, the turn reports only the answer
+    assert list(r["usage"]) == ["answer"]
+    assert set(r["timings_ms"]) == {"prefetch_wait", "answer"}
+
+
+def test_turn_after_a_prefetched_turn_reuses_its_chunks(make_approach, search_service, openai_service):
+    approach = make_approach()
+    approach.prefetcher = FollowupPrefetcher(enabled=True)
+    openai_service.responses = ["The policy is [File0] <<<Who approves it?>>>", "approver keywords",
+                                "The manager [File0]", "exception keywords", "None [File0]"]
+    overrides = {"response_temp": 0.6, "suggest_followup_questions": True}
+    history = [{"user": "What is the travel policy?"}]
+    for question in ["Who approves it?", "Are there exceptions?"]:
+        r = approach.run(history, overrides)
+        history = history[:-1] + [{**history[-1], "bot": r["answer"]}, {"user": question}]
+    r = approach.run(history, overrides)
+
+    assert approach.prefetcher.get_metrics()["hits"] == 1
+    # The third turn ranks without content and takes it from the prefetched turn's hits
+    assert "content" not in search_service.searches[-1][2]["select"]
+    assert approach.working_set.get_metrics()["reused_chunks"] == 2
+    assert [point.split("| ")[1] for point in r["data_points"]] == ["content of a", "content of b"]
+
+
+def test_retrieve_searches_the_question_without_completions(make_approach, search_service, openai_service):
+    r = make_approach().retrieve([{"user": "What is the policy?"}], {"top": 2})
+    assert openai_service.calls == []
+    assert search_service.searches[0][1] == "What is the policy?"
+    assert r["data_points"] == ["folder/a.pdf| content of a", "folder/b.pdf| content of b"]
+    assert r["citation_lookup"]["File1"]["citation"] == \
+        "https://account.blob.core.windows.net/content/folder/b.pdf/0.json"
+    assert set(r["timings_ms"]) == {"embedding", "search"}
+    assert r["degradations"] == []
+
+
+def test_later_turns_reuse_chunks_of_the_same_conversation_only(make_approach, search_service):
+    approach = make_approach()
+    overrides = {"response_temp": 0.6, "selected_folders": "finance", "selected_tags": ""}
+    history = [{"user": "What is the travel policy?"}]
+    for question in ["And for contractors?", "And for interns?"]:
+        approach.run(history, overrides)
+        history = history[:-1] + [{**history[-1], "bot": "answer"}, {"user": question}]
+    approach.run(history, overrides)
+    # The third turn ranks without content, the first two already held its hits
+    assert "content" in search_service.searches[0][2]["select"]
+    assert "content" not in search_service.searches[-1][2]["select"]
+
+    other_overrides = {"selected_folders": "legal", "selected_tags": ""}
+    assert not approach.working_set.expects_reuse(ConversationWorkingSet.make_key(history, other_overrides))
+    assert approach.working_set.get_metrics()["conversations"] == 1
+
+
+def test_prefetch_leaves_the_working_set_untouched(make_approach):
+    approach = make_approach()
+    result = approach.prefetch_retrieval([{"user": "What is the travel policy?"}], {})
+    assert [doc["id"] for doc in result["results"]] == ["a", "b"]
+    assert approach.working_set.get_metrics()["conversations"] == 0
+
+
+def test_folder_filter_matches_subfolders_and_tags(make_approach):
+    search_filter, folders = make_approach().build_search_filter("finance/,legal/2023", "draft")
+    assert folders == ["finance", "legal/2023"]
+    assert search_filter == ("(folder_hierarchy/any(f: search.in(f, 'finance,legal/2023', ','))"
+                             " or search.in(folder, 'finance,legal/2023', ','))"
+                             " and tags/any(t: search.in(t, 'draft', ','))")
+
+
+def test_all_folders_is_not_filtered(make_approach):
+    assert make_approach().build_search_filter("All", "") == (None, None)
+
+
+@pytest.mark.parametrize("question", [
+    "What is the travel policy?",
+    "remote work allowance",
+])
+def test_short_first_question_is_searched_as_asked(make_approach, search_service, openai_service, question):
+    make_approach().run([{"user": question}], {"response_temp": 0.6})
+    # Only the answer completion ran
+    assert len(openai_service.calls) == 1
+    assert search_service.searches[0][1] == question
+
+
+@pytest.mark.parametrize("history", [
+    # A follow-up needs the conversation folded in
+    [{"user": "What is the travel policy?", "bot": "It covers flights."}, {"user": "Hotels?"}],
+    # Refers to something outside the question
+    [{"user": "What does it cover?"}],
+    # Longer than rewrite_skip_max_words
+    [{"user": "What are the rules for booking flights and hotels abroad?"}],
+    # Citations, file names and quoted phrases are stripped by the rewrite
+    [{"user": "Summarize policy.pdf"}],
+    [{"user": 'Find "remote work"'}],
+    # Translated by the rewrite
+    [{"user": "Qué es la política?"}],
+])
+def test_question_that_needs_the_rewrite_is_rewritten(make_approach, history):
+    assert not make_approach().is_self_contained_question(history)
+
+
+def test_rewrite_skip_can_be_disabled(make_approach):
+    approach = make_approach(rewrite_skip_max_words=0)
+    assert not approach.is_self_contained_question([{"user": "What is the travel policy?"}])
@@ -0,0 +1,65 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import json
+import threading
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+
+from chunk_fetcher import ChunkFetcher
+
+
+def add_chunks(container_client, count):
+    names = [f"folder/file.pdf/{i}.json" for i in range(count)]
+    for i, name in enumerate(names):
+        container_client.blobs[name] = json.dumps({"content": f"chunk {i}"}).encode("utf-8")
+    return names
+
+
+def test_chunks_are_yielded_in_input_order(container_client):
+    names = add_chunks(container_client, 40)
+    fetched = list(ChunkFetcher(container_client, max_in_flight=4).fetch(names))
+    assert [name for name, _ in fetched] == names
+    assert [chunk["content"] for _, chunk in fetched] == [f"chunk {i}" for i in range(40)]
+
+
+def test_downloads_run_ahead_by_at_most_max_in_flight(container_client):
+    names = add_chunks(container_client, 40)
+    fetcher = ChunkFetcher(container_client, max_in_flight=4)
+    for i, _ in enumerate(fetcher.fetch(names)):
+        # The chunks yielded so far plus those still in flight
+        assert len(container_client.downloads) <= i + 1 + 4
+
+
+def test_downloads_overlap(container_client):
+    names = add_chunks(container_client, 4)
+    started = threading.Barrier(4, timeout=5)
+    download_blob = container_client.download_blob
+
+    def blocking_download(name, **kwargs):
+        # Only returns once all four downloads are running at once
+        started.wait()
+        return download_blob(name, **kwargs)
+
+    container_client.download_blob = blocking_download
+    assert len(list(ChunkFetcher(container_client, max_in_flight=4).fetch(names))) == 4
+
+
+def test_a_failed_download_is_raised(container_client):
+    names = add_chunks(container_client, 3)
+    del container_client.blobs[names[1]]
+    fetched = ChunkFetcher(container_client, max_in_flight=2).fetch(names)
+    assert next(fetched)[0] == names[0]
+    with pytest.raises(ResourceNotFoundError):
+        next(fetched)
+
+
+def test_downloaded_bytes_are_counted_before_decoding(container_client):
+    data = json.dumps({"content": "café"}, ensure_ascii=False).encode("utf-8")
+    container_client.blobs["folder/file.pdf/0.json"] = data
+    fetcher = ChunkFetcher(container_client)
+    assert list(fetcher.fetch(["folder/file.pdf/0.json"])) == [("folder/file.pdf/0.json", {"content": "café"})]
+    metrics = fetcher.get_metrics()
+    assert metrics["chunks"] == 1
+    assert metrics["bytes"] == len(data) == len("café") + len('{"content": ""}') + 1
@@ -0,0 +1,23 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from core.deadline import Deadline
+
+
+def test_timeout_is_capped_by_the_stage_limit_and_the_reserve():
+    deadline = Deadline(60)
+    assert deadline.timeout(10) == 10
+    assert 44 < deadline.timeout(50, reserve=15) <= 45
+
+
+def test_spent_deadline_allows_nothing():
+    deadline = Deadline(0)
+    assert deadline.remaining() == 0
+    assert deadline.timeout(10, reserve=15) == 0
+    assert not deadline.allows(1)
+
+
+def test_allows_leaves_the_reserve_for_later_stages():
+    deadline = Deadline(20)
+    assert deadline.allows(4, reserve=15)
+    assert not deadline.allows(6, reserve=15)
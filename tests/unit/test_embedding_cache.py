@@ -0,0 +1,64 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import pytest
+
+from embedding_cache import EmbeddingCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache" / "embeddings.sqlite")
+
+
+def test_vectors_are_cached_per_model(path):
+    cache = EmbeddingCache(path)
+    key = EmbeddingCache.make_key("text")
+    cache.put_many("model", {key: [0.5, -1.0]})
+    assert cache.get_many("model", [key, "missing"]) == {key: [0.5, -1.0]}
+    assert cache.get_many("other-model", [key]) == {}
+    metrics = cache.get_metrics()
+    assert metrics["local_hits"] == 1
+    assert metrics["misses"] == 2
+
+
+def test_cache_persists_across_instances(path):
+    EmbeddingCache(path).put_many("model", {"key": [1.0]})
+    assert EmbeddingCache(path).get_many("model", ["key"]) == {"key": [1.0]}
+
+
+def test_blob_tier_is_shared_and_fills_the_local_tier(tmp_path, container_client, wait_until):
+    EmbeddingCache(str(tmp_path / "a.sqlite"), container_client=container_client,
+                   blob_prefix="embeddings/").put_many("model", {"key": [2.0]})
+    wait_until(lambda: list(container_client.blobs) == ["embeddings/model/key"])
+
+    cache = EmbeddingCache(str(tmp_path / "b.sqlite"), container_client=container_client,
+                           blob_prefix="embeddings/")
+    assert cache.get_many("model", ["key"]) == {"key": [2.0]}
+    container_client.blobs.clear()
+    assert cache.get_many("model", ["key"]) == {"key": [2.0]}
+    metrics = cache.get_metrics()
+    assert metrics["blob_hits"] == 1
+    assert metrics["local_hits"] == 1
+
+
+def test_oldest_vectors_are_pruned(path):
+    cache = EmbeddingCache(path, max_entries=1000)
+    cache.put_many("model", {f"old-{i}": [0.0] for i in range(500)})
+    cache.put_many("model", {f"new-{i}": [1.0] for i in range(1000)})
+    assert cache.get_many("model", ["old-0"]) == {}
+    assert len(cache.get_many("model", [f"new-{i}" for i in range(1000)])) == 1000
+
+
+def test_blob_writes_do_not_block_callers(tmp_path, container_client, wait_until):
+    container_client.uploads_released.clear()
+    cache = EmbeddingCache(str(tmp_path / "a.sqlite"), container_client=container_client,
+                           max_pending_blob_writes=2)
+    cache.put_many("model", {"a": [1.0], "b": [2.0], "c": [3.0]})
+    # Cached locally while the uploads are held, the one over the limit is dropped
+    assert cache.get_many("model", ["a", "b", "c"]) == {"a": [1.0], "b": [2.0], "c": [3.0]}
+    assert cache.get_metrics()["pending_blob_writes"] == 2
+    assert cache.get_metrics()["dropped_blob_writes"] == 1
+    container_client.uploads_released.set()
+    wait_until(lambda: cache.get_metrics()["pending_blob_writes"] == 0)
+    assert sorted(container_client.blobs) == ["model/a", "model/b"]
@@ -0,0 +1,72 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import threading
+import time
+
+import pytest
+
+from core.hedging import HedgedCall
+
+
+def warm_up(hedger: HedgedCall, seconds: float = 0.01):
+    for _ in range(hedger.min_samples):
+        hedger.call(lambda: time.sleep(seconds))
+
+
+def test_disabled_runs_on_the_callers_thread():
+    hedger = HedgedCall("test", enabled=False)
+    assert hedger.call(lambda: threading.current_thread()) is threading.current_thread()
+    assert hedger.executor is None
+
+
+def test_no_hedge_before_enough_samples():
+    hedger = HedgedCall("test", enabled=True, budget_ratio=1.0, min_samples=5)
+    assert hedger.hedge_delay() is None
+    assert hedger.call(lambda: threading.current_thread()) is threading.current_thread()
+    assert hedger.get_metrics()["hedges"] == 0
+
+
+def test_slow_call_is_hedged_and_hedge_wins():
+    hedger = HedgedCall("test", enabled=True, budget_ratio=1.0, min_samples=5)
+    warm_up(hedger)
+    result = hedger.call(lambda: time.sleep(1) or "primary", hedge_attempt=lambda: "hedge")
+    assert result == "hedge"
+    metrics = hedger.get_metrics()
+    assert metrics["hedges"] == 1
+    assert metrics["hedge_wins"] == 1
+
+
+def test_no_hedge_without_budget():
+    hedger = HedgedCall("test", enabled=True, budget_ratio=0.01, min_samples=5)
+    warm_up(hedger)
+    assert hedger.call(lambda: time.sleep(0.1) or "primary", hedge_attempt=lambda: "hedge") == "primary"
+    assert hedger.get_metrics()["hedges"] == 0
+
+
+def test_error_is_raised_when_every_attempt_fails():
+    hedger = HedgedCall("test", enabled=True, budget_ratio=1.0, min_samples=5)
+    warm_up(hedger)
+
+    def fail():
+        time.sleep(0.1)
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        hedger.call(fail)
+
+
+def test_full_pool_runs_inline_without_hedging():
+    hedger = HedgedCall("test", enabled=True, budget_ratio=1.0, min_samples=5, max_workers=1)
+    warm_up(hedger)
+    release = threading.Event()
+    blocker = threading.Thread(target=hedger.call, args=(release.wait,))
+    blocker.start()
+    try:
+        # Let the blocking call take the only worker, and its hedge find no room
+        time.sleep(0.1)
+        assert hedger.call(lambda: threading.current_thread()) is threading.current_thread()
+        assert hedger.get_metrics()["unhedged_pool_full"] == 1
+    finally:
+        release.set()
+        blocker.join()
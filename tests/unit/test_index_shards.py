@@ -0,0 +1,30 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from shared_code.index_shards import IndexShardRouter
+
+
+def test_unsharded_uses_base_index():
+    router = IndexShardRouter("index")
+    assert router.index_names == ["index"]
+    assert router.get_index_name("folder", "folder/file.pdf") == "index"
+    assert router.get_index_names_for_folders(["folder"]) == ["index"]
+
+
+def test_folder_routing_keeps_top_level_folder_together():
+    router = IndexShardRouter("index", 4, "folder")
+    assert router.index_names == ["index-0", "index-1", "index-2", "index-3"]
+    shard = router.get_index_name("finance", "finance/a.pdf")
+    assert router.get_index_name("finance/2023/q1", "finance/2023/q1/b.pdf") == shard
+    assert router.get_index_names_for_folders(["finance/2023"]) == [shard]
+
+
+def test_folder_routing_without_filter_searches_every_shard():
+    router = IndexShardRouter("index", 3, "folder")
+    assert router.get_index_names_for_folders([]) == router.index_names
+
+
+def test_hash_routing_needs_every_shard():
+    router = IndexShardRouter("index", 3, "hash")
+    assert router.get_index_name("folder", "folder/a.pdf") == router.get_index_name("other", "folder/a.pdf")
+    assert router.get_index_names_for_folders(["folder"]) == router.index_names
@@ -0,0 +1,105 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+
+import index_writer
+from index_writer import ACTION_OVERHEAD_BYTES, IndexingError, IndexWriter
+from shared_code.index_shards import IndexShardRouter
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers: dict = None):
+        self.status_code = status_code
+        self.reason = "Service Unavailable"
+        self.headers = headers or {}
+
+    def text(self):
+        return ""
+
+
+@pytest.fixture(autouse=True)
+def search_client(monkeypatch, search_service):
+    monkeypatch.setattr(index_writer, "SearchClient", search_service.client)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(index_writer, "time", SimpleNamespace(sleep=slept.append))
+    return slept
+
+
+def document(key: str, folder: str = "folder", content: str = "") -> dict:
+    return {"id": key, "folder": folder, "file_name": f"{folder}/file.pdf", "content": content}
+
+
+def writer(**kwargs) -> IndexWriter:
+    return IndexWriter("https://search", None, IndexShardRouter("index"), **kwargs)
+
+
+def test_uploads_are_split_by_payload_size(sleeps, search_service):
+    documents = [document(str(i), content="x" * 100) for i in range(10)]
+    size = len(json.dumps(documents[0], separators=(",", ":"))) + ACTION_OVERHEAD_BYTES
+    assert writer(max_batch_bytes=size * 3).write(documents) == {}
+    assert [len(keys) for _, keys in search_service.uploads] == [3, 3, 3, 1]
+
+
+def test_uploads_are_split_by_document_count(sleeps, search_service):
+    assert writer(max_batch_documents=4).write([document(str(i)) for i in range(10)]) == {}
+    assert sorted(len(keys) for _, keys in search_service.uploads) == [2, 4, 4]
+
+
+def test_documents_are_uploaded_to_their_shard(sleeps, search_service):
+    router = IndexShardRouter("index", 4, "folder")
+    documents = [document("a", "finance"), document("b", "legal")]
+    IndexWriter("https://search", None, router).write(documents)
+    uploaded = {keys[0]: index_name for index_name, keys in search_service.uploads}
+    assert uploaded == {"a": router.get_index_name("finance", ""), "b": router.get_index_name("legal", "")}
+
+
+def test_only_transient_failures_are_retried(sleeps, search_service):
+    search_service.upload_responses = [{"flaky": 503, "bad": 400}]
+    errors = writer().write([document("good"), document("flaky"), document("bad")])
+    assert errors == {"bad": "400 error"}
+    assert [keys for _, keys in search_service.uploads] == [["good", "flaky", "bad"], ["flaky"]]
+    assert len(sleeps) == 1
+
+
+def test_throttled_request_waits_as_long_as_asked(sleeps, search_service):
+    search_service.upload_responses = [HttpResponseError(response=FakeResponse(503, {"Retry-After": "7"}))]
+    throttled_writer = writer()
+    assert throttled_writer.write([document("a")]) == {}
+    assert sleeps == [7.0]
+    assert throttled_writer.get_metrics()["throttled_requests"] == 1
+
+
+def test_retries_stop_without_a_last_backoff(sleeps, search_service):
+    search_service.upload_responses = [{"a": 503}] * 3
+    errors = writer(max_retries=2).write([document("a")])
+    assert errors == {"a": "503 error"}
+    assert len(search_service.uploads) == 3
+    assert len(sleeps) == 2
+
+
+def test_request_error_fails_its_batch_only(sleeps, search_service):
+    search_service.upload_responses = [HttpResponseError(response=FakeResponse(400))]
+    errors = writer(max_batch_documents=1, concurrency=1).write([document("a"), document("b")])
+    assert list(errors) == ["a"]
+
+
+def test_failures_are_described_in_full_across_messages():
+    failed = {f"key-{i}": "400 invalid" for i in range(30)}
+    messages = IndexingError(failed).describe(name=str.upper, max_length=100)
+    assert all(len(message) <= 100 for message in messages)
+    entries = [entry for message in messages for entry in message.split("; ")]
+    assert entries == [f"KEY-{i} (400 invalid)" for i in range(30)]
+
+
+def test_failure_too_long_for_a_message_gets_its_own():
+    messages = IndexingError({"a": "x" * 50, "b": "short"}).describe(max_length=20)
+    assert messages == [f"a ({'x' * 50})", "b (short)"]
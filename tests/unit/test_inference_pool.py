@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from inference_pool import InferencePool
+
+
+class FakeModel:
+    """Embeds each text as the id of the worker process that encoded it"""
+    def share_memory(self):
+        pass
+
+    def encode(self, texts):
+        return np.array([[float(os.getpid())] for _ in texts])
+
+
+@pytest.fixture
+def pool():
+    pool = InferencePool({"model": FakeModel()}, workers=2, torch_threads=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_large_batch_is_split_across_workers_in_order(pool):
+    embeddings = pool.encode("model", [str(i) for i in range(32)])
+    assert len(embeddings) == 32
+    # The first half went to one worker, the second half to the other
+    assert len({vector[0] for vector in embeddings[:16]}) == 1
+    assert embeddings[0] != embeddings[16]
+
+
+def test_concurrent_small_batches_run_on_different_workers(pool):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(pool.encode, "model", ["query"]) for _ in range(2)]
+        pids = {future.result()[0][0] for future in futures}
+    assert len(pids) == 2
+    assert os.getpid() not in pids
+
+
+def test_idle_workers_take_small_batches_in_turn(pool):
+    pids = [pool.encode("model", ["query"])[0][0] for _ in range(4)]
+    assert pids[0] != pids[1]
+    assert pids[:2] == pids[2:]
@@ -0,0 +1,49 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+sentence_transformers = pytest.importorskip("sentence_transformers")
+
+from onnx_backend import PARITY_SENTENCES, OnnxEmbeddingModel, export_onnx, parity
+
+# A small mean-pooled, normalized model, downloaded from the Hugging Face hub on first use
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+@pytest.fixture(scope="module")
+def st_model():
+    return sentence_transformers.SentenceTransformer(MODEL_NAME)
+
+
+@pytest.fixture(scope="module")
+def onnx_model(st_model, tmp_path_factory):
+    return OnnxEmbeddingModel(st_model, export_onnx(st_model, str(tmp_path_factory.mktemp("onnx")),
+                                                    quantize=False))
+
+
+def test_embeddings_match_sentence_transformers(st_model, onnx_model):
+    expected = st_model.encode(PARITY_SENTENCES)
+    # A batch size that splits the sentences checks they come back in input order
+    actual = onnx_model.encode(PARITY_SENTENCES, batch_size=3)
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual, expected, atol=1e-4)
+    assert parity(st_model, onnx_model) > 0.9999
+
+
+def test_single_text_is_embedded_as_one_vector(st_model, onnx_model):
+    expected = st_model.encode(PARITY_SENTENCES[0])
+    actual = onnx_model.encode(PARITY_SENTENCES[0])
+    assert actual.shape == expected.shape == (st_model.get_sentence_embedding_dimension(),)
+    np.testing.assert_allclose(actual, expected, atol=1e-4)
+
+
+def test_quantized_model_stays_above_the_default_parity_threshold(st_model, tmp_path):
+    quantized = OnnxEmbeddingModel(st_model, export_onnx(st_model, str(tmp_path), quantize=True))
+    assert quantized.onnx_path.endswith("model-int8.onnx")
+    # The ONNX_MIN_SIMILARITY default the service checks before serving a model
+    assert parity(st_model, quantized) >= 0.99
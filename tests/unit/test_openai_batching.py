@@ -0,0 +1,22 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from openai_batching import encode_in_batches
+
+
+def test_texts_are_sent_in_capped_batches_and_kept_in_order():
+    requests = []
+
+    def encode(texts):
+        requests.append(list(texts))
+        # The service does not promise to answer in input order
+        return {"data": [{"index": i, "embedding": [float(len(text))]}
+                         for i, text in reversed(list(enumerate(texts)))]}
+
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    assert encode_in_batches(encode, texts, max_batch_size=2) == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert requests == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+
+
+def test_no_texts_send_no_request():
+    assert encode_in_batches(lambda texts: 1 / 0, [], max_batch_size=16) == []
@@ -0,0 +1,80 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import openai
+import pytest
+
+from core.openairouter import OpenAIEndpoint, OpenAIRouter
+
+
+@pytest.fixture
+def router() -> OpenAIRouter:
+    return OpenAIRouter("chat", [OpenAIEndpoint("east", "key", "gpt-4"),
+                                 OpenAIEndpoint("west", "key", "gpt-4")], "2023-06-01-preview")
+
+
+def served_by(call: dict) -> str:
+    return call["api_base"]
+
+
+def metrics_by_endpoint(router: OpenAIRouter) -> dict:
+    return {metrics["endpoint"]: metrics for metrics in router.get_metrics()}
+
+
+@pytest.mark.parametrize("error", [
+    openai.error.RateLimitError("throttled"),
+    openai.error.ServiceUnavailableError("unavailable"),
+    openai.error.APIError("server error", http_status=500),
+    openai.error.APIConnectionError("connection reset"),
+])
+def test_throttled_or_failed_call_fails_over(router, openai_service, error):
+    openai_service.responses = [error, "answer"]
+    completion, endpoint = router.create(model="gpt-4", messages=[])
+    assert completion.choices[0].message.content == "answer"
+    failed, served = openai_service.calls
+    assert served_by(failed) != served_by(served) == endpoint.api_base
+    failed_endpoint = next(e for e in router.endpoints if e.api_base == served_by(failed))
+    metrics = metrics_by_endpoint(router)
+    assert not metrics[failed_endpoint.name]["healthy"]
+    assert metrics[endpoint.name]["healthy"]
+
+
+def test_retry_after_sets_the_cooldown(router, openai_service):
+    openai_service.responses = [openai.error.RateLimitError("throttled", headers={"Retry-After": "30"})]
+    router.create(model="gpt-4", messages=[])
+    throttled = [m for m in router.get_metrics() if not m["healthy"]][0]
+    assert throttled["throttled"] == 1
+    assert 25 < throttled["cooldown_seconds"] <= 30
+
+
+def test_cooling_endpoint_is_tried_last(router, openai_service):
+    openai_service.responses = [openai.error.ServiceUnavailableError("unavailable")]
+    router.create(model="gpt-4", messages=[])
+    failed_base = served_by(openai_service.calls[0])
+    for _ in range(5):
+        router.create(model="gpt-4", messages=[])
+    assert failed_base not in [served_by(call) for call in openai_service.calls[1:]]
+
+
+@pytest.mark.parametrize("error", [
+    openai.error.Timeout("timed out"),
+    openai.error.InvalidRequestError("bad request", param=None),
+])
+def test_timeout_and_request_errors_are_not_retried(router, openai_service, error):
+    openai_service.responses = [error]
+    with pytest.raises(type(error)):
+        router.create(model="gpt-4", messages=[])
+    assert len(openai_service.calls) == 1
+
+
+def test_last_error_is_raised_when_every_endpoint_fails(router, openai_service):
+    openai_service.responses = [openai.error.RateLimitError("throttled"),
+                                openai.error.ServiceUnavailableError("unavailable")]
+    with pytest.raises(openai.error.ServiceUnavailableError):
+        router.create(model="gpt-4", messages=[])
+    assert all(not m["healthy"] for m in router.get_metrics())
+
+
+def test_router_needs_an_endpoint():
+    with pytest.raises(ValueError):
+        OpenAIRouter("chat", [], "2023-06-01-preview")
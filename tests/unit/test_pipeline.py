@@ -0,0 +1,101 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import threading
+
+import pytest
+
+from index_writer import IndexingError
+from pipeline import DocumentJob, EmbeddingPipeline
+
+
+def chunks(prefix: str, count: int) -> list:
+    return [{"id": f"{prefix}-{i}"} for i in range(count)]
+
+
+class Recorder:
+    """Embed and index functions that record their calls. Embedding waits for the gate, so
+    items queued meanwhile are collected into one batch"""
+    def __init__(self, bad_embed: str = None, index_errors: dict = None):
+        self.bad_embed = bad_embed
+        self.index_errors = index_errors or {}
+        self.gate = threading.Event()
+        self.embedding = threading.Event()
+        self.embed_calls = []
+        self.index_calls = []
+
+    def embed(self, model, batch):
+        self.embedding.set()
+        self.gate.wait()
+        self.embed_calls.append([chunk["id"] for chunk in batch])
+        if any(chunk["id"].startswith(self.bad_embed or "\0") for chunk in batch):
+            raise RuntimeError("embedding failed")
+        for chunk in batch:
+            chunk["embedded"] = model
+
+    def index(self, batch):
+        self.index_calls.append([chunk["id"] for chunk in batch])
+        return {key: error for key, error in self.index_errors.items()
+                if key in {chunk["id"] for chunk in batch}}
+
+
+def submit(pipeline: EmbeddingPipeline, name: str, batches: list) -> DocumentJob:
+    job = DocumentJob(name, "model")
+    for batch in batches:
+        pipeline.submit(job, batch)
+    job.close()
+    return job
+
+
+def test_document_completes_once_every_batch_is_indexed():
+    recorder = Recorder()
+    recorder.gate.set()
+    pipeline = EmbeddingPipeline(recorder.embed, recorder.index, embed_batch_size=4)
+    job = submit(pipeline, "a", [chunks("a", 3), chunks("b", 3)])
+    job.wait()
+    assert job.indexed == 6
+    assert sorted(chunk for call in recorder.index_calls for chunk in call) == \
+        sorted(["a-0", "a-1", "a-2", "b-0", "b-1", "b-2"])
+
+
+def test_failed_mixed_batch_is_retried_per_document():
+    recorder = Recorder(bad_embed="bad")
+    pipeline = EmbeddingPipeline(recorder.embed, recorder.index, embed_batch_size=32)
+    # Holds the only embed worker while the other documents queue up behind it
+    first = submit(pipeline, "first", [chunks("first", 1)])
+    recorder.embedding.wait()
+    good = submit(pipeline, "good", [chunks("good", 2)])
+    bad = submit(pipeline, "bad", [chunks("bad", 2)])
+    recorder.gate.set()
+
+    first.wait()
+    good.wait()
+    with pytest.raises(RuntimeError):
+        bad.wait()
+    assert good.indexed == 2
+    assert recorder.embed_calls[1:] == [["good-0", "good-1", "bad-0", "bad-1"],
+                                        ["good-0", "good-1"],
+                                        ["bad-0", "bad-1"]]
+    assert pipeline.get_metrics()["embed"]["failed_calls"] == 2
+
+
+def test_index_errors_fail_only_their_own_document():
+    recorder = Recorder(index_errors={"bad-1": "400 invalid"})
+    pipeline = EmbeddingPipeline(recorder.embed, recorder.index, index_workers=1)
+    good = submit(pipeline, "good", [chunks("good", 2)])
+    bad = submit(pipeline, "bad", [chunks("bad", 2)])
+    recorder.gate.set()
+
+    good.wait()
+    with pytest.raises(IndexingError) as error:
+        bad.wait()
+    assert error.value.failed == {"bad-1": "400 invalid"}
+    assert good.indexed == 2
+    assert bad.indexed == 1
+
+
+def test_empty_document_completes_immediately():
+    job = DocumentJob("empty", "model")
+    job.close()
+    job.wait()
+    assert job.indexed == 0
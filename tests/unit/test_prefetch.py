@@ -0,0 +1,71 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import threading
+
+from core.prefetch import FollowupPrefetcher
+from core.usagemetrics import TokenUsageTracker
+
+
+def test_key_ignores_answers_and_prompt_overrides():
+    history = [{"user": "First question", "bot": "An answer"}, {"user": "Follow-up"}]
+    key = FollowupPrefetcher.make_key(history, {"top": 3, "user_persona": "analyst"})
+    reformatted = [{"user": "First  question", "bot": "The answer, reformatted"}, {"user": "Follow-up"}]
+    assert key == FollowupPrefetcher.make_key(reformatted, {"top": 3, "user_persona": "tester"})
+    assert key != FollowupPrefetcher.make_key(history, {"top": 5})
+
+
+def test_take_returns_prefetched_result_once():
+    prefetcher = FollowupPrefetcher(enabled=True)
+    prefetcher.submit("key", lambda: {"results": [1]})
+    assert prefetcher.take("key", timeout=5) == {"results": [1]}
+    assert prefetcher.take("key", timeout=5) is None
+    assert prefetcher.get_metrics()["hits"] == 1
+
+
+def test_take_waits_for_a_running_prefetch():
+    prefetcher = FollowupPrefetcher(enabled=True)
+    release = threading.Event()
+    prefetcher.submit("key", lambda: release.wait() and {"results": [1]})
+    threading.Timer(0.05, release.set).start()
+    assert prefetcher.take("key", timeout=5) == {"results": [1]}
+
+
+def test_failed_or_slow_prefetch_is_not_used():
+    prefetcher = FollowupPrefetcher(enabled=True)
+
+    def fail():
+        raise RuntimeError("failed")
+
+    prefetcher.submit("failed", fail)
+    assert prefetcher.take("failed", timeout=5) is None
+    release = threading.Event()
+    prefetcher.submit("slow", release.wait)
+    assert prefetcher.take("slow", timeout=0.01) is None
+    release.set()
+    assert prefetcher.get_metrics()["failures"] == 1
+
+
+def test_expired_prefetch_is_not_used():
+    prefetcher = FollowupPrefetcher(enabled=True, ttl_seconds=0)
+    prefetcher.submit("key", lambda: {"results": [1]})
+    assert prefetcher.take("key", timeout=5) is None
+
+
+def test_disabled_prefetches_nothing():
+    prefetcher = FollowupPrefetcher(enabled=False)
+    prefetcher.submit("key", lambda: {"results": [1]})
+    assert prefetcher.take("key", timeout=5) is None
+
+
+def test_prefetch_usage_is_recorded_under_its_own_approach(wait_until):
+    tracker = TokenUsageTracker()
+    prefetcher = FollowupPrefetcher(enabled=True, usage_tracker=tracker)
+    usage = {"rewrite": {"model": "gpt-35-turbo", "prompt_tokens": 100, "completion_tokens": 10}}
+    prefetcher.submit("key", lambda: {"results": [1], "usage": usage}, "analyst", 2048)
+    # Recorded once the prefetch completes, whether or not the follow-up is asked
+    wait_until(lambda: tracker.get_metrics()["5m"])
+    [row] = tracker.get_metrics()["5m"]
+    assert (row["approach"], row["step"], row["persona"], row["response_length"]) == \
+        ("followup_prefetch", "rewrite", "analyst", 2048)
+    assert row["prompt_tokens"] == 100
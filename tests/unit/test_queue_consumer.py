@@ -0,0 +1,124 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import threading
+import time
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from queue_consumer import QueueConsumer
+
+
+class FakeMessage:
+    def __init__(self, message_id: str, dequeue_count: int = 1):
+        self.id = message_id
+        self.content = f"content of {message_id}"
+        self.dequeue_count = dequeue_count
+        self.pop_receipt = f"{message_id}-receipt-0"
+
+
+class FakeReceipt:
+    def __init__(self, pop_receipt: str):
+        self.pop_receipt = pop_receipt
+
+
+class FakeQueueClient:
+    """Hands out the given messages once. Every lease extension issues a new pop receipt,
+    which deletes and later extensions must use"""
+    def __init__(self, messages: list = (), exists: bool = True):
+        self.messages = list(messages)
+        self.exists = exists
+        self.receipts = {message.id: message.pop_receipt for message in self.messages}
+        self.deleted = []
+        self.extended = []
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def receive_messages(self, messages_per_page, max_messages, visibility_timeout):
+        with self.lock:
+            received, self.messages = self.messages[:max_messages], self.messages[max_messages:]
+            return received
+
+    def update_message(self, message_id, pop_receipt, visibility_timeout):
+        with self.lock:
+            assert pop_receipt == self.receipts[message_id]
+            self.extended.append(message_id)
+            self.receipts[message_id] = f"{message_id}-receipt-{self.extended.count(message_id)}"
+            return FakeReceipt(self.receipts[message_id])
+
+    def delete_message(self, message_id, pop_receipt):
+        with self.lock:
+            assert pop_receipt == self.receipts[message_id]
+            self.deleted.append(message_id)
+
+    def send_message(self, content):
+        if not self.exists:
+            raise ResourceNotFoundError("queue not found")
+        self.sent.append(content)
+
+    def create_queue(self):
+        self.exists = True
+
+
+def start(consumer: QueueConsumer) -> QueueConsumer:
+    threading.Thread(target=consumer.run, daemon=True).start()
+    return consumer
+
+
+def test_message_is_deleted_after_it_is_handled(wait_until):
+    queue_client = FakeQueueClient([FakeMessage("a"), FakeMessage("b")])
+    handled = []
+    consumer = start(QueueConsumer(queue_client, lambda message: handled.append(message.id),
+                                   min_idle_seconds=0.01, max_idle_seconds=0.01))
+    wait_until(lambda: sorted(queue_client.deleted) == ["a", "b"])
+    assert sorted(handled) == ["a", "b"]
+    assert consumer.get_metrics()["succeeded"] == 2
+
+
+def test_failed_message_is_left_to_reappear(wait_until):
+    queue_client = FakeQueueClient([FakeMessage("a")])
+
+    def fail(message):
+        raise RuntimeError("failed")
+
+    consumer = start(QueueConsumer(queue_client, fail, min_idle_seconds=0.01, max_idle_seconds=0.01))
+    wait_until(lambda: consumer.get_metrics()["failed"] == 1)
+    assert queue_client.deleted == []
+    assert consumer.get_metrics()["in_flight"] == 0
+
+
+def test_lease_is_extended_while_the_handler_runs(wait_until):
+    queue_client = FakeQueueClient([FakeMessage("a")])
+    release = threading.Event()
+    start(QueueConsumer(queue_client, lambda message: release.wait(), visibility_timeout=0.03,
+                        min_idle_seconds=0.01, max_idle_seconds=0.01))
+    wait_until(lambda: queue_client.extended.count("a") >= 2)
+    assert queue_client.deleted == []
+    release.set()
+    # Deleted with the pop receipt of the latest extension
+    wait_until(lambda: queue_client.deleted == ["a"])
+
+
+def test_message_received_too_often_goes_to_the_poison_queue(wait_until):
+    queue_client = FakeQueueClient([FakeMessage("a", dequeue_count=6)])
+    poison_queue_client = FakeQueueClient(exists=False)
+    handled = []
+    consumer = start(QueueConsumer(queue_client, handled.append, max_dequeue_count=5,
+                                   poison_queue_client=poison_queue_client,
+                                   min_idle_seconds=0.01, max_idle_seconds=0.01))
+    wait_until(lambda: queue_client.deleted == ["a"])
+    assert handled == []
+    assert poison_queue_client.sent == ["content of a"]
+    assert consumer.get_metrics()["poisoned"] == 1
+
+
+def test_no_more_messages_are_received_than_slots_are_free(wait_until):
+    queue_client = FakeQueueClient([FakeMessage(str(i)) for i in range(5)])
+    release = threading.Event()
+    consumer = start(QueueConsumer(queue_client, lambda message: release.wait(), concurrency=2,
+                                   min_idle_seconds=0.01, max_idle_seconds=0.01))
+    wait_until(lambda: consumer.get_metrics()["received"] == 2)
+    time.sleep(0.05)
+    assert consumer.get_metrics()["in_flight"] == 2
+    release.set()
+    wait_until(lambda: len(queue_client.deleted) == 5)
@@ -0,0 +1,63 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from core.searchcache import SearchResultCache
+
+
+def test_key_depends_on_text_vector_and_arguments():
+    key = SearchResultCache.make_key("query", [0.1, 0.2], top=3, filter=None)
+    assert key == SearchResultCache.make_key("query", [0.1, 0.2], filter=None, top=3)
+    assert key != SearchResultCache.make_key("other", [0.1, 0.2], top=3, filter=None)
+    assert key != SearchResultCache.make_key("query", [0.1, 0.3], top=3, filter=None)
+    assert key != SearchResultCache.make_key("query", [0.1, 0.2], top=5, filter=None)
+
+
+def test_get_returns_what_was_put():
+    cache = SearchResultCache(ttl_seconds=60, max_entries=10)
+    assert cache.get("key") is None
+    cache.put("key", [{"id": "a"}])
+    assert cache.get("key") == [{"id": "a"}]
+
+
+def test_entries_expire():
+    cache = SearchResultCache(ttl_seconds=60, max_entries=10)
+    cache.put("key", [])
+    # Expired long ago
+    cache._entries["key"] = (0.0, [])
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SearchResultCache(ttl_seconds=60, max_entries=2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    cache.get("a")
+    cache.put("c", [3])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1]
+
+
+def test_disabled_cache_stores_nothing():
+    cache = SearchResultCache(ttl_seconds=0, max_entries=10)
+    cache.put("key", [1])
+    assert cache.get("key") is None
+
+
+def test_moved_watermark_drops_every_entry(watermark):
+    cache = SearchResultCache(ttl_seconds=60, max_entries=10, watermark=watermark,
+                              watermark_refresh_seconds=0)
+    cache.get("key")
+    cache.put("key", [1])
+    assert cache.get("key") == [1]
+    watermark.etag = "2"
+    assert cache.get("key") is None
+
+
+def test_watermark_is_read_at_most_every_refresh_interval(watermark):
+    cache = SearchResultCache(ttl_seconds=60, max_entries=10, watermark=watermark,
+                              watermark_refresh_seconds=60)
+    cache.get("key")
+    cache.put("key", [1])
+    watermark.etag = "2"
+    assert cache.get("key") == [1]
+    assert watermark.reads == 1
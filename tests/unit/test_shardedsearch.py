@@ -0,0 +1,84 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import pytest
+
+from core import shardedsearch
+from core.shardedsearch import ShardedSearchClient
+from shared_code.index_shards import IndexShardRouter
+
+
+@pytest.fixture
+def client(monkeypatch, search_service):
+    monkeypatch.setattr(shardedsearch, "SearchClient", search_service.client)
+    return ShardedSearchClient("https://search", None, IndexShardRouter("index", 2, "hash"))
+
+
+def hit(doc_id, score):
+    return {"id": doc_id, "@search.score": score}
+
+
+def test_merge_orders_by_rank_then_score():
+    merged = ShardedSearchClient.merge([
+        [hit("a0", 1.0), hit("a1", 0.9), hit("a2", 0.8)],
+        [hit("b0", 30.0), hit("b1", 20.0)],
+    ], top=4)
+    # Equal ranks across shards tie on RRF score, the raw score breaks the tie
+    assert [doc["id"] for doc in merged] == ["b0", "a0", "b1", "a1"]
+    assert merged[0]["@search.rrf_score"] == pytest.approx(1 / 61)
+
+
+def test_search_merges_every_shard(client, search_service):
+    search_service.hits = {"index-0": [hit("a", 1.0)], "index-1": [hit("b", 2.0)]}
+    results = client.search("query", top=2)
+    assert [doc["id"] for doc in results] == ["b", "a"]
+    assert results.failed_shards == []
+
+
+def test_search_reports_failed_shards(client, search_service):
+    search_service.hits = {"index-0": [hit("a", 1.0)], "index-1": RuntimeError("down")}
+    results = client.search("query", top=2)
+    assert [doc["id"] for doc in results] == ["a"]
+    assert results.failed_shards == ["index-1"]
+
+
+def test_search_raises_when_every_shard_fails(client, search_service):
+    search_service.hits = {"index-0": RuntimeError("down"), "index-1": RuntimeError("down")}
+    with pytest.raises(RuntimeError):
+        client.search("query", top=2)
+
+
+def test_single_shard_is_searched_directly(monkeypatch, search_service):
+    monkeypatch.setattr(shardedsearch, "SearchClient", search_service.client)
+    client = ShardedSearchClient("https://search", None, IndexShardRouter("index"))
+    search_service.hits = {"index": [hit("a", 1.0)]}
+    assert [doc["id"] for doc in client.search("query", top=3)] == ["a"]
+    assert search_service.searches == [("index", "query", {"top": 3})]
+
+
+def test_get_documents_looks_keys_up_on_every_shard(client, search_service):
+    search_service.hits = {"index-0": [hit("a", 1.0)], "index-1": [hit("b", 1.0)]}
+    docs = client.get_documents("id", ["a", "b"], select=["id"])
+    assert sorted(docs) == ["a", "b"]
+    assert docs.failed_shards == []
+    assert search_service.searches[0][2]["filter"] == "search.in(id, 'a,b', ',')"
+
+
+def test_get_documents_skips_failed_shards(client, search_service):
+    search_service.hits = {"index-0": [hit("a", 1.0)], "index-1": RuntimeError("down")}
+    docs = client.get_documents("id", ["a", "b"])
+    assert list(docs) == ["a"]
+    assert docs.failed_shards == ["index-1"]
+
+
+def test_get_documents_raises_when_every_shard_fails(client, search_service):
+    search_service.hits = {"index-0": RuntimeError("down"), "index-1": RuntimeError("down")}
+    with pytest.raises(RuntimeError):
+        client.get_documents("id", ["a"])
+
+
+def test_get_documents_quotes_keys(client, search_service):
+    client.get_documents("id", ["it's"])
+    assert search_service.searches[0][2]["filter"] == "search.in(id, 'it''s', ',')"
+    with pytest.raises(ValueError):
+        client.get_documents("id", ["a,b"])
@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from core.singleflight import SingleFlight
+
+
+def run_concurrently(flight: SingleFlight, work, wait_until, callers: int = 4):
+    """Starts callers that all find the first caller's work in flight"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def leader_work():
+        started.set()
+        release.wait()
+        return work()
+
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        futures = [executor.submit(flight.do, "key", leader_work)]
+        started.wait()
+        futures += [executor.submit(flight.do, "key", work) for _ in range(callers - 1)]
+        wait_until(lambda: flight.get_metrics()["coalesced"] == callers - 1)
+        release.set()
+    return futures
+
+
+def test_concurrent_callers_share_one_result(wait_until):
+    flight = SingleFlight()
+    calls = []
+    futures = run_concurrently(flight, lambda: calls.append(1) or "answer", wait_until)
+    results = [future.result() for future in futures]
+    assert results[0] == ("answer", False)
+    assert results[1:] == [("answer", True)] * 3
+    assert len(calls) == 1
+    assert flight.get_metrics()["in_flight"] == 0
+
+
+def test_error_is_raised_to_every_waiter(wait_until):
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("failed")
+
+    futures = run_concurrently(flight, fail, wait_until)
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result()
+    # The failed flight is gone, the next caller runs again
+    assert flight.do("key", lambda: "retried") == ("retried", False)
+
+
+def test_disabled_runs_every_call():
+    flight = SingleFlight(enabled=False)
+    assert flight.do("key", lambda: "answer") == ("answer", False)
+    assert flight.get_metrics()["executed"] == 0
+
+
+def test_key_ignores_whitespace_and_filter_order():
+    key = SingleFlight.make_key("chat", [{"user": "What  is it?"}],
+                                {"selected_folders": "a,b", "selected_tags": ""})
+    assert key == SingleFlight.make_key("chat", [{"user": " What is it? "}],
+                                        {"selected_folders": "b, a", "selected_tags": ""})
+    assert key != SingleFlight.make_key("chat", [{"user": "What is that?"}],
+                                        {"selected_folders": "a,b", "selected_tags": ""})
@@ -0,0 +1,64 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import pytest
+
+from core import usagemetrics
+from core.usagemetrics import TokenUsageTracker
+
+
+def usage(model: str, prompt_tokens: int, completion_tokens: int, latency_ms: float = 100) -> dict:
+    return {"model": model, "deployment": model, "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens, "latency_ms": latency_ms}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(usagemetrics.time, "time", lambda: now[0])
+    return now
+
+
+def test_requests_are_aggregated_by_step_model_and_persona(clock):
+    tracker = TokenUsageTracker()
+    tracker.record("rrr", "analyst", 1024, {"rewrite": usage("gpt-35-turbo", 200, 10, 50),
+                                            "answer": usage("gpt-4", 1000, 100, 900)})
+    tracker.record("rrr", "analyst", 1024, {"answer": usage("gpt-4", 2000, 300, 1100)})
+    tracker.record("rrr", "tester", 1024, {"answer": usage("gpt-4", 500, 50)})
+
+    rows = tracker.get_metrics()["5m"]
+    # Largest token spend first
+    assert [(row["step"], row["persona"]) for row in rows] == [("answer", "analyst"), ("answer", "tester"),
+                                                               ("rewrite", "analyst")]
+    answer = rows[0]
+    assert answer["calls"] == 2
+    assert answer["prompt_tokens"] == 3000
+    assert answer["completion_tokens"] == 400
+    assert answer["avg_prompt_tokens"] == 1500
+    assert answer["avg_latency_ms"] == 1000
+
+
+def test_cost_uses_the_price_per_thousand_tokens(clock):
+    tracker = TokenUsageTracker(prices={"gpt-4": {"prompt": 0.03, "completion": 0.06}})
+    tracker.record("rrr", "", 1024, {"answer": usage("gpt-4", 1000, 500),
+                                     "rewrite": usage("unpriced", 1000, 500)})
+    costs = {row["model"]: row["cost"] for row in tracker.get_metrics()["5m"]}
+    assert costs == {"gpt-4": pytest.approx(0.06), "unpriced": 0.0}
+
+
+def test_windows_only_count_recent_minutes(clock):
+    tracker = TokenUsageTracker(windows={"5m": 5, "1h": 60})
+    tracker.record("rrr", "", 1024, {"answer": usage("gpt-4", 100, 10)})
+    clock[0] += 10 * 60
+    tracker.record("rrr", "", 1024, {"answer": usage("gpt-4", 100, 10)})
+    metrics = tracker.get_metrics()
+    assert metrics["5m"][0]["calls"] == 1
+    assert metrics["1h"][0]["calls"] == 2
+
+
+def test_buckets_older_than_the_longest_window_are_dropped(clock):
+    tracker = TokenUsageTracker(windows={"5m": 5})
+    tracker.record("rrr", "", 1024, {"answer": usage("gpt-4", 100, 10)})
+    clock[0] += 10 * 60
+    tracker.record("rrr", "", 1024, {"answer": usage("gpt-4", 100, 10)})
+    assert len(tracker._buckets) == 1
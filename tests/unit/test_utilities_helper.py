@@ -0,0 +1,22 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from shared_code.utilities_helper import UtilitiesHelper
+
+utilities_helper = UtilitiesHelper("account", "https://account.blob.core.windows.net", "key")
+
+
+def test_folder_hierarchy_lists_every_ancestor():
+    assert utilities_helper.get_folder_hierarchy("finance/2023/q1/") == ["finance", "finance/2023",
+                                                                         "finance/2023/q1"]
+
+
+def test_folder_hierarchy_of_a_top_level_file_is_empty():
+    _, _, directory = utilities_helper.get_filename_and_extension("upload/file.pdf")
+    assert utilities_helper.get_folder_hierarchy(directory) == []
+
+
+def test_folder_hierarchy_matches_the_indexed_folder():
+    _, _, directory = utilities_helper.get_filename_and_extension("upload/finance/2023/report.pdf")
+    # The indexed folder is the directory without its trailing slash
+    assert utilities_helper.get_folder_hierarchy(directory)[-1] == directory[:-1]
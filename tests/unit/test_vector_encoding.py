@@ -0,0 +1,34 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import base64
+import struct
+
+import pytest
+
+from vector_encoding import encode_vector_base64, pack_vector, unpack_vector
+
+
+def test_float32_round_trip_is_exact_for_float32_values():
+    vector = [0.5, -1.25, 3.0]
+    data = pack_vector(vector)
+    assert len(data) == 12
+    assert data == struct.pack("<3f", *vector)
+    assert unpack_vector(data) == vector
+
+
+def test_float16_halves_the_size():
+    vector = [0.1, -0.2, 0.3, 1.0]
+    data = pack_vector(vector, "float16")
+    assert len(data) == 8
+    assert unpack_vector(data, "float16") == pytest.approx(vector, abs=1e-3)
+
+
+def test_base64_encodes_the_packed_vector():
+    vector = [1.0, 2.0]
+    assert base64.b64decode(encode_vector_base64(vector)) == pack_vector(vector)
+
+
+def test_unknown_dtype_is_rejected():
+    with pytest.raises(KeyError):
+        pack_vector([1.0], "float64")
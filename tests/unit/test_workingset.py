@@ -0,0 +1,88 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from core.workingset import ConversationWorkingSet
+
+
+def test_key_is_every_question_and_the_filter():
+    overrides = {"selected_folders": "finance", "selected_tags": ""}
+    key = ConversationWorkingSet.make_key([{"user": "What is it?"}, {"user": "And then?"}], overrides)
+    assert key == ConversationWorkingSet.make_key([{"user": "What  is it? ", "bot": "It"},
+                                                   {"user": "And then?"}], overrides)
+    assert key != ConversationWorkingSet.make_key([{"user": "What is it?"}, {"user": "And now?"}],
+                                                  overrides)
+    assert key != ConversationWorkingSet.make_key([{"user": "What is it?"}, {"user": "And then?"}],
+                                                  {"selected_folders": "legal", "selected_tags": ""})
+
+
+def test_conversation_id_keeps_the_key_across_turns():
+    overrides = {"conversation_id": "c1", "selected_folders": "finance"}
+    key = ConversationWorkingSet.make_key([{"user": "What is it?"}], overrides)
+    assert key == ConversationWorkingSet.make_key([{"user": "What is it?"}, {"user": "And then?"}],
+                                                  overrides)
+    assert key != ConversationWorkingSet.make_key([{"user": "What is it?"}],
+                                                  {"conversation_id": "c2", "selected_folders": "finance"})
+    assert key != ConversationWorkingSet.make_key([{"user": "What is it?"}],
+                                                  {"conversation_id": "c1", "selected_folders": "legal"})
+
+
+def test_advance_carries_the_conversation_to_its_next_key():
+    working_set = ConversationWorkingSet()
+    working_set.put("turn-1", {"a": "content a"})
+    working_set.advance("turn-1", "turn-2")
+    assert working_set.get("turn-2", ["a"]) == {"a": "content a"}
+    assert working_set.get("turn-1", ["a"]) == {}
+    working_set.advance("turn-2", "turn-2")
+    assert working_set.get("turn-2", ["a"]) == {"a": "content a"}
+
+
+def test_get_returns_held_chunks_only():
+    working_set = ConversationWorkingSet()
+    working_set.put("key", {"a": "content a"})
+    assert working_set.get("key", ["a", "b"]) == {"a": "content a"}
+    assert working_set.get("other", ["a"]) == {}
+
+
+def test_reuse_is_expected_once_a_turn_returns_held_chunks():
+    working_set = ConversationWorkingSet(min_reuse=0.5)
+    assert not working_set.expects_reuse("key")
+    working_set.put_hits("key", {"a": "content a", "b": "content b"})
+    # Nothing was held before the first turn
+    assert not working_set.expects_reuse("key")
+    working_set.put_hits("key", {"a": "content a", "c": "content c"})
+    assert working_set.expects_reuse("key")
+
+
+def test_reuse_follows_the_last_ranked_turn():
+    working_set = ConversationWorkingSet(min_reuse=0.5)
+    working_set.put_hits("key", {"a": "content a"})
+    working_set.put_hits("key", {"a": "content a"})
+    assert working_set.expects_reuse("key")
+    working_set.get("key", ["a", "x", "y"])
+    assert not working_set.expects_reuse("key")
+
+
+def test_moved_watermark_drops_every_conversation(watermark):
+    working_set = ConversationWorkingSet(watermark=watermark, watermark_refresh_seconds=0)
+    working_set.put_hits("key", {"a": "old content"})
+    working_set.put_hits("key", {"a": "old content"})
+    assert working_set.get("key", ["a"]) == {"a": "old content"}
+    watermark.etag = "2"
+    assert not working_set.expects_reuse("key")
+    assert working_set.get("key", ["a"]) == {}
+
+
+def test_oldest_chunks_and_conversations_are_dropped():
+    working_set = ConversationWorkingSet(max_conversations=1, max_chunks=2)
+    working_set.put("key", {"a": "1", "b": "2", "c": "3"})
+    assert working_set.get("key", ["a", "b", "c"]) == {"b": "2", "c": "3"}
+    working_set.put("other", {"d": "4"})
+    assert working_set.get("key", ["b"]) == {}
+
+
+def test_disabled_holds_nothing():
+    working_set = ConversationWorkingSet(ttl_seconds=0)
+    working_set.put_hits("key", {"a": "1"})
+    working_set.put_hits("key", {"a": "1"})
+    assert not working_set.expects_reuse("key")
+    assert working_set.get("key", ["a"]) == {}